@@ -0,0 +1,429 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Enable relative module lookups
+# (protect against symlinks using realpath())
+import os, sys
+root = os.path.realpath(os.path.dirname(__file__) + "/..")
+if root not in sys.path:
+    sys.path.insert(0, root)
+
+# Import required modules
+import re
+import glob
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from retainium.config import load_config
+from retainium.diagnostics import Diagnostics
+from retainium.embeddings import EmbeddingHandler
+from retainium.import_knowledge import import_inputs
+from retainium.knowledge import KnowledgeDB
+from retainium.llm import LLMHandler, LLMStream, ANSWER_MARKER, ANSWER_TERMINATOR, TAGS_INSTRUCTION
+from retainium.query_knowledge import retrieve, answer
+from retainium.text_utils import TextHandler, chunk_text, extract_text_from_pdf
+from retainium.tracing import Tracer
+
+# Format of the results file (bumped on incompatible changes)
+RESULTS_VERSION = 1
+
+# Inputs bundled with the repository, added to the synthetic corpus
+EXAMPLE_INPUTS = os.path.join(root, "examples", "input_files", "*")
+
+# Where results are written by default
+DEFAULT_RESULTS_DIRECTORY = os.path.join(root, "data", "benchmarks")
+
+# Retrieval modes timed at each corpus size
+QUERY_MODES = ("vector", "keyword", "hybrid")
+
+# Spread of the noise added to reused embeddings, so that corpora larger than
+# the embedded chunks still hold distinct vectors
+EMBEDDING_NOISE = 0.02
+
+# Number of words in the answers of the stub LLM, and of its tags
+STUB_ANSWER_WORDS = 40
+STUB_TAGS = 5
+
+class StubLLMHandler(LLMHandler):
+    """Stands in for the configured LLM without any model: answers with the
+    first words of the text of the prompt (its part after the instruction),
+    or its first distinct longer words when asked for tags, output like
+    llama-cli's, so that the same prompt always gets the same answer."""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.backend = "stub"
+
+    def generate_stream(self, prompt: str, max_tokens: int = None, json_schema: dict = None) -> LLMStream:
+        return LLMStream(self._stream_via_stub(prompt, max_tokens or -1, json_schema))
+
+    def _stream_via_stub(self, prompt: str, max_tokens: int = -1, json_schema: dict = None):
+        body = prompt.rsplit(ANSWER_MARKER, 1)[0].split("\n\n", 1)[-1]
+        words = [word for word in re.findall(r"[\w'-]+", body)
+                 if word not in ("Text", "Context", "Query")]
+        limit = STUB_ANSWER_WORDS if max_tokens < 0 else min(STUB_ANSWER_WORDS, max_tokens)
+        summary = " ".join(words[:limit])
+        tags = list(dict.fromkeys(word.lower() for word in words if len(word) > 3))[:STUB_TAGS]
+
+        if json_schema is not None:
+            response = json.dumps({"summary": summary, "tags": tags})
+        elif prompt.startswith(TAGS_INSTRUCTION):
+            response = " ".join(tags)
+        else:
+            response = summary
+        yield prompt
+        for word in (" " + response).split(" ")[1:]:
+            yield " " + word
+        yield " " + ANSWER_TERMINATOR
+
+# A deterministic vocabulary of pronounceable words
+def make_vocabulary(rng, size: int):
+    onsets = ["b", "c", "d", "f", "g", "l", "m", "n", "p", "r", "s", "t", "v", "st", "tr", "pl"]
+    vowels = ["a", "e", "i", "o", "u", "ai", "ou"]
+    codas = ["", "n", "r", "s", "t", "l", "x"]
+    words = set()
+    while len(words) < size:
+        syllables = rng.randint(1, 3)
+        words.add("".join(rng.choice(onsets) + rng.choice(vowels) + rng.choice(codas)
+                          for _ in range(syllables)))
+    return sorted(words)
+
+# Generate "documents" synthetic documents of about "words" words each:
+# paragraphs of sentences whose words follow a Zipf-like distribution, like
+# natural text (the same seed always gives the same corpus)
+def make_corpus(documents: int, words: int, seed: int):
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng, 5000)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    corpus = []
+    for _ in range(documents):
+        paragraphs = []
+        remaining = words
+        while remaining > 0:
+            sentences = []
+            for _ in range(rng.randint(3, 6)):
+                length = rng.randint(8, 20)
+                sentence = rng.choices(vocabulary, weights, k=length)
+                sentences.append(" ".join(sentence).capitalize() + ".")
+                remaining -= length
+            paragraphs.append(" ".join(sentences))
+        corpus.append("\n\n".join(paragraphs))
+    return corpus
+
+# Queries made of a few consecutive words of random chunks
+def make_queries(chunks, count: int, seed: int):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        words = rng.choice(chunks).split()
+        start = rng.randrange(max(len(words) - 6, 1))
+        queries.append(" ".join(words[start:start + 6]))
+    return queries
+
+# Megabytes of UTF-8 text
+def megabytes(texts) -> float:
+    return sum(len(text.encode("utf-8")) for text in texts) / 1e6
+
+# The commit being benchmarked, if known
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Time PDF text extraction over the example PDFs
+def bench_extraction(paths):
+    texts = []
+    start = time.perf_counter()
+    try:
+        for path in paths:
+            texts.append(extract_text_from_pdf(path))
+    except ImportError as e:
+        Diagnostics.warning(f"skipping PDF extraction: {e}")
+        return {"skipped": str(e)}, []
+    elapsed = time.perf_counter() - start
+    return {
+        "files": len(paths),
+        "megabytes": megabytes(texts),
+        "seconds": elapsed,
+        "megabytes_per_second": megabytes(texts) / max(elapsed, 1e-9),
+    }, texts
+
+# Time chunking of the texts
+def bench_chunking(texts):
+    start = time.perf_counter()
+    chunks = [chunk for text in texts for chunk in chunk_text(text)]
+    elapsed = time.perf_counter() - start
+    return {
+        "megabytes": megabytes(texts),
+        "chunks": len(chunks),
+        "seconds": elapsed,
+        "megabytes_per_second": megabytes(texts) / max(elapsed, 1e-9),
+    }, chunks
+
+# Time the load of the embedding model and the embedding of the chunks
+def bench_embedding(embedding_handler, chunks):
+    start = time.perf_counter()
+    embedding_handler.embed(chunks[0])
+    load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectors = embedding_handler.embed_batch(chunks)
+    elapsed = time.perf_counter() - start
+    return {
+        "load_seconds": load,
+        "texts": len(chunks),
+        "seconds": elapsed,
+        "texts_per_second": len(chunks) / max(elapsed, 1e-9),
+    }, vectors
+
+# Entries for a database of "size" entries, reusing the chunks and their
+# embeddings (copies get a distinct text and a slightly perturbed vector)
+def make_entries(chunks, vectors, size: int, seed: int):
+    import numpy
+    rng = numpy.random.default_rng(seed)
+    texts, embeddings = [], []
+    for n in range(size):
+        copy, i = divmod(n, len(chunks))
+        if copy == 0:
+            texts.append(chunks[i])
+            embeddings.append(vectors[i])
+            continue
+        vector = numpy.asarray(vectors[i]) + rng.normal(0, EMBEDDING_NOISE, len(vectors[i]))
+        texts.append(f"{chunks[i]} ({copy})")
+        embeddings.append((vector / numpy.linalg.norm(vector)).tolist())
+    return texts, embeddings
+
+# Time the insertion of "size" entries into a fresh database, then the
+# latency of each retrieval mode, and of answering with the LLM
+def bench_size(config, directory: str, size: int, chunks, vectors, queries, answer_queries: int,
+               embedding_handler, llm_handler, top_k: int, seed: int):
+    knowledge_db = KnowledgeDB(directory,
+                               write_batch_size=config.getint("database", "write_batch_size", fallback=256),
+                               backend=config.get("database", "backend", fallback="chroma"),
+                               vector_dtype=config.get("database", "vector_dtype", fallback="float32"))
+    texts, embeddings = make_entries(chunks, vectors, size, seed)
+    batch = knowledge_db.write_batch_size
+    start = time.perf_counter()
+    for i in range(0, size, batch):
+        knowledge_db.add_entries(texts[i:i + batch], ["benchmark"] * len(texts[i:i + batch]),
+                                 embedding_handler, llm_handler,
+                                 tags=[[] for _ in texts[i:i + batch]], embeddings=embeddings[i:i + batch])
+    elapsed = time.perf_counter() - start
+    result = {
+        "entries": knowledge_db.count(),
+        "insert": {"seconds": elapsed, "entries_per_second": size / max(elapsed, 1e-9)},
+    }
+
+    # Time the queries as spans, along with the stages within them
+    Tracer.drain()
+    for mode in QUERY_MODES:
+        for query in queries:
+            with Tracer.span(f"query.{mode}"):
+                retrieve(query, top_k, knowledge_db, embedding_handler, mode=mode)
+    for query in queries[:answer_queries]:
+        with Tracer.span("query.answer"):
+            results = retrieve(query, top_k, knowledge_db, embedding_handler)
+            answer(query, top_k, results, knowledge_db.generation(), llm_handler)
+    result["query"] = Tracer.summary()
+    Tracer.drain()
+    return result
+
+# Time a complete import of the corpus files into a fresh database
+def bench_import(config, directory: str, paths, workers: int, embedding_handler, llm_handler):
+    knowledge_db = KnowledgeDB(directory,
+                               write_batch_size=config.getint("database", "write_batch_size", fallback=256),
+                               backend=config.get("database", "backend", fallback="chroma"),
+                               vector_dtype=config.get("database", "vector_dtype", fallback="float32"))
+    Tracer.drain()
+    start = time.perf_counter()
+    counts = import_inputs(paths, knowledge_db, embedding_handler, llm_handler, force=True, workers=workers)
+    elapsed = time.perf_counter() - start
+    result = dict(counts, seconds=elapsed, chunks_per_second=counts["chunks"] / max(elapsed, 1e-9),
+                  stages=Tracer.summary())
+    Tracer.drain()
+    return result
+
+# Flatten the numbers of the results into "path": value pairs
+def flatten(value, prefix: str = ""):
+    if isinstance(value, dict):
+        items = {}
+        for key, item in value.items():
+            items.update(flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+        return items
+    if isinstance(value, list):
+        items = {}
+        for item in value:
+            if isinstance(item, dict) and "entries" in item:
+                items.update(flatten(item, f"{prefix}[{item['entries']}]"))
+        return items
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+# Print how the timings and rates of the results compare to a previous run
+def compare(results: dict, baseline_path: str) -> None:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("settings") != results["settings"]:
+        Diagnostics.warning(f"{baseline_path} was run with different settings; the numbers may not compare")
+    baseline = flatten(baseline)
+    current = flatten(results)
+    print(f"\n{'metric (vs ' + os.path.basename(baseline_path) + ')':<56} {'before':>12} {'after':>12} {'change':>8}")
+    for name, value in current.items():
+        if name not in baseline or name.startswith(("settings", "corpus")):
+            continue
+        if not name.endswith(("seconds", "per_second", "p50_ms", "p95_ms")):
+            continue
+        before = baseline[name]
+        change = f"{(value - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{name:<56} {before:>12.3f} {value:>12.3f} {change:>8}")
+
+# Print the headline numbers of the results
+def print_results(results: dict) -> None:
+    extraction = results["extraction"]
+    if "skipped" not in extraction:
+        print(f"extraction: {extraction['megabytes_per_second']:.2f} MB/s over {extraction['files']} PDFs")
+    chunking = results["chunking"]
+    print(f"chunking:   {chunking['megabytes_per_second']:.2f} MB/s, {chunking['chunks']} chunks")
+    embedding = results["embedding"]
+    print(f"embedding:  {embedding['texts_per_second']:.1f} texts/s (model load {embedding['load_seconds']:.2f}s)")
+
+    print(f"\n{'entries':>8} {'insert/s':>10}" + "".join(f" {mode + ' p50':>12} {mode + ' p95':>12}"
+                                                      for mode in QUERY_MODES + ("answer",)))
+    for size in results["sizes"]:
+        line = f"{size['entries']:>8} {size['insert']['entries_per_second']:>10.0f}"
+        for mode in QUERY_MODES + ("answer",):
+            stage = size["query"].get(f"query.{mode}")
+            line += f" {stage['p50_ms']:>10.1f}ms {stage['p95_ms']:>10.1f}ms" if stage else f" {'-':>12} {'-':>12}"
+        print(line)
+
+    imported = results["import"]
+    print(f"\nimport:     {imported['files']} files, {imported['chunks']} chunks in {imported['seconds']:.2f}s "
+          f"({imported['chunks_per_second']:.1f} chunks/s, {imported['failed']} files failed)")
+
+# Benchmark ingest and query on synthetic corpora plus the bundled examples,
+# with a deterministic stub LLM unless asked to use the configured model
+def main():
+    parser = argparse.ArgumentParser(description="Retainium offline ingest and query benchmark")
+    parser.add_argument("--documents", type=int, default=20, help="Number of synthetic documents")
+    parser.add_argument("--words", type=int, default=2000, help="Number of words per synthetic document")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000],
+                        help="Numbers of database entries to time inserts and queries at")
+    parser.add_argument("--queries", type=int, default=50, help="Number of queries timed per mode and size")
+    parser.add_argument("--answer-queries", type=int, default=10,
+                        help="Number of queries also answered by the LLM per size")
+    parser.add_argument("--top-k", type=int, default=5, help="Number of matching entries to retrieve")
+    parser.add_argument("--workers", type=int, default=0, help="Extraction workers of the import (default: all CPUs)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic corpus and queries")
+    parser.add_argument("--no-examples", action="store_true", help="Leave out the bundled example inputs")
+    parser.add_argument("--real-llm", action="store_true",
+                        help="Use the LLM of the configuration instead of the deterministic stub")
+    parser.add_argument("--output", type=str, help="Results file (default: data/benchmarks/<time>.json)")
+    parser.add_argument("--compare", type=str, metavar="RESULTS", help="Compare with the results of a previous run")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory (corpus and databases)")
+    parser.add_argument("--verbose", action="store_true", help="Show the notes of the stages being timed")
+    args = parser.parse_args()
+
+    # Use the configuration, except for the LLM (unless asked) and the caches,
+    # which would hide the work being measured
+    config = load_config()
+    if not args.real_llm:
+        config.read_dict({"llm": {"enabled": "true"}})
+    TextHandler(config)
+    embedding_handler = EmbeddingHandler(
+                                config.get("embedding", "model_path", fallback="all-MiniLM-L6-v2"),
+                                batch_size=config.getint("embedding", "batch_size", fallback=32),
+                                backend=config.get("embedding", "backend", fallback="torch"),
+                                threads=config.getint("embedding", "threads", fallback=0),
+                                quantize=config.getboolean("embedding", "quantize", fallback=True),
+                                onnx_cache_dir=config.get("embedding", "onnx_cache_dir", fallback="data/models/onnx"),
+                               )
+    llm_handler = LLMHandler(config) if args.real_llm else StubLLMHandler(config)
+    Diagnostics.enable_quiet(not args.verbose)
+
+    work_directory = tempfile.mkdtemp(prefix="retainium-bench-")
+    results = {
+        "version": RESULTS_VERSION,
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "settings": {
+            "documents": args.documents, "words": args.words, "sizes": args.sizes,
+            "queries": args.queries, "answer_queries": args.answer_queries, "top_k": args.top_k,
+            "seed": args.seed, "examples": not args.no_examples,
+            "llm_backend": llm_handler.backend,
+            "embedding_model": embedding_handler.model_name,
+            "embedding_backend": embedding_handler.backend,
+            "database_backend": config.get("database", "backend", fallback="chroma"),
+            "chunk_size": TextHandler().chunk_size,
+        },
+    }
+    try:
+        # Write the synthetic corpus out, to be imported along with the examples
+        corpus = make_corpus(args.documents, args.words, args.seed)
+        corpus_directory = os.path.join(work_directory, "corpus")
+        os.makedirs(corpus_directory)
+        paths = []
+        for n, text in enumerate(corpus):
+            paths.append(os.path.join(corpus_directory, f"document-{n:04}.txt"))
+            with open(paths[-1], "w", encoding="utf-8") as f:
+                f.write(text)
+        examples = [] if args.no_examples else sorted(glob.glob(EXAMPLE_INPUTS))
+        results["corpus"] = {"synthetic_documents": len(corpus), "synthetic_megabytes": megabytes(corpus),
+                             "example_files": len(examples)}
+
+        # Time the stages of ingest separately
+        print("timing extraction, chunking and embedding", file=sys.stderr)
+        results["extraction"], pdf_texts = bench_extraction([path for path in examples if path.endswith(".pdf")])
+        text_examples = []
+        for path in examples:
+            if path.endswith(".txt"):
+                with open(path, "r", encoding="utf-8") as f:
+                    text_examples.append(f.read())
+        results["chunking"], chunks = bench_chunking(corpus + pdf_texts + text_examples)
+        results["embedding"], vectors = bench_embedding(embedding_handler, chunks)
+
+        # Time inserts and queries as the database grows
+        queries = make_queries(chunks, args.queries, args.seed)
+        results["sizes"] = []
+        Tracer.enable(True)
+        for size in args.sizes:
+            print(f"timing inserts and queries with {size} entries", file=sys.stderr)
+            results["sizes"].append(bench_size(config, os.path.join(work_directory, f"db-{size}"), size,
+                                               chunks, vectors, queries, args.answer_queries,
+                                               embedding_handler, llm_handler, args.top_k, args.seed))
+
+        # Time a complete import
+        print("timing a complete import", file=sys.stderr)
+        results["import"] = bench_import(config, os.path.join(work_directory, "db-import"), paths + examples,
+                                         args.workers, embedding_handler, llm_handler)
+        Tracer.enable(False)
+    finally:
+        if args.keep:
+            Diagnostics.warning(f"working directory kept at {work_directory}")
+        else:
+            shutil.rmtree(work_directory, ignore_errors=True)
+
+    output = args.output or os.path.join(DEFAULT_RESULTS_DIRECTORY, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print_results(results)
+    if args.compare:
+        compare(results, args.compare)
+    Diagnostics.enable_quiet(False)
+    Diagnostics.success(f"results written to {output}")
+
+if __name__ == "__main__":
+    main()
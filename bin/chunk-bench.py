@@ -0,0 +1,88 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Enable relative module lookups
+# (protect against symlinks using realpath())
+import os, sys
+root = os.path.realpath(os.path.dirname(__file__) + "/..")
+if root not in sys.path:
+    sys.path.insert(0, root)
+
+# Import required modules
+import glob
+import time
+import argparse
+import statistics
+from retainium.config import load_config
+from retainium.diagnostics import Diagnostics
+from retainium.chunker import iter_chunks, token_counter
+from retainium.text_utils import TextHandler, extract_text_from_pdf
+
+# Documents chunked by default
+DEFAULT_INPUTS = os.path.join(root, "examples", "input_files", "*.pdf")
+
+# Load the text of the documents (extraction is not part of the timing)
+def load_texts(paths):
+    texts = []
+    for path in paths:
+        if path.endswith(".pdf"):
+            texts.append(extract_text_from_pdf(path))
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                texts.append(f.read())
+    return texts
+
+# Chunk all the texts "runs" times; return the median time (s) and the chunks of the last run
+def time_chunker(chunker, texts, runs: int):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        chunks = [chunk for text in texts for chunk in chunker(text)]
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), chunks
+
+# Compare the built-in chunker with langchain's RecursiveCharacterTextSplitter
+def main():
+    parser = argparse.ArgumentParser(description="Retainium text chunking throughput benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="Number of timed runs per chunker")
+    parser.add_argument("inputs", nargs="*", help="PDF or text files to chunk (default: the example PDFs)")
+    args = parser.parse_args()
+
+    config = load_config()
+    text_handler = TextHandler(config)
+    paths = args.inputs or sorted(glob.glob(DEFAULT_INPUTS))
+    texts = load_texts(paths)
+    megabytes = sum(len(text.encode("utf-8")) for text in texts) / 1e6
+    Diagnostics.note(f"chunking {len(paths)} documents ({megabytes:.2f} MB of text)")
+
+    # Time the load of each chunker separately from its throughput
+    start = time.perf_counter()
+    counter = token_counter(text_handler.tokenizer)
+    if counter.exact:
+        chunk_size = text_handler.chunk_size - counter.special_tokens
+    else:
+        chunk_size = text_handler.chunk_size_fallback
+    chunkers = [("native (tokens)", time.perf_counter() - start,
+                 lambda text: iter_chunks(text, counter, chunk_size, text_handler.chunk_overlap))]
+    try:
+        start = time.perf_counter()
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=512, chunk_overlap=text_handler.chunk_overlap,
+            separators=["\n\n", "\n", ".", "!", "?", " ", ""]
+        )
+        chunkers.append(("langchain (512 chars)", time.perf_counter() - start, splitter.split_text))
+    except ImportError:
+        Diagnostics.warning("langchain is not installed; timing the native chunker only")
+
+    # Chunk sizes are measured in tokens of the embedding model (or estimated)
+    print(f"{'chunker':<24} {'load':>10} {'MB/s':>8} {'chunks':>8} {'avg tokens':>11} {'over limit':>11}")
+    for name, load, chunker in chunkers:
+        elapsed, chunks = time_chunker(chunker, texts, args.runs)
+        sizes = [len(offsets) for offsets in counter.offsets(chunks)]
+        over = sum(1 for size in sizes if size > chunk_size)
+        print(f"{name:<24} {load * 1000:>8.1f}ms {megabytes / max(elapsed, 1e-9):>8.2f} "
+              f"{len(chunks):>8} {statistics.mean(sizes) if sizes else 0:>11.1f} {over:>11}")
+
+if __name__ == "__main__":
+    main()
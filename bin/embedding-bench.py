@@ -0,0 +1,129 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Enable relative module lookups
+# (protect against symlinks using realpath())
+import os, sys
+root = os.path.realpath(os.path.dirname(__file__) + "/..")
+if root not in sys.path:
+    sys.path.insert(0, root)
+
+# Import required modules
+import json
+import math
+import time
+import argparse
+import statistics
+from retainium.config import load_config
+from retainium.context_builder import split_sentences
+from retainium.diagnostics import Diagnostics
+from retainium.embeddings import EmbeddingHandler
+
+# Texts embedded by default
+DEFAULT_INPUTS = [
+    os.path.join(root, "examples", "input_files", "knowledge-multi.json"),
+    os.path.join(root, "README.md"),
+]
+
+# Number of nearest neighbours compared between backends
+NEIGHBOURS = 5
+
+# Load the sentences of the inputs (the texts of a JSON export, or the
+# sentences of a text file)
+def load_sentences(paths):
+    sentences = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith(".json"):
+                sentences += [entry["text"].strip() for entry in json.load(f) if entry.get("text", "").strip()]
+            else:
+                sentences += [sentence for sentence in split_sentences(f.read()) if len(sentence.split()) >= 3]
+    return list(dict.fromkeys(sentences))
+
+def cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    return dot / (math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b)) or 1.0)
+
+# Indices of the nearest neighbours of each vector among the others
+def nearest_neighbours(vectors):
+    neighbours = []
+    for i, vector in enumerate(vectors):
+        scores = sorted(((cosine(vector, other), j) for j, other in enumerate(vectors) if j != i), reverse=True)
+        neighbours.append({j for _, j in scores[:NEIGHBOURS]})
+    return neighbours
+
+# Embed the sentences with a backend; return the load time (s), the
+# throughput (sentences/s) and the vectors
+def run_backend(handler, sentences, total: int):
+    start = time.perf_counter()
+    handler.model.encode(sentences[:1], batch_size=1)   # Load (and warm up) the model
+    load = time.perf_counter() - start
+
+    workload = [sentences[n % len(sentences)] for n in range(total)]
+    start = time.perf_counter()
+    handler.model.encode(workload, batch_size=handler.batch_size)
+    elapsed = time.perf_counter() - start
+    vectors = [vector.tolist() for vector in handler.model.encode(sentences, batch_size=handler.batch_size)]
+    return load, total / max(elapsed, 1e-9), vectors
+
+# Compare the torch and ONNX Runtime embedding backends: throughput, and the
+# drift of the ONNX vectors from the torch ones
+def main():
+    parser = argparse.ArgumentParser(description="Retainium embedding backend benchmark and drift check")
+    parser.add_argument("--sentences", type=int, default=2000, help="Number of sentences embedded per backend")
+    parser.add_argument("--threads", type=int, help="Intra-op threads (default: from config)")
+    parser.add_argument("--min-cosine", type=float, default=0.99,
+                        help="Fail if any ONNX vector is less similar than this to the torch one")
+    parser.add_argument("inputs", nargs="*", help="JSON exports or text files to embed (default: the examples and README)")
+    args = parser.parse_args()
+
+    config = load_config()
+    model_name = config.get("embedding", "model_path", fallback="all-MiniLM-L6-v2")
+    batch_size = config.getint("embedding", "batch_size", fallback=32)
+    threads = args.threads if args.threads is not None else config.getint("embedding", "threads", fallback=0)
+    onnx_cache_dir = config.get("embedding", "onnx_cache_dir", fallback="data/models/onnx")
+    sentences = load_sentences(args.inputs or DEFAULT_INPUTS)
+    Diagnostics.note(f"embedding {args.sentences} sentences ({len(sentences)} distinct) with {model_name}")
+
+    # (no embedding cache, so that every sentence runs the model)
+    configurations = [
+        ("torch", dict(backend="torch")),
+        ("onnx fp32", dict(backend="onnx", quantize=False)),
+        ("onnx int8", dict(backend="onnx", quantize=True)),
+    ]
+    results = {}
+    print(f"{'backend':<12} {'load':>10} {'sentences/s':>12}")
+    for name, settings in configurations:
+        handler = EmbeddingHandler(model_name, batch_size=batch_size, threads=threads,
+                                   onnx_cache_dir=onnx_cache_dir, **settings)
+        try:
+            load, throughput, vectors = run_backend(handler, sentences, args.sentences)
+        except ImportError as e:
+            Diagnostics.warning(f"skipping {name}: {e}")
+            continue
+        results[name] = vectors
+        print(f"{name:<12} {load * 1000:>8.0f}ms {throughput:>12.1f}")
+
+    # Report how far the ONNX vectors drift from the torch ones
+    if "torch" not in results:
+        Diagnostics.warning("torch backend unavailable; cannot check drift")
+        return
+    reference = results["torch"]
+    reference_neighbours = nearest_neighbours(reference)
+    failed = False
+    print(f"\n{'drift vs torch':<12} {'min cos':>10} {'mean cos':>10} {'top-' + str(NEIGHBOURS) + ' overlap':>14}")
+    for name, vectors in results.items():
+        if name == "torch":
+            continue
+        similarities = [cosine(a, b) for a, b in zip(reference, vectors)]
+        overlap = statistics.mean(len(a & b) / max(len(a), 1)
+                                  for a, b in zip(reference_neighbours, nearest_neighbours(vectors)))
+        print(f"{name:<12} {min(similarities):>10.4f} {statistics.mean(similarities):>10.4f} {overlap:>14.3f}")
+        if min(similarities) < args.min_cosine:
+            Diagnostics.error(f"{name} vectors drift beyond the minimum cosine similarity of {args.min_cosine}")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
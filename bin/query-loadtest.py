@@ -0,0 +1,104 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Enable relative module lookups
+# (protect against symlinks using realpath())
+import os, sys
+root = os.path.realpath(os.path.dirname(__file__) + "/..")
+if root not in sys.path:
+    sys.path.insert(0, root)
+
+# Import required modules
+import time
+import asyncio
+import argparse
+import statistics
+from retainium.config import load_config
+from retainium.diagnostics import Diagnostics
+from retainium.embeddings import EmbeddingHandler
+from retainium.knowledge import KnowledgeDB
+from retainium.query_engine import QueryEngine
+
+# Queries issued by default
+DEFAULT_QUERIES = [
+    "What are the key points of the design?",
+    "How is the data stored?",
+    "Which tools are used for testing?",
+    "Summarize the meeting notes",
+    "What were the action items?",
+    "Who is responsible for the release?",
+    "What is the performance target?",
+    "How do I configure the model?",
+    "What changed in the last version?",
+    "Where are the logs written?",
+]
+
+# Return the value at the given percentile of the sorted samples
+def percentile(samples, fraction: float) -> float:
+    index = min(int(round(fraction * (len(samples) - 1))), len(samples) - 1)
+    return samples[index]
+
+# Issue the requests from "concurrency" concurrent clients
+# Return the per-request latencies (in milliseconds) and the wall time (in seconds)
+async def run_load(engine, queries, requests: int, concurrency: int, top_k: int):
+    latencies = []
+    remaining = iter(range(requests))
+
+    async def client():
+        for i in remaining:
+            start = time.perf_counter()
+            await engine.search(queries[i % len(queries)], top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return sorted(latencies), time.perf_counter() - start
+
+# Measure query latency and throughput as concurrency grows, with and without batching
+def main():
+    parser = argparse.ArgumentParser(description="Retainium concurrent query load test")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64],
+                        help="Numbers of concurrent clients to test")
+    parser.add_argument("--requests", type=int, default=200, help="Number of queries issued per test")
+    parser.add_argument("--top-k", type=int, default=5, help="Number of matching entries to retrieve")
+    parser.add_argument("--window-ms", type=float, default=5, help="Batching window of the query engine")
+    parser.add_argument("--max-batch", type=int, default=64, help="Largest batch run by the query engine")
+    parser.add_argument("--queries", type=str, help="File of queries, one per line (default: a built-in set)")
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    # Setup the handlers from the configuration
+    # (without the embedding cache, so that every query runs the model)
+    config = load_config()
+    embedding_handler = EmbeddingHandler(
+                                            config.get("embedding", "model_path", fallback="all-MiniLM-L6-v2"),
+                                            batch_size=config.getint("embedding", "batch_size", fallback=32),
+                                        )
+    knowledge_db = KnowledgeDB(config.get("database", "path", fallback="data/knowledge_db"),
+                               backend=config.get("database", "backend", fallback="chroma"),
+                               vector_dtype=config.get("database", "vector_dtype", fallback="float32"))
+    if knowledge_db.count() == 0:
+        Diagnostics.error("knowledge database is empty; add or import some entries first")
+        sys.exit(1)
+    embedding_handler.embed(queries[0])  # Load the model before timing
+
+    modes = [
+        ("unbatched", dict(window_ms=0, max_batch=1)),
+        ("batched", dict(window_ms=args.window_ms, max_batch=args.max_batch)),
+    ]
+    print(f"{'mode':<10} {'clients':>8} {'p50':>10} {'p99':>10} {'QPS':>9} {'avg batch':>10}")
+    for concurrency in args.concurrency:
+        for mode, settings in modes:
+            engine = QueryEngine(knowledge_db, embedding_handler, **settings)
+            latencies, elapsed = asyncio.run(run_load(engine, queries, args.requests, concurrency, args.top_k))
+            engine.stop()
+            print(f"{mode:<10} {concurrency:>8} "
+                  f"{statistics.median(latencies):>8.1f}ms {percentile(latencies, 0.99):>8.1f}ms "
+                  f"{len(latencies) / elapsed:>9.1f} {engine.queries / max(engine.batches, 1):>10.1f}")
+
+if __name__ == "__main__":
+    main()
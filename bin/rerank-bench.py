@@ -0,0 +1,103 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Enable relative module lookups
+# (protect against symlinks using realpath())
+import os, sys
+root = os.path.realpath(os.path.dirname(__file__) + "/..")
+if root not in sys.path:
+    sys.path.insert(0, root)
+
+# Import required modules
+import json
+import time
+import argparse
+import statistics
+import tempfile
+from retainium.config import load_config
+from retainium.diagnostics import Diagnostics
+from retainium.embeddings import EmbeddingHandler
+from retainium.knowledge import KnowledgeDB
+from retainium.query_knowledge import search
+from retainium.reranker import Reranker
+
+# Fixed set of queries, with the ids of the entries relevant to each
+DEFAULT_QUERIES = os.path.join(root, "examples", "rerank-queries.json")
+
+# Rank of the first relevant entry (1-based), or 0 if none was retrieved
+def first_relevant_rank(results, relevant) -> int:
+    for rank, entry in enumerate(results, start=1):
+        if entry.id in relevant:
+            return rank
+    return 0
+
+# Run every query and measure its latency and the quality of its results
+# Return the median latency (ms), the recall at k and the mean reciprocal rank
+def evaluate(queries, top_k: int, knowledge_db, embedding_handler, reranker):
+    latencies, recalls, reciprocal_ranks = [], [], []
+    for query in queries:
+        relevant = set(query["relevant"])
+        start = time.perf_counter()
+        results, _ = search(query["query"], top_k, knowledge_db, embedding_handler, reranker=reranker)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(relevant & {entry.id for entry in results}) / len(relevant))
+        rank = first_relevant_rank(results, relevant)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+    return statistics.median(latencies), statistics.mean(recalls), statistics.mean(reciprocal_ranks)
+
+# Compare retrieval with and without reranking over a fixed query set
+def main():
+    parser = argparse.ArgumentParser(description="Retainium reranker latency/quality benchmark")
+    parser.add_argument("--queries", type=str, default=DEFAULT_QUERIES, help="Query set (JSON with \"corpus\" and \"queries\")")
+    parser.add_argument("--corpus", type=str, help="Entries to search (JSON export; default: from the query set)")
+    parser.add_argument("--top-k", type=int, default=5, help="Number of entries kept per query")
+    parser.add_argument("--candidates", type=int, nargs="+", default=[10, 20, 50], help="Candidate set sizes to rerank")
+    args = parser.parse_args()
+
+    with open(args.queries, "r", encoding="utf-8") as f:
+        query_set = json.load(f)
+    corpus_path = args.corpus or os.path.join(root, query_set["corpus"])
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    # Setup the models from the configuration
+    # (without the embedding cache, so that every query runs the model)
+    config = load_config()
+    embedding_handler = EmbeddingHandler(
+                                            config.get("embedding", "model_path", fallback="all-MiniLM-L6-v2"),
+                                            batch_size=config.getint("embedding", "batch_size", fallback=32),
+                                        )
+    reranker_model = config.get("rerank", "model_path", fallback="cross-encoder/ms-marco-MiniLM-L-6-v2")
+    batch_size = config.getint("rerank", "batch_size", fallback=32)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Load the corpus into a scratch database (tags as given; no LLM needed)
+        knowledge_db = KnowledgeDB(os.path.join(tmp, "knowledge_db"),
+                                   backend=config.get("database", "backend", fallback="chroma"),
+                                   vector_dtype=config.get("database", "vector_dtype", fallback="float32"))
+        knowledge_db.add_entries([entry["text"].strip() for entry in corpus],
+                                 [entry.get("source", "benchmark") for entry in corpus],
+                                 embedding_handler, None,
+                                 tags=[entry.get("tags", []) for entry in corpus])
+        Diagnostics.note(f"searching {knowledge_db.count()} entries with {len(query_set['queries'])} queries")
+
+        # (one reranker, its candidate set resized per configuration)
+        shared_reranker = Reranker(reranker_model, top_k=args.top_k, batch_size=batch_size)
+        configurations = [("bi-encoder only", None)]
+        configurations += [(f"rerank {candidates} candidates", candidates) for candidates in args.candidates]
+
+        print(f"{'configuration':<26} {'p50':>10} {'recall@' + str(args.top_k):>10} {'MRR':>8}")
+        for name, candidates in configurations:
+            reranker = None
+            if candidates:
+                reranker = shared_reranker
+                reranker.candidates = candidates
+
+            # Load the models before timing
+            search("warm up", args.top_k, knowledge_db, embedding_handler, reranker=reranker)
+            latency, recall, mrr = evaluate(query_set["queries"], args.top_k, knowledge_db,
+                                            embedding_handler, reranker)
+            print(f"{name:<26} {latency:>8.1f}ms {recall:>10.3f} {mrr:>8.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Enable relative module lookups
+# (protect against symlinks using realpath())
+import os, sys
+root = os.path.realpath(os.path.dirname(__file__) + "/..")
+if root not in sys.path:
+    sys.path.insert(0, root)
+
+# Import required modules
+import time
+import shlex
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+from retainium.config import load_config
+from retainium.diagnostics import Diagnostics
+
+# Subcommand invocations timed by default
+# (the "{tmp}" placeholder is replaced by a scratch directory)
+DEFAULT_COMMANDS = [
+    "--help",
+    "add --help",
+    "list --help",
+    "query --help",
+    "export --help",
+    "import --help",
+    "rebuild-index --help",
+    "list --terse",
+    "export --output {tmp}/export.json",
+]
+
+# Run a single invocation of the CLI and return the wall time in milliseconds
+# (from the scratch directory, so that the data paths of the configuration,
+#  relative to the working directory, resolve into it)
+def time_command(argv, cwd: str) -> float:
+    command = [sys.executable, os.path.join(root, "retainium.py")] + argv
+    start = time.perf_counter()
+    subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+# Measure the startup time of each subcommand
+def main():
+    parser = argparse.ArgumentParser(description="Retainium CLI startup-time benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="Number of timed runs per command")
+    parser.add_argument("--budget-ms", type=float, default=0, help="Fail if any median exceeds this many milliseconds")
+    parser.add_argument("--copy-database", action="store_true",
+                        help="Time against a copy of the configured database (default: an empty scratch one)")
+    parser.add_argument("commands", nargs="*", help="Subcommand invocations to time (quoted, after \"--\"), e.g. -- \"list --terse\"")
+    args = parser.parse_args()
+
+    # The commands never see the user's database, which opening it could
+    # migrate or add a keyword index to; they run against a scratch one
+    # (empty, or a copy of the configured one)
+    db_path = load_config().get("database", "path", fallback="data/knowledge_db")
+    if os.path.isabs(db_path):
+        Diagnostics.error(f"the configured database path {db_path} is absolute, "
+                          f"and cannot be redirected to a scratch database")
+        sys.exit(1)
+
+    commands = args.commands or DEFAULT_COMMANDS
+    over_budget = []
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.copy_database and os.path.isdir(os.path.join(root, db_path)):
+            shutil.copytree(os.path.join(root, db_path), os.path.join(tmp, db_path))
+        print(f"{'command':<40} {'median':>10} {'min':>10} {'max':>10}")
+        for command in commands:
+            argv = shlex.split(command.format(tmp=tmp))
+            time_command(argv, tmp)  # Warm up the filesystem cache
+            samples = [time_command(argv, tmp) for _ in range(args.runs)]
+            median = statistics.median(samples)
+            print(f"{command:<40} {median:>8.1f}ms {min(samples):>8.1f}ms {max(samples):>8.1f}ms")
+            if args.budget_ms and median > args.budget_ms:
+                over_budget.append(command)
+
+    # Flag regressions
+    if over_budget:
+        for command in over_budget:
+            Diagnostics.error(f"\"{command}\" exceeded the {args.budget_ms}ms startup budget")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
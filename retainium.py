@@ -12,10 +12,15 @@
 # Import required modules
 from retainium.cli import process_cli
 from retainium.config import load_config
+from retainium.daemon import DaemonClient, DEFAULT_HOST, DEFAULT_PORT
 from retainium.diagnostics import Diagnostics
+from retainium.embedding_cache import EmbeddingCache
 from retainium.embeddings import EmbeddingHandler
 from retainium.knowledge import KnowledgeDB
+from retainium.lazy import LazyHandler
 from retainium.llm import LLMHandler
+from retainium.query_cache import QueryCache
+from retainium.reranker import Reranker
 from retainium.text_utils import TextHandler
 
 def main():
@@ -26,23 +31,76 @@ def main():
     # (singleton, static - no need to pass around)
     text_handler = TextHandler(config)
 
+    # The handlers below are only built when a command first uses them,
+    # so that commands like "list", "export" or "--help" start quickly
+
     # Setup embedings model
-    model_name = config.get("embeddings", "model", fallback="all-MiniLM-L6-v2")
+    model_name = config.get("embedding", "model_path", fallback="all-MiniLM-L6-v2")
+    batch_size = config.getint("embedding", "batch_size", fallback=32)
     Diagnostics.note(f"configured embeddings model name: {model_name}")
-    embedding_handler = EmbeddingHandler(model_name=model_name)
+
+    # Setup the embeddings cache, consulted before running the model
+    def build_embedding_handler():
+        cache = None
+        if config.getboolean("embedding", "cache_enabled", fallback=True):
+            cache = EmbeddingCache(
+                        config.get("embedding", "cache_path", fallback="data/embedding_cache.db"),
+                        config.getint("embedding", "cache_max_entries", fallback=100000)
+                    )
+        return EmbeddingHandler(
+                                model_name=model_name,
+                                batch_size=batch_size,
+                                cache=cache,
+                                backend=config.get("embedding", "backend", fallback="torch"),
+                                threads=config.getint("embedding", "threads", fallback=0),
+                                quantize=config.getboolean("embedding", "quantize", fallback=True),
+                                onnx_cache_dir=config.get("embedding", "onnx_cache_dir",
+                                                          fallback="data/models/onnx"),
+                               )
+    embedding_handler = LazyHandler("embedding model", build_embedding_handler)
 
     # Setup LLM handler
-    llm_handler = LLMHandler(config) if config.getboolean("llm", "enabled", fallback=False) else None
+    llm_handler = None
+    if config.getboolean("llm", "enabled", fallback=False):
+        llm_handler = LazyHandler("LLM", lambda: LLMHandler(config))
     Diagnostics.note(f"configured LLM: {llm_handler}")
 
+    # Setup the cache of query answers, opened when a query is first answered
+    query_cache = None
+    if llm_handler is not None and config.getboolean("llm", "cache_enabled", fallback=True):
+        query_cache = LazyHandler("query cache", lambda: QueryCache(
+                                    config.get("llm", "cache_path", fallback="data/query_cache.db"),
+                                    config.getint("llm", "cache_max_entries", fallback=1000),
+                                  ))
+
+    # Setup the reranker, rescoring a wider set of retrieved candidates
+    reranker = None
+    if config.getboolean("rerank", "enabled", fallback=False):
+        reranker = LazyHandler("reranker", lambda: Reranker(
+                                config.get("rerank", "model_path", fallback="cross-encoder/ms-marco-MiniLM-L-6-v2"),
+                                candidates=config.getint("rerank", "candidates", fallback=50),
+                                top_k=config.getint("rerank", "top_k", fallback=5),
+                                batch_size=config.getint("rerank", "batch_size", fallback=32),
+                              ))
+    Diagnostics.note(f"configured reranker: {reranker}")
+
     # Setup vector database 
     db_path = config.get("database", "path", fallback="data/knowledge_db")
     Diagnostics.note(f"configured database path: {db_path}")
-    knowledge_db = KnowledgeDB(db_path)
+    write_batch_size = config.getint("database", "write_batch_size", fallback=256)
+    db_backend = config.get("database", "backend", fallback="chroma")
+    vector_dtype = config.get("database", "vector_dtype", fallback="float32")
+    knowledge_db = LazyHandler("knowledge database", 
+                               lambda: KnowledgeDB(db_path, write_batch_size=write_batch_size,
+                                                   backend=db_backend, vector_dtype=vector_dtype))
+
+    # Setup the address of the daemon, served by "serve" and used when running
+    daemon_client = DaemonClient(config.get("server", "host", fallback=DEFAULT_HOST),
+                                 config.getint("server", "port", fallback=DEFAULT_PORT))
 
     # Process command line options
     try:
-        process_cli(knowledge_db, embedding_handler, llm_handler)
+        process_cli(knowledge_db, embedding_handler, llm_handler, daemon_client, reranker, query_cache)
     except Exception as e:
         Diagnostics.error(f"failed to parse command line options: {e}")
 
@@ -11,7 +11,7 @@ def register(subparsers):
     parser = subparsers.add_parser("add", help="Add a new knowledge entry")
     parser.add_argument("--text", type=str, required=True, help="Text content of the entry")
     parser.add_argument("--source", type=str, help="Source of the entry (e.g., CLI, URL, etc.)")
-    parser.set_defaults(func=run)
+    parser.set_defaults(func=run, remote=remote)
 
 # Handling of the "add" command
 def run(args, knowledge_db, embedding_handler, llm_handler):
@@ -24,3 +24,11 @@ def run(args, knowledge_db, embedding_handler, llm_handler):
     except Exception as e:
         Diagnostics.error(f"failed to add entry: {e}")
 
+
+# Handling of the "add" command by a running daemon
+def remote(args, client):
+    response = client.request("/add", {"text": args.text.strip(), "source": args.source or "CLI"})
+    if response["added"]:
+        Diagnostics.note(f"entry added successfully")
+    else:
+        Diagnostics.warning(f"entry not added (empty or duplicate)")
@@ -0,0 +1,46 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Module to inspect or purge the embedding cache
+
+# Import required modules
+import json
+from retainium.diagnostics import Diagnostics
+
+# Register command line options for "cache"
+def register(subparsers):
+    parser = subparsers.add_parser("cache", help="Inspect or purge the embedding cache")
+    parser.add_argument("--purge", action="store_true", help="Remove cached embeddings")
+    parser.add_argument("--model", type=str, help="Restrict --purge to the given embedding model (as listed, e.g. all-MiniLM-L6-v2@onnx-int8)")
+    parser.add_argument("--json", action="store_true", help="Output statistics as JSON")
+    parser.set_defaults(func=run, exclusive=True)
+
+# Handling of the "cache" command
+def run(args, knowledge_db, embedding_handler, llm_handler):
+    cache = embedding_handler.cache
+    if cache is None:
+        Diagnostics.warning("embedding cache is disabled in config")
+        return
+
+    # Purge, if requested
+    if args.purge:
+        removed = cache.purge(args.model)
+        Diagnostics.note(f"purged {removed} cached embeddings")
+        return
+
+    # Report the cache statistics
+    stats = cache.stats()
+    if args.json:
+        print(json.dumps(stats, indent=2))
+        return
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = 100.0 * stats["hits"] / lookups if lookups else 0.0
+    print(f"path:      {stats['path']}")
+    print(f"entries:   {stats['entries']} / {stats['max_entries']}")
+    print(f"size:      {stats['size_bytes'] / (1024 * 1024):.1f} MiB")
+    print(f"hits:      {stats['hits']}")
+    print(f"misses:    {stats['misses']}")
+    print(f"hit rate:  {hit_rate:.1f}%")
+    print(f"evictions: {stats['evictions']}")
+    for model, count in stats["models"].items():
+        print(f"model:     {model} ({count} entries)")
@@ -0,0 +1,219 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Split text into chunks sized in tokens of the embedding model, breaking at
+# paragraph and sentence boundaries wherever possible
+
+# Import required modules
+# (the tokenizer libraries are imported on first use, since they are slow
+#  to load and most commands never chunk anything)
+import os
+import re
+import threading
+from typing import Iterator, List, Tuple
+from retainium.diagnostics import Diagnostics
+
+# Paragraphs are separated by blank lines, sentences by terminal punctuation
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+
+# Stand-in for tokens when no tokenizer can be loaded
+# (words and punctuation; subword tokenizers produce at least as many)
+ESTIMATED_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+# Token counters, one per tokenizer (loaded once per process)
+_counters = {}
+_counters_lock = threading.Lock()
+
+class TokenCounter:
+    """Locates the tokens of texts, using the tokenizer of the embedding
+    model if it can be loaded and an estimate otherwise."""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.special_tokens = 0     # Tokens the model adds to every text
+        self._offsets = self._load(model_name)
+        self.exact = self._offsets is not None
+        if not self.exact:
+            Diagnostics.warning(f"tokenizer for {model_name} unavailable; estimating chunk sizes")
+
+    # Load the tokenizer of the model (a local directory or a model name)
+    # (only local files are used: this runs in every extraction worker, and
+    #  a hub lookup would wait for a network timeout on an offline machine)
+    # Return a function mapping texts to their token (start, end) offsets,
+    # or None if no tokenizer could be loaded
+    def _load(self, model_name: str):
+        names = [model_name]
+        if "/" not in model_name and not os.path.isdir(model_name):
+            names.append(f"sentence-transformers/{model_name}")
+
+        # The standalone tokenizers library loads far faster than transformers
+        try:
+            from tokenizers import Tokenizer
+            for path in local_tokenizer_files(names):
+                try:
+                    tokenizer = Tokenizer.from_file(path)
+                except Exception:
+                    continue
+                tokenizer.no_truncation()
+                tokenizer.no_padding()
+                self.special_tokens = len(tokenizer.encode("").ids)
+                Diagnostics.debug(f"loaded tokenizer {path} (tokenizers)")
+                return lambda texts: [encoding.offsets for encoding in
+                                      tokenizer.encode_batch(texts, add_special_tokens=False)]
+        except ImportError:
+            pass
+
+        try:
+            from transformers import AutoTokenizer
+            for name in names:
+                try:
+                    tokenizer = AutoTokenizer.from_pretrained(name, use_fast=True, local_files_only=True)
+                except Exception:
+                    continue
+                if not tokenizer.is_fast:   # (only fast tokenizers report offsets)
+                    continue
+                self.special_tokens = len(tokenizer("")["input_ids"])
+                Diagnostics.debug(f"loaded tokenizer {name} (transformers)")
+                return lambda texts: tokenizer(texts, add_special_tokens=False,
+                                               return_offsets_mapping=True)["offset_mapping"]
+        except ImportError:
+            pass
+        return None
+
+    # Return the (start, end) character offsets of the tokens of each text
+    def offsets(self, texts: List[str]) -> List[List[Tuple[int, int]]]:
+        if not texts:
+            return []
+        if self.exact:
+            return [[tuple(offset) for offset in offsets] for offsets in self._offsets(texts)]
+        return [[match.span() for match in ESTIMATED_TOKEN.finditer(text)] for text in texts]
+
+    def count(self, text: str) -> int:
+        return len(self.offsets([text])[0])
+
+# Yield the paths of the tokenizer.json files of the named models found
+# locally: in the model directory, the Hugging Face cache or the cache of
+# sentence-transformers (where older releases keep their models)
+def local_tokenizer_files(names: List[str]) -> Iterator[str]:
+    sentence_transformers_home = os.environ.get("SENTENCE_TRANSFORMERS_HOME",
+                                                os.path.join(os.path.expanduser("~"), ".cache",
+                                                             "torch", "sentence_transformers"))
+    for name in names:
+        paths = [os.path.join(name, "tokenizer.json"),
+                 os.path.join(sentence_transformers_home, name.replace("/", "_"), "tokenizer.json")]
+        try:
+            from huggingface_hub import try_to_load_from_cache
+            for cache_dir in (None, sentence_transformers_home):
+                path = try_to_load_from_cache(name, "tokenizer.json", cache_dir=cache_dir)
+                if isinstance(path, str):
+                    paths.append(path)
+        except Exception:
+            pass    # (not installed, or not a valid repository name)
+        for path in paths:
+            if os.path.isfile(path):
+                yield path
+
+# Return the (shared) token counter for the tokenizer of a model
+def token_counter(model_name: str) -> TokenCounter:
+    with _counters_lock:
+        if model_name not in _counters:
+            _counters[model_name] = TokenCounter(model_name)
+        return _counters[model_name]
+
+# Yield the paragraphs of the text, as they are found
+def iter_paragraphs(text: str) -> Iterator[str]:
+    start = 0
+    for match in PARAGRAPH_BREAK.finditer(text):
+        paragraph = text[start:match.start()].strip()
+        if paragraph:
+            yield paragraph
+        start = match.end()
+    paragraph = text[start:].strip()
+    if paragraph:
+        yield paragraph
+
+# Cut a sentence longer than "size" tokens into pieces of at most "size"
+# tokens, preferring to cut at line breaks, then between words
+# Yield (piece, tokens) pairs
+def split_long_sentence(sentence: str, offsets: List[Tuple[int, int]], size: int) -> Iterator[Tuple[str, int]]:
+    first = 0
+    while first < len(offsets):
+        last = min(first + size, len(offsets))
+        if last < len(offsets):
+            # Look back (at most half the piece) for the best place to cut
+            cut = None
+            for n in range(last, first + max(size // 2, 1), -1):
+                gap = sentence[offsets[n - 1][1]:offsets[n][0]]
+                if "\n" in gap:
+                    cut = n
+                    break
+                if cut is None and gap:
+                    cut = n
+            last = cut or last
+        piece = sentence[offsets[first][0]:offsets[last - 1][1]].strip()
+        if piece:
+            yield piece, last - first
+        first = last
+
+# Split text into chunks of at most "chunk_size" tokens, each starting with
+# up to "chunk_overlap" tokens of whole sentences from the end of the
+# previous chunk
+# Sentences are never split unless longer than a chunk, and a paragraph
+# that does not fit in the rest of a chunk (at least half full) starts the
+# next one. The text is read in a single pass, so chunks are yielded as soon
+# as they are complete.
+def iter_chunks(text: str, counter: TokenCounter, chunk_size: int,
+                chunk_overlap: int = 0) -> Iterator[str]:
+    chunk_size = max(chunk_size, 1)
+    chunk_overlap = min(max(chunk_overlap, 0), chunk_size // 2)
+    window: List[Tuple[str, str, int]] = []     # (separator, sentence, tokens) of the current chunk
+    used = 0                                    # Tokens in the current chunk
+    fresh = 0                                   # Sentences not carried over from the previous chunk
+
+    def emit():
+        return "".join(separator + sentence for separator, sentence, _ in window).strip()
+
+    # Keep the trailing sentences of the chunk that fit in the overlap
+    def carry_over():
+        kept, tokens = [], 0
+        for item in reversed(window):
+            if tokens + item[2] > chunk_overlap:
+                break
+            kept.insert(0, item)
+            tokens += item[2]
+        return kept, tokens
+
+    for paragraph in iter_paragraphs(text):
+        sentences = [sentence for sentence in SENTENCE_BREAK.split(paragraph) if sentence]
+        offsets = counter.offsets(sentences)
+
+        # Start a paragraph that does not fit in the rest of the chunk afresh
+        paragraph_tokens = sum(len(sentence_offsets) for sentence_offsets in offsets)
+        if fresh and used + paragraph_tokens > chunk_size and used >= chunk_size // 2:
+            yield emit()
+            window, used = carry_over()
+            fresh = 0
+
+        separator = "\n\n"
+        for sentence, sentence_offsets in zip(sentences, offsets):
+            if len(sentence_offsets) > chunk_size:
+                pieces = split_long_sentence(sentence, sentence_offsets, chunk_size)
+            else:
+                pieces = [(sentence, len(sentence_offsets))]
+            for piece, tokens in pieces:
+                if used + tokens > chunk_size:
+                    if fresh:
+                        yield emit()
+                        window, used = carry_over()
+                        fresh = 0
+                    if used + tokens > chunk_size:
+                        # (no room for an overlap before this sentence)
+                        window, used = [], 0
+                window.append((separator, piece, tokens))
+                used += tokens
+                fresh += 1
+                separator = " "
+
+    if fresh:
+        yield emit()
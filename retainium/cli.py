@@ -4,13 +4,22 @@
 # Command line parsing module
 import argparse
 from retainium.diagnostics import Diagnostics
-from retainium import add_knowledge, list_knowledge, query_knowledge, export_knowledge, import_knowledge, rebuild_index
+from retainium.tracing import Tracer
+from retainium import add_knowledge, list_knowledge, query_knowledge, export_knowledge, import_knowledge, rebuild_index, cache_embeddings, serve_knowledge
+from retainium.daemon import DaemonClient
 
-def process_cli(knowledge_db, embedding_handler, llm_handler):
+def process_cli(knowledge_db, embedding_handler, llm_handler, daemon_client=None, reranker=None, query_cache=None):
     parser = argparse.ArgumentParser(prog="retainium.ai", description="Retainium AI - Personal Knowledge Database")
 
     # Enable debug support
     parser.add_argument("--debug", action="store_true", help="Enable debug output")
+
+    # Enable profiling support
+    parser.add_argument("--profile", action="store_true", help="Print the time spent in each stage on exit")
+    parser.add_argument("--trace", type=str, metavar="FILE", help="Write the timed stages as a Chrome trace (implies --profile)")
+
+    # Allow bypassing a running daemon
+    parser.add_argument("--local", action="store_true", help="Run locally even if a daemon is running")
     
     # Create subparser group for commands
     subparsers = parser.add_subparsers(dest="command", required=True)
@@ -22,15 +31,45 @@ def process_cli(knowledge_db, embedding_handler, llm_handler):
     export_knowledge.register(subparsers)
     import_knowledge.register(subparsers)
     rebuild_index.register(subparsers)
+    cache_embeddings.register(subparsers)
+    serve_knowledge.register(subparsers)
 
     # Parse command line arguments
     args = parser.parse_args()
 
     # Enable debug mode if specified on the command line
     Diagnostics.enable_debug(args.debug)
+    Tracer.enable(args.profile or bool(args.trace))
+
+    # Optional second retrieval stage, used by the commands that search
+    args.reranker = reranker
+
+    # Optional cache of the answers to queries
+    args.query_cache = query_cache
+
+    # Forward to a running daemon, if the command supports it
+    # (the local handlers are then never loaded; commands that would open
+    #  the database or cache the daemon holds are refused instead)
+    args.daemon = daemon_client or DaemonClient()
+    try:
+        with Tracer.span(f"command.{args.command}"):
+            if hasattr(args, "remote") and not args.local and args.daemon.is_running():
+                Diagnostics.debug(f"forwarding \"{args.command}\" to the daemon at {args.daemon.url('')}")
+                args.remote(args, args.daemon)
+            elif getattr(args, "exclusive", False) and args.daemon.is_running():
+                Diagnostics.error(f"\"{args.command}\" cannot run while the daemon at {args.daemon.url('')} "
+                                  f"is running; stop it first")
+
+            # Dispatch to the selected command's handler
+            elif hasattr(args, "func"):
+                args.func(args, knowledge_db, embedding_handler, llm_handler)
+            else:
+                parser.print_help()
 
-    # Dispatch to the selected command's handler
-    if hasattr(args, "func"):
-        args.func(args, knowledge_db, embedding_handler, llm_handler)
-    else:
-        parser.print_help()
+    # Summarize the profile, even if the command failed
+    finally:
+        if Tracer.is_enabled():
+            Tracer.report()
+            if args.trace:
+                Tracer.write_chrome_trace(args.trace)
+                Diagnostics.note(f"trace written to {args.trace}")
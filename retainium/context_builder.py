@@ -0,0 +1,87 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Assemble the retrieved entries into an LLM prompt context that fits the
+# model's context window
+
+# Import required modules
+import re
+import math
+from typing import List
+from retainium.diagnostics import Diagnostics
+from retainium.llm import estimate_tokens
+
+# Passages sharing at least this fraction of their words are near-duplicates
+DEDUP_THRESHOLD = 0.8
+
+# Truncated passages shorter than this many tokens are not worth including
+MIN_PASSAGE_TOKENS = 16
+
+# Split text into sentences (keeping the terminating punctuation)
+def split_sentences(text: str) -> List[str]:
+    return [sentence for sentence in re.split(r"(?<=[.!?])\s+", text.strip()) if sentence]
+
+# Jaccard similarity of the word sets of two texts
+def similarity(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+# Return the longest run of leading sentences of the text fitting the budget
+# (or an empty string, if not even the first sentence fits)
+# (the "tokens" of the text are shared out between its sentences in
+#  proportion to their estimated counts, rather than counting each again)
+def truncate_to_budget(text: str, budget: int, tokens: int) -> str:
+    split = split_sentences(text)
+    estimates = [estimate_tokens(sentence) for sentence in split]
+    scale = tokens / max(sum(estimates), 1)
+    sentences = []
+    used = 0
+    for sentence, estimate in zip(split, estimates):
+        # (allow a token for the join between sentences)
+        tokens = math.ceil(estimate * scale) + 1
+        if used + tokens > budget:
+            break
+        sentences.append(sentence)
+        used += tokens
+    return " ".join(sentences)
+
+# Build the context for answering the question from the ranked entries
+# Best ranked entries are taken first, near-duplicates are skipped, and the
+# last passage that fits only partially is truncated at a sentence boundary
+# (the prompt and all the candidate passages are counted together, once)
+def build_context(question: str, entries, llm_handler) -> str:
+    candidates = []
+    seen = []       # Word sets of the passages kept so far
+    for entry in entries:
+        text = entry.text.strip()
+        words = set(re.findall(r"\w+", text.lower()))
+        if any(similarity(words, other) >= DEDUP_THRESHOLD for other in seen):
+            Diagnostics.debug(f"skipping near-duplicate passage [{entry.id}]")
+            continue
+        candidates.append((entry, text))
+        seen.append(words)
+
+    counts = llm_handler.count_tokens_many([llm_handler.query_prompt(question, "")] +
+                                           [text for _, text in candidates])
+    budget = llm_handler.context_budget(question, overhead=counts[0])
+    passages = []
+    used = 0
+    for (entry, text), count in zip(candidates, counts[1:]):
+        # (allow a token for the newline joining passages)
+        tokens = count + 1
+        if used + tokens > budget:
+            remaining = budget - used
+            if remaining >= MIN_PASSAGE_TOKENS:
+                text = truncate_to_budget(text, remaining, count)
+                if text:
+                    Diagnostics.debug(f"truncated passage [{entry.id}] to fit the context budget")
+                    passages.append(text)
+            break
+
+        passages.append(text)
+        used += tokens
+
+    Diagnostics.debug(f"context holds {len(passages)} of {len(entries)} passages, "
+                      f"~{used} of {budget} budgeted tokens")
+    return "\n".join(passages)
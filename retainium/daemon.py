@@ -0,0 +1,194 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Long-running daemon serving the knowledge base over a local HTTP API,
+# and the client used by the CLI to talk to it
+#
+# Endpoints (JSON in, JSON out):
+#   GET  /health  - liveness check
+#   POST /query   - {"text", "top_k", "similarity_only", "no_cache", "mode", "filters", "rerank"}
+#   POST /add     - {"text", "source"}
+#   POST /import  - {"input", "force", "prune", "workers", "restore"}
+#   POST /list    - {"offset", "limit", "filters"}
+#   POST /rebuild - {"re_embed", "re_tag"}
+#
+# "filters" are {"source", "tags", "since", "until"}, as in retainium.filters
+
+# Import required modules
+import os
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from retainium.diagnostics import Diagnostics
+from retainium.filters import build_where
+
+# Default address of the daemon
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+class DaemonClient:
+    """Talks to a running daemon; used by the CLI to act as a thin client."""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        self.host = host
+        self.port = port
+
+    def url(self, endpoint: str) -> str:
+        return f"http://{self.host}:{self.port}{endpoint}"
+
+    # Query if a daemon is listening
+    # (a refused local connection fails immediately, so this is cheap)
+    def is_running(self) -> bool:
+        try:
+            with urllib.request.urlopen(self.url("/health"), timeout=0.5) as response:
+                return response.status == 200
+        except (urllib.error.URLError, ConnectionError, OSError):
+            return False
+
+    # POST a request to the daemon and return the decoded reply
+    def request(self, endpoint: str, payload: dict) -> dict:
+        request = urllib.request.Request(
+                                            self.url(endpoint),
+                                            data=json.dumps(payload).encode("utf-8"),
+                                            headers={"Content-Type": "application/json"},
+                                        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read().decode("utf-8")).get("error", str(e))
+            except ValueError:
+                message = str(e)
+            raise RuntimeError(f"daemon request {endpoint} failed: {message}")
+        except urllib.error.URLError as e:
+            raise RuntimeError(f"daemon request {endpoint} failed: {e}")
+
+class DaemonServer(ThreadingHTTPServer):
+    """Keeps the handlers resident and serves each client in its own thread.
+    Reads run concurrently (similarity searches coalesced into batches by the
+    query engine, if given); writes to the knowledge base are serialized."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, knowledge_db, embedding_handler, llm_handler, engine=None, reranker=None,
+                 query_cache=None):
+        super().__init__(address, DaemonRequestHandler)
+        self.knowledge_db = knowledge_db
+        self.embedding_handler = embedding_handler
+        self.llm_handler = llm_handler
+        self.engine = engine
+        self.reranker = reranker
+        self.query_cache = query_cache
+        self.write_lock = threading.Lock()
+
+    # Handle "/query"
+    def query(self, request: dict) -> dict:
+        from retainium import query_knowledge
+        query_text = request["text"].strip()
+        if not query_text:
+            return {"entries": [], "answer": None}
+        reranker = self.reranker if request.get("rerank", True) else None
+        top_k = query_knowledge.resolve_top_k(int(request.get("top_k") or 0), reranker)
+        results, generation = query_knowledge.search(query_text, top_k,
+                                                     self.knowledge_db, self.embedding_handler,
+                                                     engine=self.engine,
+                                                     mode=request.get("mode", "vector"),
+                                                     where=build_where(**(request.get("filters") or {})),
+                                                     reranker=reranker)
+        response = None
+        if results and not request.get("similarity_only"):
+            if self.llm_handler is None:
+                raise RuntimeError("LLM integration is disabled in config.")
+            response = query_knowledge.answer(query_text, top_k, results, generation, self.llm_handler,
+                                              cache=None if request.get("no_cache") else self.query_cache)
+        return {"entries": [entry.to_dict() for entry in results], "answer": response}
+
+    # Handle "/add"
+    def add(self, request: dict) -> dict:
+        with self.write_lock:
+            added = self.knowledge_db.add_entry(request["text"].strip(), request.get("source") or "CLI",
+                                                self.embedding_handler, self.llm_handler)
+        return {"added": added}
+
+    # Handle "/import"
+    def import_files(self, request: dict) -> dict:
+        from retainium import import_knowledge
+        with self.write_lock:
+            return import_knowledge.import_inputs(
+                                                    request["input"],
+                                                    self.knowledge_db, self.embedding_handler, self.llm_handler,
+                                                    force=bool(request.get("force")),
+                                                    prune=bool(request.get("prune")),
+                                                    workers=int(request.get("workers") or 0),
+                                                    restore=bool(request.get("restore")),
+                                                 )
+
+    # Handle "/rebuild"
+    # (queries keep being served, from the old index until the new one is
+    #  swapped in)
+    def rebuild(self, request: dict) -> dict:
+        re_tag = bool(request.get("re_tag"))
+        if re_tag and self.llm_handler is None:
+            raise RuntimeError("re-tagging requires the LLM to be enabled in config")
+        with self.write_lock:
+            nr = self.knowledge_db.rebuild(self.embedding_handler, self.llm_handler,
+                                           re_embed=bool(request.get("re_embed")), re_tag=re_tag)
+        return {"entries": nr}
+
+    # Handle "/list"
+    def list_entries(self, request: dict) -> dict:
+        where = build_where(**(request.get("filters") or {}))
+        entries = self.knowledge_db.list_entries_page(int(request.get("offset", 0)),
+                                                      int(request.get("limit", 1000)), where=where)
+        return {"count": self.knowledge_db.count(where=where), "entries": [entry.to_dict() for entry in entries]}
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    # Map of endpoints to the DaemonServer methods handling them
+    ROUTES = {
+        "/query": "query",
+        "/add": "add",
+        "/import": "import_files",
+        "/list": "list_entries",
+        "/rebuild": "rebuild",
+    }
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, {"status": "ok", "pid": os.getpid()})
+        else:
+            self._reply(404, {"error": f"unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        route = self.ROUTES.get(self.path)
+        if route is None:
+            self._reply(404, {"error": f"unknown endpoint {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+        except ValueError as e:
+            self._reply(400, {"error": f"bad request: {e}"})
+            return
+        try:
+            self._reply(200, getattr(self.server, route)(request))
+        except KeyError as e:
+            self._reply(400, {"error": f"bad request: missing {e}"})
+        except Exception as e:
+            Diagnostics.error(f"{self.path} failed: {e}")
+            self._reply(500, {"error": str(e)})
+
+    def _reply(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Route the access log through the diagnostics
+    def log_message(self, format, *args):
+        Diagnostics.debug(f"{self.address_string()} {format % args}")
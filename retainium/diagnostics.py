@@ -10,6 +10,7 @@ class Diagnostics:
     """Handles logging of errors, warnings, notes, and debug messages."""
 
     _debug_enabled = False  # Controls debug output
+    _quiet = False          # Suppresses notes and success messages
     _lock = threading.Lock()  # Ensures thread-safe output
 
     @classmethod
@@ -22,11 +23,19 @@ class Diagnostics:
         """Query if debug mode is enabled or not."""
         return cls._debug_enabled
 
+    @classmethod
+    def enable_quiet(cls, enabled: bool):
+        """Enables or disables quiet mode (only errors, warnings and debug
+        messages are shown)."""
+        cls._quiet = enabled
+
     @classmethod
     def diagnostic(cls, severity: str, message: str):
         """Prints a diagnostic message with a given severity."""
         if severity == "debug" and not cls._debug_enabled:
             return  # Skip debug messages unless debugging is enabled
+        if severity in ("note", "success") and cls._quiet:
+            return
 
         color_code = color.TerminalColors.get_color(severity)
         reset = color.TerminalColors.get_color("reset")
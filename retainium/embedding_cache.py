@@ -0,0 +1,146 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# On-disk cache of embeddings, keyed by (embedding model name, text uuid)
+
+# Import required modules
+import os
+import time
+import sqlite3
+import threading
+from array import array
+from typing import Dict, List, Optional
+from retainium.diagnostics import Diagnostics
+
+# Maximum number of bound parameters per SQL statement
+# (stay well below SQLite's historical limit of 999)
+SQL_BATCH_SIZE = 500
+
+class EmbeddingCache:
+    """Size-bounded, least-recently-used embedding cache backed by SQLite."""
+
+    def __init__(self, path: str, max_entries: int = 100000):
+        self.path = path
+        self.max_entries = max(max_entries, 1)
+        self.hits = 0    # Lookups served from the cache (this session)
+        self.misses = 0  # Lookups that needed the model (this session)
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, uuid TEXT NOT NULL, vector BLOB NOT NULL, "
+                "last_used REAL NOT NULL, PRIMARY KEY (model, uuid))"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+        Diagnostics.debug(f"embedding cache opened at {path} (max {self.max_entries} entries)")
+
+    # Fetch the cached embeddings for the given text uuids
+    # Return a mapping of uuid to embedding for the uuids found
+    def get_many(self, model: str, uuids: List[str]) -> Dict[str, list]:
+        found = {}
+        with self._lock, self.connection:
+            for start in range(0, len(uuids), SQL_BATCH_SIZE):
+                batch = uuids[start:start + SQL_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT uuid, vector FROM embeddings WHERE model = ? AND uuid IN ({placeholders})",
+                    [model] + batch,
+                ).fetchall()
+                for uuid, vector in rows:
+                    found[uuid] = array("f", vector).tolist()
+
+            # Refresh the recency of the hits
+            now = time.time()
+            self.connection.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND uuid = ?",
+                [(now, model, uuid) for uuid in found],
+            )
+
+            # Update the hit/miss counters
+            hits = len(found)
+            misses = len(set(uuids)) - hits
+            self.hits += hits
+            self.misses += misses
+            self._bump_counter("hits", hits)
+            self._bump_counter("misses", misses)
+        return found
+
+    # Store the embeddings for the given text uuids, evicting the least
+    # recently used entries beyond the configured size
+    def put_many(self, model: str, embeddings: Dict[str, list]) -> None:
+        if not embeddings:
+            return
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, uuid, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, uuid, array("f", vector).tobytes(), now) for uuid, vector in embeddings.items()],
+            )
+            excess = self._count() - self.max_entries
+            if excess > 0:
+                self.connection.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._bump_counter("evictions", excess)
+                Diagnostics.debug(f"evicted {excess} least recently used embeddings from cache")
+
+    # Remove cached embeddings (all, or only those of the given model)
+    # Return the number of embeddings removed
+    def purge(self, model: Optional[str] = None) -> int:
+        with self._lock, self.connection:
+            if model:
+                cursor = self.connection.execute("DELETE FROM embeddings WHERE model = ?", (model,))
+            else:
+                cursor = self.connection.execute("DELETE FROM embeddings")
+                self.connection.execute("DELETE FROM counters")
+            removed = cursor.rowcount
+        with self._lock:
+            self.connection.execute("VACUUM")
+        return removed
+
+    # Summarize the cache contents and the lifetime hit/miss counters
+    def stats(self) -> dict:
+        with self._lock:
+            models = dict(self.connection.execute(
+                "SELECT model, COUNT(*) FROM embeddings GROUP BY model"
+            ).fetchall())
+            counters = dict(self.connection.execute("SELECT name, value FROM counters").fetchall())
+        return {
+            "path": self.path,
+            "entries": sum(models.values()),
+            "max_entries": self.max_entries,
+            "size_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "models": models,
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+    # Number of cached embeddings (caller holds the lock)
+    def _count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    # Accumulate a persistent counter (caller holds the lock)
+    def _bump_counter(self, name: str, amount: int) -> None:
+        if amount:
+            self.connection.execute(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                (name, amount),
+            )
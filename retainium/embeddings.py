@@ -1,20 +1,100 @@
 # Copyright (C) 2024-2025 Soumitra Chatterjee
 # Licensed under the GNU AGPL-3.0. See LICENSE file for details.
 
-from sentence_transformers import SentenceTransformer
+import threading
+from typing import List
 from retainium.diagnostics import Diagnostics
+from retainium.knowledge import compute_text_uuid
+from retainium.tracing import Tracer
+
+# The available inference backends
+# ("torch" runs SentenceTransformer; "onnx" runs the model's ONNX export with
+#  ONNX Runtime, without loading torch)
+BACKENDS = ("torch", "onnx")
 
 class EmbeddingHandler:
-    def __init__(self, model_name: str):
+    def __init__(self, model_name: str, batch_size: int = 32, cache=None, backend: str = "torch",
+                 threads: int = 0, quantize: bool = True, onnx_cache_dir: str = "data/models/onnx"):
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown embedding backend \"{backend}\"; expected one of {', '.join(BACKENDS)}")
         self.model_name = model_name
-        Diagnostics.note(f"loading embedding model: {model_name}")
-        self.model = SentenceTransformer(model_name)
+        self.batch_size = max(batch_size, 1)
+        self.cache = cache      # Optional EmbeddingCache, consulted before the model
+        self.backend = backend
+        self.threads = threads  # Intra-op threads (0 for the library default)
+        self.quantize = quantize and backend == "onnx"
+        self.onnx_cache_dir = onnx_cache_dir
+        self._model = None      # Loaded on first cache miss
+        self._model_lock = threading.Lock()
+
+    # The name embeddings are cached under
+    # (vectors from different backends differ slightly, so are kept apart;
+    #  torch keeps the bare model name, that of caches predating backends)
+    @property
+    def cache_key(self) -> str:
+        if self.backend == "torch":
+            return self.model_name
+        return f"{self.model_name}@{self.backend}" + ("-int8" if self.quantize else "")
+
+    # The underlying model (SentenceTransformer, or an equivalent running on
+    # ONNX Runtime), loaded on first use
+    @property
+    def model(self):
+        with self._model_lock:
+            if self._model is None:
+                Diagnostics.note(f"loading embedding model: {self.model_name} ({self.backend})")
+                if self.backend == "onnx":
+                    from retainium.onnx_embeddings import OnnxEncoder
+                    self._model = OnnxEncoder(self.model_name, self.onnx_cache_dir,
+                                              quantize=self.quantize, threads=self.threads)
+                else:
+                    # Deferred import; pulls in torch, which is expensive
+                    from sentence_transformers import SentenceTransformer
+                    if self.threads > 0:
+                        import torch
+                        torch.set_num_threads(self.threads)
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model
 
     def embed(self, text: str) -> list:
         if not text.strip():
             Diagnostics.error("attempted to embed empty text.")
             return []
 
-        embedding = self.model.encode(text, convert_to_tensor=False).tolist()
-        return embedding
+        return self.embed_batch([text])[0]
+
+    # Embed many texts with one model call per batch of "batch_size" texts
+    # (empty texts yield empty embeddings, in place)
+    def embed_batch(self, texts: List[str]) -> List[list]:
+        embeddings = [[] for _ in texts]
+        indices = [i for i, text in enumerate(texts) if text.strip()]
+        if len(indices) < len(texts):
+            Diagnostics.error(f"attempted to embed {len(texts) - len(indices)} empty text(s).")
+        if not indices:
+            return embeddings
+
+        # Serve what we can from the cache
+        uuids = {i: compute_text_uuid(texts[i]) for i in indices}
+        if self.cache is not None:
+            cached = self.cache.get_many(self.cache_key, list(set(uuids.values())))
+            for i in indices:
+                if uuids[i] in cached:
+                    embeddings[i] = cached[uuids[i]]
+            indices = [i for i in indices if uuids[i] not in cached]
+            if not indices:
+                return embeddings
+
+        # Run the model over the rest
+        with Tracer.span("embed", texts=len(indices)):
+            vectors = self.model.encode(
+                                        [texts[i] for i in indices],
+                                        batch_size=self.batch_size,
+                                        convert_to_tensor=False,
+                                       )
+        for i, vector in zip(indices, vectors):
+            embeddings[i] = vector.tolist()
 
+        # Remember the new embeddings
+        if self.cache is not None:
+            self.cache.put_many(self.cache_key, {uuids[i]: embeddings[i] for i in indices})
+        return embeddings
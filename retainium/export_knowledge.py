@@ -4,20 +4,54 @@
 # Module to export all knowledge to a file
 
 import json
+import textwrap
 from retainium.diagnostics import Diagnostics
 
+# Supported export formats
+#   json  - a single JSON array (the default)
+#   jsonl - JSON Lines, one entry per line
+EXPORT_FORMATS = ("json", "jsonl")
+
 def register(subparsers):
-    parser = subparsers.add_parser("export", help="Export all entries to JSON")
+    parser = subparsers.add_parser("export", help="Export all entries to JSON or JSON Lines")
     parser.add_argument("--output", required=True, help="Path to output file")
-    parser.set_defaults(func=run)
+    parser.add_argument("--format", choices=EXPORT_FORMATS, help="Output format (default: from the file extension, else json)")
+    parser.add_argument("--include-embeddings", action="store_true", help="Include embeddings, for backup and restore")
+    parser.set_defaults(func=run, exclusive=True)
 
 # Handling of the "export" command
+# (entries are streamed from the database and written as they arrive)
 def run(args, knowledge_db, *_):
-    kb = knowledge_db.export_all()
+    format = args.format or ("jsonl" if args.output.endswith(".jsonl") else "json")
+    entries = knowledge_db.iter_entries(include_embeddings=args.include_embeddings)
     try:
         with open(args.output, "w", encoding="utf-8") as f:
-            json.dump(kb, f, indent=2, ensure_ascii=False)
-        Diagnostics.note(f"exported all entries to {args.output}")
+            if format == "jsonl":
+                nr = write_jsonl(f, entries)
+            else:
+                nr = write_json(f, entries)
+        Diagnostics.note(f"exported {nr} entries to {args.output}")
     except Exception as e:
         Diagnostics.error(f"failed to export: {e}")
 
+# Write entries as JSON Lines
+# Return the number of entries written
+def write_jsonl(f, entries) -> int:
+    nr = 0
+    for entry in entries:
+        f.write(json.dumps(entry.to_dict(), ensure_ascii=False))
+        f.write("\n")
+        nr += 1
+    return nr
+
+# Write entries as an indented JSON array, one element at a time
+# (the layout matches json.dump(..., indent=2) of the whole list)
+# Return the number of entries written
+def write_json(f, entries) -> int:
+    nr = 0
+    for entry in entries:
+        f.write(",\n" if nr else "[\n")
+        f.write(textwrap.indent(json.dumps(entry.to_dict(), indent=2, ensure_ascii=False), "  "))
+        nr += 1
+    f.write("\n]" if nr else "[]")
+    return nr
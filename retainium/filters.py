@@ -0,0 +1,68 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Metadata filters (source, tags and date range) for the commands that read
+# the knowledge base, translated into ChromaDB "where" clauses
+
+# Import required modules
+import argparse
+from datetime import datetime, timedelta
+from typing import List, Optional
+from retainium.knowledge import tag_key
+
+# Register the filter options of a command
+def register_filters(parser) -> None:
+    parser.add_argument("--source", type=str, help="Only entries from this source")
+    parser.add_argument("--tag", action="append", dest="tags", metavar="TAG",
+                        help="Only entries with this tag (repeat to require several)")
+    parser.add_argument("--since", type=since_timestamp, metavar="DATE",
+                        help="Only entries added on or after this date (YYYY-MM-DD[THH:MM[:SS]])")
+    parser.add_argument("--until", type=until_timestamp, metavar="DATE",
+                        help="Only entries added on or before this date (YYYY-MM-DD[THH:MM[:SS]])")
+
+# Parse a date (or date and time)
+def parse_date(value: str) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date \"{value}\"; expected YYYY-MM-DD[THH:MM[:SS]]")
+
+# Start of the range given by "--since"
+def since_timestamp(value: str) -> int:
+    return int(parse_date(value).timestamp())
+
+# End of the range given by "--until" (inclusive; a date covers the whole day)
+def until_timestamp(value: str) -> int:
+    date = parse_date(value)
+    if len(value) <= len("YYYY-MM-DD"):
+        return int((date + timedelta(days=1)).timestamp()) - 1
+    return int(date.timestamp())
+
+# The filters given on the command line, as sent to a daemon
+def filters_from_args(args) -> dict:
+    return {
+        "source": args.source,
+        "tags": args.tags,
+        "since": args.since,
+        "until": args.until,
+    }
+
+# Build the "where" clause matching all of the given filters
+# Return None if there are no filters
+def build_where(source: Optional[str] = None, tags: Optional[List[str]] = None,
+                since: Optional[int] = None, until: Optional[int] = None) -> Optional[dict]:
+    conditions = []
+    if source:
+        conditions.append({"source": source})
+    for tag in tags or []:
+        conditions.append({tag_key(tag): True})
+    if since is not None:
+        conditions.append({"added": {"$gte": since}})
+    if until is not None:
+        conditions.append({"added": {"$lte": until}})
+
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
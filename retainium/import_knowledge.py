@@ -1,34 +1,125 @@
 # Copyright (C) 2024-2025 Soumitra Chatterjee
 # Licensed under the GNU AGPL-3.0. See LICENSE file for details.
 
-# Module to import knowledge to the database from a file
+# Module to import knowledge to the database from files
 
 # Import required modules
 import os
+import glob
 import json
+import time
+import threading
+import multiprocessing
+from typing import List, Optional
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
 from retainium.diagnostics import Diagnostics
-from retainium.text_utils import chunk_text, extract_and_chunk_pdf
+from retainium.knowledge import compute_text_uuid
+from retainium.manifest import IngestManifest, MANIFEST_FILE_NAME, file_state
+from retainium.pipeline import Pipeline
+from retainium.text_utils import TextHandler, chunk_text, extract_and_chunk_pdf
+from retainium.tracing import Tracer, call_traced
+
+# File types picked up when importing a directory
+IMPORTABLE_EXTENSIONS = (".pdf", ".json", ".jsonl", ".txt", ".md")
+
+# Maximum number of chunks waiting between the stages of the import pipeline
+PIPELINE_QUEUE_SIZE = 64
+
+# Maximum number of chunks checked for duplicates at once by the tag stage
+TAG_BATCH_SIZE = 16
 
 # Register command line options for "import"
 def register(subparsers):
-    parser = subparsers.add_parser("import", help="Import new knowledge entries from file")
-    parser.add_argument("--input", required=True, help="Path to file containing knowledge (plain text or JSON)")
+    parser = subparsers.add_parser("import", help="Import new knowledge entries from files")
+    parser.add_argument("--input", required=True, nargs="+", help="Files, directories or glob patterns containing knowledge (plain text, JSON or PDF)")
     parser.add_argument("--mbox", action="store_true", help="File to be imported is a Thunderbird mailbox (MBOX format)")
-    parser.set_defaults(func=run)
+    parser.add_argument("--force", action="store_true", help="Re-process files even if unchanged since the last import")
+    parser.add_argument("--prune", action="store_true", help="Remove entries of chunks that no longer exist in a changed file")
+    parser.add_argument("--workers", type=int, default=0, help="Number of parallel extraction processes (default: one per CPU)")
+    parser.add_argument("--restore", action="store_true", help="Restore exported entries (JSON or JSON Lines) as they are, without summarizing, tagging or, where included, embedding")
+    parser.set_defaults(func=run, remote=remote)
 
 # Handling of the "import" command
 def run(args, knowledge_db, embedding_handler, llm_handler):
-    json_data = None
     #if args.mbox:
     #    Diagnostics.warning("MBOX format")
+    import_inputs(args.input, knowledge_db, embedding_handler, llm_handler,
+                  force=args.force, prune=args.prune, workers=args.workers, restore=args.restore)
+
+# Handling of the "import" command by a running daemon
+# (paths are resolved here, since the daemon may run from another directory)
+def remote(args, client):
+    paths = [os.path.realpath(path) for path in expand_inputs(args.input)]
+    if not paths:
+        Diagnostics.error("no importable files found")
+        return
+    response = client.request("/import", {
+                                            "input": paths,
+                                            "force": args.force,
+                                            "prune": args.prune,
+                                            "workers": args.workers,
+                                            "restore": args.restore,
+                                         })
+    Diagnostics.note(f"imported {response['files']} files ({response['chunks']} chunks), "
+                     f"{response['failed']} failed")
+
+# Import files, directories or glob patterns
+# Return counts of the files imported, the chunks imported and the files failed
+def import_inputs(inputs, knowledge_db, embedding_handler, llm_handler,
+                  force: bool = False, prune: bool = False, workers: int = 0, restore: bool = False) -> dict:
+    counts = {"files": 0, "chunks": 0, "failed": 0}
+    paths = expand_inputs(inputs)
+    if not paths:
+        Diagnostics.error("no importable files found")
+        return counts
+
+    # Restore a previous export verbatim
+    if restore:
+        for path in paths:
+            nr = restore_file(path, knowledge_db, embedding_handler, llm_handler)
+            counts["files"] += 1
+            counts["chunks"] += nr
+        return counts
+
+    # The manifest doubles as the checkpoint of an interrupted bulk import
+    manifest = IngestManifest(os.path.join(knowledge_db.persist_directory, MANIFEST_FILE_NAME))
+    return import_files(paths, knowledge_db, embedding_handler, llm_handler, manifest,
+                        force=force, prune=prune, workers=workers or os.cpu_count() or 1)
+
+# Expand files, directories (recursively) and glob patterns into files
+def expand_inputs(inputs):
+    paths = []
+    for pattern in inputs:
+        matches = glob.glob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            Diagnostics.warning(f"no files match \"{pattern}\"")
+        for match in sorted(matches):
+            if os.path.isdir(match):
+                for directory, _, files in sorted(os.walk(match)):
+                    paths.extend(os.path.join(directory, name) for name in sorted(files)
+                                 if name.lower().endswith(IMPORTABLE_EXTENSIONS))
+            else:
+                paths.append(match)
+
+    # Drop duplicates, keeping the first occurrence
+    return list(dict.fromkeys(paths))
+
+# Read a file into a list of JSON entries, each with a "text" field
+# Return None if the file cannot be read
+def read_entries(path: str):
+    json_data = None
     try:
-        with open(args.input, "r", encoding="utf-8") as f:
-            if args.input.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith(".json"):
                 # Load the JSON data from the file
                 json_data = json.load(f)
-            elif args.input.endswith(".pdf"):
+            elif path.endswith(".jsonl"):
+                # Load one JSON entry per line
+                json_data = [json.loads(line) for line in f if line.strip()]
+            elif path.endswith(".pdf"):
                 # Create a list of JSON entries using the chunks of text from the PDF
-                chunks = extract_and_chunk_pdf(args.input)
+                chunks = extract_and_chunk_pdf(path)
                 Diagnostics.note(f"pdf file chunked into {len(chunks)} chunks")
                 json_data = [{ "text": chunk } for chunk in chunks]
             else:
@@ -37,37 +128,410 @@ def run(args, knowledge_db, embedding_handler, llm_handler):
                 Diagnostics.note(f"text file chunked into {len(chunks)} chunks")
                 json_data = [{ "text": chunk } for chunk in chunks]
     except Exception as e:
-        Diagnostics.error(f"failed to read input file: {e}")
-        return
+        Diagnostics.error(f"failed to read input file {path}: {e}")
+        return None
 
     # Normalize: if it's a single entry (dict), wrap it in a list
     if isinstance(json_data, dict):
-        entries = [json_data]
+        return [json_data]
     elif isinstance(json_data, list):
-        entries = json_data
-    else:
-        Diagnostics.error("invalid JSON format: expected a list or a dict.")
+        return json_data
+    Diagnostics.error(f"invalid JSON format in {path}: expected a list or a dict.")
+    return None
+
+# Capture the state of a file for the manifest, then read it into entries
+# Return the state and the entries (None for both if the file cannot be read)
+def extract_file(path: str):
+    try:
+        state = file_state(path)
+    except OSError as e:
+        Diagnostics.error(f"failed to read input file {path}: {e}")
+        return None, None
+    return state, read_entries(path)
 
-    # Add each entry into the knowledge database
-    prior_context = ""
-    for entry in entries:
+# Stream the records of an export, JSON Lines one line at a time
+def read_records(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            json_data = json.load(f)
+            yield from ([json_data] if isinstance(json_data, dict) else json_data)
+
+# Restore exported entries as they are, in batches
+# (entries exported with --include-embeddings are not re-embedded)
+# Return the number of entries restored
+def restore_file(path, knowledge_db, embedding_handler, llm_handler) -> int:
+    def flush(batch):
+        if batch:
+            return knowledge_db.add_entries(
+                                            [record["text"].strip() for record in batch],
+                                            [record.get("source", "unknown") for record in batch],
+                                            embedding_handler, llm_handler,
+                                            tags=[record.get("tags", []) for record in batch],
+                                            embeddings=[record.get("embedding", []) for record in batch],
+                                            added=[int(record.get("added") or 0) for record in batch],
+                                           )
+        return 0
+
+    nr = 0
+    batch = []
+    try:
+        for record in read_records(path):
+            batch.append(record)
+            if len(batch) >= knowledge_db.write_batch_size:
+                nr += flush(batch)
+                batch = []
+        nr += flush(batch)
+    except Exception as e:
+        Diagnostics.error(f"failed to restore {path}: {e}")
+    Diagnostics.note(f"restored {nr} entries from {path}")
+    return nr
+
+# Setup an extraction worker process
+def _init_worker(text_settings: dict, debug: bool, profile: bool = False):
+    TextHandler.restore(text_settings)
+    Diagnostics.enable_debug(debug)
+    Tracer.enable(profile)
+    Tracer.drain()  # (forked workers inherit the spans of the parent)
+
+# Import many files: extraction and chunking run in a pool of worker
+# processes, and the chunks then flow through a pipeline of threads that
+# summarize, tag, embed and write them, each stage working on a different
+# chunk at the same time
+# Return counts of the files imported, the chunks imported and the files failed
+def import_files(paths, knowledge_db, embedding_handler, llm_handler, manifest,
+                 force: bool = False, prune: bool = False, workers: int = 1) -> dict:
+    # Skip the files imported before and unchanged since
+    sources = {path: os.path.realpath(path) for path in paths}
+    if not force:
+        unchanged = [path for path in paths if manifest.is_unchanged(sources[path])]
+        for path in unchanged:
+            Diagnostics.note(f"skipping unchanged file {path}")
+        paths = [path for path in paths if path not in unchanged]
+        manifest.save()  # Persist refreshed mtimes, if any
+    if not paths:
+        return {"files": 0, "chunks": 0, "failed": 0}
+
+    progress = ImportProgress(len(paths))
+    pipeline = Pipeline(queue_size=PIPELINE_QUEUE_SIZE)
+    pipeline.add_stage("summarize", ImportSummarizer(knowledge_db, llm_handler, force))
+    pipeline.add_stage("tag", lambda batch: tag_stage(batch, knowledge_db, llm_handler),
+                       max_batch=TAG_BATCH_SIZE)
+    pipeline.add_stage("embed", lambda batch: embed_stage(batch, embedding_handler),
+                       max_batch=embedding_handler.batch_size)
+    pipeline.add_stage("write", ImportWriter(knowledge_db, embedding_handler, llm_handler,
+                                             manifest, prune, progress))
+    pipeline.start()
+    extracted = extract_files(paths, workers)
+    try:
+        for path, (state, entries) in extracted:
+            if entries is not None:
+                # (with --force, the chunks recorded are not reused, but are
+                #  still what --prune compares the new chunks against)
+                record = manifest.get(sources[path])
+                previous = {} if record is None else dict(record["chunks"])
+                pipeline.put(("begin", sources[path], previous, path, state))
+                for entry in entries:
+                    pipeline.put(("entry", entry))
+                pipeline.put(("end", sources[path], previous, path))
+            else:
+                progress.file_done(path, 0, failed=True)
+    except BaseException:
+        # Interrupted: stop once the chunks in progress are done, dropping
+        # the queued ones (the manifest checkpoints of the files written so
+        # far let the next import resume from there)
+        Diagnostics.warning("import interrupted, finishing the chunks in progress")
+        extracted.close()
+        pipeline.cancel()
+        raise
+    pipeline.finish()
+    progress.summary()
+    pipeline.report()
+    return {"files": progress.files - progress.failed, "chunks": progress.chunks, "failed": progress.failed}
+
+# Yield (path, (state, entries)) for each file, extracting in worker processes
+# (at most twice the number of workers are in flight, bounding memory)
+def extract_files(paths, workers: int):
+    if workers <= 1 or len(paths) == 1:
+        for path in paths:
+            yield path, extract_file(path)
+        return
+
+    # Share the OCR workers between the extraction workers
+    text_settings = TextHandler().settings()
+    text_settings["ocr_workers"] = max(text_settings["ocr_workers"] // workers, 1)
+    # (the spans timed by the workers come back with their results; workers
+    #  are spawned rather than forked, as the parent may be a multithreaded
+    #  daemon with torch loaded)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(text_settings, Diagnostics.is_debug_enabled(),
+                                       Tracer.is_enabled()),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        in_flight = []
+        remaining = iter(paths)
+        for path in remaining:
+            in_flight.append((path, pool.submit(call_traced, extract_file, path)))
+            if len(in_flight) >= 2 * workers:
+                break
+        try:
+            while in_flight:
+                path, future = in_flight.pop(0)
+                extracted, spans = future.result()
+                Tracer.merge(spans)
+                yield path, extracted
+                for next_path in remaining:
+                    in_flight.append((next_path, pool.submit(call_traced, extract_file, next_path)))
+                    break
+        finally:
+            # (when interrupted, only wait for the extractions already running)
+            for _, future in in_flight:
+                future.cancel()
+
+# Tracks and reports the progress and throughput of an import
+class ImportProgress:
+    def __init__(self, total_files: int):
+        self.total_files = total_files
+        self.files = 0
+        self.chunks = 0
+        self.failed = 0
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def file_done(self, path: str, chunks: int, failed: bool = False) -> None:
+        with self._lock:
+            self.files += 1
+            self.chunks += chunks
+            self.failed += failed
+            elapsed = max(time.monotonic() - self.start, 1e-9)
+            status = "failed" if failed else f"{chunks} chunks"
+            Diagnostics.note(f"[{self.files}/{self.total_files}] {path}: {status} "
+                             f"({self.files / elapsed:.2f} files/s, {self.chunks / elapsed:.2f} chunks/s)")
+
+    def summary(self) -> None:
+        elapsed = time.monotonic() - self.start
+        Diagnostics.note(f"imported {self.files - self.failed} of {self.total_files} files "
+                         f"({self.chunks} chunks) in {elapsed:.1f}s")
+
+# A chunk of an imported file, as it moves through the import pipeline
+@dataclass
+class ImportChunk:
+    chunk_id: Optional[str]
+    entry_id: Optional[str]             # Entry produced by the chunk, if any
+    text: Optional[str] = None          # Summary to add (None if reused or nothing new)
+    tags: Optional[List[str]] = None
+    embedding: Optional[list] = None
+    reused: bool = False                # Whether the entry was recorded by a previous import
+    failed: bool = False
+
+# Messages passed along the import pipeline
+#   ("begin", source, previous, path, state) - start of a file (in the state
+#                                              given by manifest.file_state())
+#   ("entry", entry)                         - an extracted chunk (summarize stage input)
+#   ("chunk", ImportChunk)                   - a summarized chunk
+#   ("end", source, previous, path)          - end of a file
+
+# Summarize stage: summarize each new chunk of a file, chaining the prior context
+# (chunks recorded in "previous" reuse their entries without LLM work, unless
+#  "force" is given; with [llm] combined_summary_tags, the summary is tagged by
+#  the same generation; otherwise, or if that fails, tags are None)
+class ImportSummarizer:
+    def __init__(self, knowledge_db, llm_handler, force: bool = False):
+        self.knowledge_db = knowledge_db
+        self.llm_handler = llm_handler
+        self.force = force
+        self.path = None
+        self.reusable = {}
+        self.prior_context = ""
+        self.prior_entry = None     # Entry whose text is the prior context, if not yet fetched
+
+    def __call__(self, batch):
+        for message in batch:
+            if message[0] == "begin":
+                _, _, previous, self.path, _ = message
+                self.reusable = {} if self.force else previous
+                self.prior_context = ""
+                self.prior_entry = None
+                yield message
+            elif message[0] == "entry":
+                try:
+                    chunk = self._summarize(message[1])
+                except Exception as e:
+                    Diagnostics.error(f"failed to summarize a chunk of {self.path}: {e}")
+                    chunk = ImportChunk(None, None, failed=True)
+                yield ("chunk", chunk)
+            else:
+                yield message
+
+    # Summarize one chunk, or reuse the result of an already imported one
+    def _summarize(self, entry) -> ImportChunk:
         text = entry["text"].strip()
-        source = os.path.realpath(args.input)
+        chunk_id = compute_text_uuid(text)
+        if chunk_id in self.reusable:
+            entry_id = self.reusable[chunk_id]
+            if entry_id:
+                self.prior_entry = entry_id
+            return ImportChunk(chunk_id, entry_id, reused=True)
+
+        # Fetch the prior context left by reused chunks
+        if self.prior_entry:
+            found = self.knowledge_db.get_entries([self.prior_entry])
+            self.prior_context = found[0].text if found else self.prior_context
+            self.prior_entry = None
 
         # Summarize key information
         # (leverage prior context, if available)
-        text = llm_handler.summarize_info(text, prior_context)
+        tags = None
+        if self.llm_handler.combined_summary_tags:
+            text, tags = self.llm_handler.summarize_and_tag(text, self.prior_context)
+        else:
+            text = self.llm_handler.summarize_info(text, self.prior_context)
         if text:
             Diagnostics.debug(f"Summary info: {text}")
-            Diagnostics.debug(f"Prior context: {prior_context}")
-            prior_context = text
-        else:
-            Diagnostics.warning(f"Summary info: no new info")
-            continue
+            Diagnostics.debug(f"Prior context: {self.prior_context}")
+            self.prior_context = text
+            return ImportChunk(chunk_id, compute_text_uuid(text), text, tags)
+        Diagnostics.warning(f"Summary info: no new info")
+        return ImportChunk(chunk_id, None)
+
+# Tag stage: generate the tags of the new summaries not tagged while summarizing
+# (summaries already in the database are not tagged, embedded or written again)
+def tag_stage(batch, knowledge_db, llm_handler):
+    chunks = [message[1] for message in batch if message[0] == "chunk" and message[1].text]
+    try:
+        existing = set(knowledge_db.existing_ids([chunk.entry_id for chunk in chunks]))
+    except Exception as e:
+        Diagnostics.error(f"failed to look up entries: {e}")
+        existing = set()
+        for chunk in chunks:
+            chunk.failed = True
+
+    for message in batch:
+        chunk = message[1] if message[0] == "chunk" else None
+        if chunk is not None and chunk.text and not chunk.failed:
+            if chunk.entry_id in existing:
+                Diagnostics.debug(f"duplicate entry skipped: {chunk.entry_id[:16]}")
+                chunk.text = None
+            elif chunk.tags is None:
+                try:
+                    chunk.tags = llm_handler.auto_tags(chunk.text)
+                    Diagnostics.debug(f"auto generated tags: {chunk.tags}")
+                except Exception as e:
+                    Diagnostics.error(f"failed to generate tags: {e}")
+                    chunk.failed = True
+        yield message
 
-        # Add the knowledge to the database
+# Embed stage: embed the new summaries, a batch at a time
+def embed_stage(batch, embedding_handler):
+    chunks = [message[1] for message in batch
+              if message[0] == "chunk" and message[1].text and not message[1].failed]
+    if chunks:
         try:
-            knowledge_db.add_entry(text, source, embedding_handler, llm_handler)
+            for chunk, vector in zip(chunks, embedding_handler.embed_batch([chunk.text for chunk in chunks])):
+                chunk.embedding = vector
         except Exception as e:
-            Diagnostics.error(f"failed to add entry: {e}")
+            Diagnostics.error(f"failed to embed entries: {e}")
+            for chunk in chunks:
+                chunk.failed = True
+    return batch
+
+# Write stage: commit the summarized chunks to the database
+# (records each file in the manifest as its batches are committed, so that
+#  an interrupted import resumes from the last committed batch)
+class ImportWriter:
+    def __init__(self, knowledge_db, embedding_handler, llm_handler, manifest, prune, progress):
+        self.knowledge_db = knowledge_db
+        self.embedding_handler = embedding_handler
+        self.llm_handler = llm_handler
+        self.manifest = manifest
+        self.prune = prune
+        self.progress = progress
+        self.source = None
+        self.state = None
+        self.previous = {}
+        self.chunks = []
+        self.reused = 0
+        self.pending = []
+        self.failed = False
+
+    def __call__(self, batch) -> None:
+        for message in batch:
+            try:
+                self._handle(message)
+            except Exception as e:
+                Diagnostics.error(f"import writer failed: {e}")
+                self.failed = True
+
+    # Handle one message of the pipeline
+    def _handle(self, message) -> None:
+        kind = message[0]
+        if kind == "begin":
+            _, self.source, self.previous, _, self.state = message
+            self.chunks = []    # Chunks of the current file seen so far
+            self.reused = 0     # Of which reused from the previous import
+            self.pending = []   # New chunks waiting to be written
+            self.failed = False
+        elif kind == "chunk":
+            chunk = message[1]
+            if chunk.failed:
+                self.failed = True
+                return
+            self.chunks.append([chunk.chunk_id, chunk.entry_id])
+            self.reused += chunk.reused
+            if chunk.text:
+                self.pending.append(chunk)
+            if len(self.pending) >= self.knowledge_db.write_batch_size:
+                self._commit(complete=False)
+        else:
+            _, _, previous, path = message
+            self._commit(complete=True)
+            if not self.failed and self.prune and previous:
+                self._prune(path)
+            Diagnostics.debug(f"imported {len(self.chunks) - self.reused} new chunks, "
+                              f"reused {self.reused} from {path}")
+            if self.failed:
+                Diagnostics.warning(f"not recording {path} as fully imported due to errors")
+            self.progress.file_done(path, len(self.chunks) - self.reused, failed=self.failed)
+
+    # Write the pending chunks and checkpoint the file's chunks so far
+    # (a partial checkpoint keeps the previously recorded chunks not reached
+    #  yet, so that a resumed import can still reuse and prune them; a file
+    #  with failed chunks keeps being written, but is only ever checkpointed
+    #  partially, so that the next import retries the failed chunks)
+    def _commit(self, complete: bool) -> None:
+        pending, self.pending = self.pending, []
+        if pending:
+            try:
+                self.knowledge_db.add_entries(
+                                                [chunk.text for chunk in pending],
+                                                [self.source] * len(pending),
+                                                self.embedding_handler, self.llm_handler,
+                                                tags=[chunk.tags for chunk in pending],
+                                                embeddings=[chunk.embedding for chunk in pending],
+                                             )
+            except Exception as e:
+                Diagnostics.error(f"failed to add entries: {e}")
+                self.failed = True
+                # (forget the chunks not written, so that they are not reused)
+                unwritten = {chunk.chunk_id for chunk in pending}
+                self.chunks = [chunk for chunk in self.chunks if chunk[0] not in unwritten]
+
+        complete = complete and not self.failed
+        chunks = list(self.chunks)
+        if not complete:
+            seen = {chunk_id for chunk_id, _ in chunks}
+            chunks += [[chunk_id, entry_id] for chunk_id, entry_id in self.previous.items()
+                       if chunk_id not in seen]
+        self.manifest.update(self.source, self.state, chunks, complete=complete)
+        self.manifest.save()
 
+    # Remove the entries of chunks that disappeared from the file
+    # (unless still produced by this or any other imported file)
+    def _prune(self, path) -> None:
+        keep = self.manifest.referenced_entries(exclude=self.source)
+        keep.update(entry_id for _, entry_id in self.chunks if entry_id)
+        stale = [entry_id for entry_id in set(self.previous.values()) if entry_id and entry_id not in keep]
+        self.knowledge_db.delete_entries(stale)
+        Diagnostics.note(f"pruned {len(stale)} stale entries from {path}")
@@ -0,0 +1,135 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Persistent inverted index over the text and tags of the knowledge entries,
+# ranking keyword matches with BM25
+
+# Import required modules
+import re
+import math
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, List, Tuple
+from retainium.diagnostics import Diagnostics
+
+# File holding the index, next to the knowledge database
+KEYWORD_INDEX_FILE_NAME = "keyword_index.db"
+
+# BM25 parameters (term frequency saturation and document length normalization)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Rank constant of reciprocal rank fusion (dampens the weight of the top ranks)
+RRF_K = 60
+
+# Split text into index terms
+# (identifiers such as "H100-SXM5" or "10.2.1" are kept whole, and their
+#  parts are indexed too, so that either form matches)
+def tokenize(text: str) -> List[str]:
+    terms = []
+    for token in re.findall(r"\w+(?:[-./:]\w+)*", text.lower()):
+        terms.append(token)
+        parts = re.split(r"[-./:_]", token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part)
+    return terms
+
+# Fuse several rankings of ids into one with reciprocal rank fusion
+# Return the ids ordered by their fused score
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[str]:
+    scores = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking):
+            scores[id] = scores.get(id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda id: scores[id], reverse=True)
+
+class KeywordIndex:
+    """Inverted index (term -> entry, term frequency) backed by SQLite,
+    maintained alongside the vector collection."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, length INTEGER NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS postings ("
+                "term TEXT NOT NULL, id TEXT NOT NULL, frequency INTEGER NOT NULL, "
+                "PRIMARY KEY (term, id)) WITHOUT ROWID"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS postings_id ON postings (id)"
+            )
+        Diagnostics.debug(f"keyword index opened at {path}")
+
+    # Number of indexed entries
+    def count(self) -> int:
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    # Index (or re-index) entries, given as (id, text, tags) tuples
+    def add(self, entries: List[Tuple[str, str, List[str]]]) -> None:
+        with self._lock, self.connection:
+            for id, text, tags in entries:
+                terms = Counter(tokenize(text + " " + " ".join(tags)))
+                self.connection.execute("DELETE FROM postings WHERE id = ?", (id,))
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO documents (id, length) VALUES (?, ?)",
+                    (id, sum(terms.values()))
+                )
+                self.connection.executemany(
+                    "INSERT INTO postings (term, id, frequency) VALUES (?, ?, ?)",
+                    [(term, id, frequency) for term, frequency in terms.items()]
+                )
+
+    # Remove entries from the index
+    def delete(self, ids: List[str]) -> None:
+        with self._lock, self.connection:
+            for id in ids:
+                self.connection.execute("DELETE FROM postings WHERE id = ?", (id,))
+                self.connection.execute("DELETE FROM documents WHERE id = ?", (id,))
+
+    # Remove all entries from the index
+    def clear(self) -> None:
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM postings")
+            self.connection.execute("DELETE FROM documents")
+
+    # Rank the entries matching the terms of the query with BM25
+    # Return up to "top_k" (id, score) pairs, best first
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[str, float]]:
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        with self._lock:
+            documents, total_length = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM documents"
+            ).fetchone()
+            if not documents:
+                return []
+            average_length = max(total_length / documents, 1)
+
+            scores: Dict[str, float] = {}
+            for term in terms:
+                postings = self.connection.execute(
+                    "SELECT p.id, p.frequency, d.length FROM postings p "
+                    "JOIN documents d ON d.id = p.id WHERE p.term = ?", (term,)
+                ).fetchall()
+                if not postings:
+                    continue
+                idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+                for id, frequency, length in postings:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                    scores[id] = scores.get(id, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:top_k]
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
@@ -7,17 +7,38 @@ import os
 root = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
 
 # Import required modules
+import time
 import hashlib
 import base64
-from typing import List
+from typing import Iterator, List, Optional
 from dataclasses import dataclass, asdict
-import chromadb
-from chromadb.config import Settings
 from retainium.diagnostics import Diagnostics
+from retainium.keyword_index import KeywordIndex, KEYWORD_INDEX_FILE_NAME
+from retainium.tracing import Tracer
+from retainium.vector_store import open_store
 
-# The knowledge database collection name
-# (changing this can cause loss of existing knowledge)
-COLLECTION_NAME = "retainium_knowledge"
+# Number of entries fetched per round-trip when scanning the store
+READ_BATCH_SIZE = 1000
+
+# File holding the database generation, bumped on every write
+# (entries are stamped with the generation that last wrote them, which lets
+#  caches of derived results detect that an entry has changed)
+GENERATION_FILE_NAME = "generation"
+
+# File holding the version of the metadata schema of the entries
+#   1 - tags as a comma-joined string only
+#   2 - also a "tag:<name>" flag per tag and the time the entry was "added",
+#       so that entries can be filtered by tag and date within the database
+SCHEMA_FILE_NAME = "schema_version"
+SCHEMA_VERSION = 2
+
+# Prefix of the metadata keys flagging the tags of an entry
+TAG_KEY_PREFIX = "tag:"
+
+# Metadata key flagging the tag
+# (tags are matched case-insensitively)
+def tag_key(tag: str) -> str:
+    return TAG_KEY_PREFIX + tag.strip().lower()
 
 # Compute a hash from the text to serve as the unique id and to aid deduplication
 def compute_text_uuid(text: str) -> str:
@@ -31,120 +52,385 @@ class KnowledgeEntry:
     text: str
     source: str
     tags: List[str]
+    embedding: Optional[List[float]] = None  # Only populated when requested
+    generation: int = 0                      # Database generation of the last write
+    added: int = 0                           # Time the entry was added (seconds since the epoch)
 
     def to_metadata(self) -> dict:
-        return {
+        metadata = {
             "source": self.source,
             "tags": ",".join(self.tags),
+            "added": self.added,
         }
+        metadata.update((tag_key(tag), True) for tag in self.tags if tag.strip())
+        return metadata
+
+    # Metadata shown when printing the entry
+    def describe(self) -> dict:
+        description = {
+            "source": self.source,
+            "tags": ",".join(self.tags),
+        }
+        if self.added:
+            description["added"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.added))
+        return description
+
+    @classmethod
+    def from_metadata(cls, id: str, text: str, metadata: dict) -> "KnowledgeEntry":
+        metadata = metadata or {}
+        tags = metadata.get("tags", "").split(",") if metadata.get("tags") else []
+        return cls(
+                    id=id,
+                    text=text,
+                    source=metadata.get("source", "unknown"),
+                    tags=tags,
+                    generation=metadata.get("generation", 0),
+                    added=metadata.get("added", 0),
+                  )
 
     def to_dict(self) -> dict:
-        return {
+        result = {
             "id": self.id,
             "text": self.text,
             "source": self.source,
             "tags": self.tags,
+            "added": self.added,
         }
+        if self.embedding is not None:
+            result["embedding"] = self.embedding
+        return result
 
 # The knowledge database class
 class KnowledgeDB:
-    def __init__(self, persist_directory: str = os.path.join(root, "data", "knowledge_db")):
+    def __init__(self, persist_directory: str = os.path.join(root, "data", "knowledge_db"),
+                 write_batch_size: int = 256, backend: str = "chroma", vector_dtype: str = "float32"):
         self.persist_directory = persist_directory
+        self.write_batch_size = max(write_batch_size, 1)
         os.makedirs(self.persist_directory, exist_ok=True) # Ensure the directory exists
         Diagnostics.note(f"knowledge database initialized at {self.persist_directory}")
 
-        # Setup ChromaDB as the persistent knowledge database
-        self.client = chromadb.PersistentClient(path=persist_directory)
-        self.collection = self.client.get_or_create_collection(COLLECTION_NAME)
-        Diagnostics.note(f"using ChromaDB client collection \"{self.collection.name}\"")
+        # Setup the store holding the entries (ChromaDB, or a memory-mapped
+        # NumPy matrix), persisted in the database directory
+        self.store = open_store(backend, persist_directory, vector_dtype)
+
+        # Bring the metadata of entries written by older versions up to date
+        self._migrate_schema()
+
+        # Setup the keyword index, building it for databases that predate it
+        self.keyword_index = KeywordIndex(os.path.join(persist_directory, KEYWORD_INDEX_FILE_NAME))
+        if self.keyword_index.count() != self.store.count():
+            self.rebuild_keyword_index()
 
     # Add the knowledge to the database along with the corresponding embedding
-    def add_entry(self, text: str, source: str, embedding_handler, llm_handler) -> None:
-        # Guard against empty text
-        if not text:
-            Diagnostics.warning("request to add empty entry ignored")
-            return
+    # Return the number of entries actually added (0 or 1)
+    def add_entry(self, text: str, source: str, embedding_handler, llm_handler) -> int:
+        return self.add_entries([text], [source], embedding_handler, llm_handler)
 
-        # Auto generate tags for the entry
-        tags = llm_handler.auto_tags(text)
-        Diagnostics.debug(f"auto generated tags: {tags}")
+    # Add many knowledge entries to the database in bulk
+    # (one duplicate lookup, batched embedding and batched writes; precomputed
+    #  tags and embeddings, if given, are used instead of the LLM and the
+    #  embedding model, and an empty embedding is computed as usual; entries
+    #  are stamped with the current time, unless given the time they were
+    #  added, e.g. when restored)
+    # Return the number of entries actually added
+    def add_entries(self, texts: List[str], sources: List[str], embedding_handler, llm_handler,
+                    tags: Optional[List[List[str]]] = None,
+                    embeddings: Optional[List[list]] = None,
+                    added: Optional[List[int]] = None) -> int:
+        # Guard against empty text and duplicates within the batch
+        pending = {}
+        for i, text in enumerate(texts):
+            if not text:
+                Diagnostics.warning("request to add empty entry ignored")
+                continue
+            pending.setdefault(compute_text_uuid(text), i)
+        if not pending:
+            return 0
 
-        #date = datetime.now().strftime('%Y-%m-%d') # TODO 
+        # Skip entries already present in the database, with a single lookup
+        for id in self.existing_ids(list(pending)):
+            # Warn about duplicate entries only in debug mode
+            if Diagnostics.is_debug_enabled():
+                Diagnostics.warning(f"duplicate entry skipped: {id[:16]}")
+            del pending[id]
+        if not pending:
+            return 0
 
-        # Generate the knowledge entry and the corresponding embedding
-        entry = KnowledgeEntry(
-                                id=compute_text_uuid(text), 
-                                text=text, 
-                                source=source, 
-                                tags=tags
+        # Generate the knowledge entries, auto generating tags where needed
+        now = int(time.time())
+        entries = []
+        for id, i in pending.items():
+            entry_tags = tags[i] if tags is not None else llm_handler.auto_tags(texts[i])
+            Diagnostics.debug(f"auto generated tags: {entry_tags}")
+            entries.append(
+                KnowledgeEntry(
+                                id=id,
+                                text=texts[i],
+                                source=sources[i],
+                                tags=entry_tags,
+                                added=(added[i] if added is not None and added[i] else now)
                               )
-        embedding_vector = embedding_handler.embed(text)
+            )
 
-        # Warn about duplicate entries only in debug mode
-        if Diagnostics.is_debug_enabled():
-            existing = self.collection.get(ids=[entry.id])
-            if existing['ids']:  # Already present
-                Diagnostics.warning(f"duplicate entry skipped: {entry.id[:16]}")
-                return
+        # Generate the corresponding embeddings and add to the vector database
+        vectors = [list(embeddings[i]) if embeddings is not None and len(embeddings[i]) else []
+                   for i in pending.values()]
+        missing = [n for n, vector in enumerate(vectors) if not vector]
+        if missing:
+            computed = embedding_handler.embed_batch([entries[n].text for n in missing])
+            for n, vector in zip(missing, computed):
+                vectors[n] = vector
+        self._write_entries(self.store, entries, vectors, self.bump_generation())
+        self.keyword_index.add([(entry.id, entry.text, entry.tags) for entry in entries])
+        for entry in entries:
+            Diagnostics.note(f"entry added successfully: {entry.id[:16]}")
+        return len(entries)
+
+    # Return those of the given ids already present in the database
+    def existing_ids(self, ids: List[str]) -> List[str]:
+        if not ids:
+            return []
+        return self.store.get(ids=ids)["ids"]
+
+    # Write entries and their embeddings into the given store
+    # (in batches bounded by both the configured and the store's limits)
+    def _write_entries(self, store, entries: List[KnowledgeEntry], embeddings: List[list],
+                       generation: int) -> None:
+        self._write(
+                    store,
+                    ids=[entry.id for entry in entries],
+                    documents=[entry.text for entry in entries],
+                    embeddings=embeddings,
+                    metadatas=[dict(entry.to_metadata(), generation=generation) for entry in entries],
+                   )
+
+    # Write raw records into the given store, in bounded batches
+    def _write(self, store, ids: List[str], documents: List[str], embeddings, metadatas: List[dict]) -> None:
+        batch_size = min(self.write_batch_size, store.max_batch_size() or self.write_batch_size)
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            with Tracer.span("store.add", records=len(ids[start:end])):
+                store.add(
+                                ids=ids[start:end],
+                                documents=documents[start:end],
+                                embeddings=embeddings[start:end],
+                                metadatas=metadatas[start:end],
+                )
+
+    # Fetch the entries with the given ids (missing ids, and entries not
+    # matching the "where" filter, if given, are skipped)
+    def get_entries(self, ids: List[str], where: Optional[dict] = None) -> List[KnowledgeEntry]:
+        if not ids:
+            return []
+        results = self.store.get(ids=ids, where=where, include=["documents", "metadatas"])
+        return [
+            KnowledgeEntry.from_metadata(id, text, metadata)
+            for id, text, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+        ]
+
+    # Delete the entries with the given ids
+    def delete_entries(self, ids: List[str]) -> None:
+        if ids:
+            self.store.delete(ids)
+            self.keyword_index.delete(ids)
+            self.bump_generation()
+            Diagnostics.debug(f"deleted {len(ids)} entries")
+
+    # The current database generation
+    def generation(self) -> int:
+        try:
+            with open(os.path.join(self.persist_directory, GENERATION_FILE_NAME), "r") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
 
-        # Add to the vector database
-        # (ignore duplicate entries silently in non-debug mode)
-        self.collection.add(
-                            ids=[entry.id],
-                            documents=[entry.text],
-                            embeddings=[embedding_vector],
-                            metadatas=[entry.to_metadata()],
-        )
-        Diagnostics.note(f"entry added successfully: {entry.id[:16]}")
+    # Advance the database generation, marking a write
+    # Return the new generation
+    def bump_generation(self) -> int:
+        generation = self.generation() + 1
+        path = os.path.join(self.persist_directory, GENERATION_FILE_NAME)
+        with open(path + ".tmp", "w") as f:
+            f.write(str(generation))
+        os.replace(path + ".tmp", path)
+        return generation
+
+    # Number of entries in the database (matching the "where" filter, if given)
+    def count(self, where: Optional[dict] = None) -> int:
+        return self.store.count(where)
+
+    # Scan a store in pages of raw records
+    # (each page is a dict as returned by store.get())
+    def _iter_batches(self, store, include: List[str], batch_size: int = READ_BATCH_SIZE,
+                      where: Optional[dict] = None):
+        offset = 0
+        while True:
+            results = store.get(include=include, limit=batch_size, offset=offset, where=where)
+            if not results["ids"]:
+                return
+            yield results
+            offset += len(results["ids"])
 
     # Fetch and list all entries from the database
+    # (prefer iter_entries() for large databases)
     def list_entries(self) -> List[KnowledgeEntry]:
-        results = self.collection.get()
-        entries = []
-        for i in range(len(results["ids"])):
-            metadata = results["metadatas"][i]
-            tags = metadata.get("tags", "").split(",") if metadata.get("tags") else []
-            entries.append(
-                KnowledgeEntry(
-                    id=results["ids"][i],
-                    text=results["documents"][i],
-                    source=metadata.get("source", "unknown"),
-                    tags=tags,
-                )
-            )
-        return entries
+        return list(self.iter_entries())
+
+    # Fetch a page of entries
+    def list_entries_page(self, offset: int, limit: int, where: Optional[dict] = None) -> List[KnowledgeEntry]:
+        results = self.store.get(include=["documents", "metadatas"], limit=limit, offset=offset,
+                                 where=where)
+        return [
+            KnowledgeEntry.from_metadata(id, text, metadata)
+            for id, text, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+        ]
+
+    # Iterate over all entries (matching the "where" filter, if given),
+    # fetching "batch_size" of them per round-trip
+    # (memory is bounded by the batch size, not the size of the database)
+    def iter_entries(self, batch_size: int = READ_BATCH_SIZE, include_embeddings: bool = False,
+                     where: Optional[dict] = None) -> Iterator[KnowledgeEntry]:
+        include = ["documents", "metadatas"]
+        if include_embeddings:
+            include.append("embeddings")
+        for results in self._iter_batches(self.store, include, batch_size, where=where):
+            for i in range(len(results["ids"])):
+                entry = KnowledgeEntry.from_metadata(
+                            results["ids"][i],
+                            results["documents"][i],
+                            results["metadatas"][i],
+                        )
+                if include_embeddings:
+                    entry.embedding = [float(x) for x in results["embeddings"][i]]
+                yield entry
 
     # Query the knowledge database for the specific embedding
-    def query_entry(self, embedding: List[float], top_k: int = 5) -> List[KnowledgeEntry]:
-        results = self.collection.query(query_embeddings=[embedding], n_results=top_k)
-        entries = []
-        for i in range(len(results["ids"][0])):
-            metadata = results["metadatas"][0][i]
-            tags = metadata.get("tags", "").split(",") if metadata.get("tags") else []
-            entries.append(
-                KnowledgeEntry(
-                    id=results["ids"][0][i],
-                    text=results["documents"][0][i],
-                    source=metadata.get("source", "unknown"),
-                    tags=tags,
+    # (only among the entries matching the "where" filter, if given)
+    def query_entry(self, embedding: List[float], top_k: int = 5,
+                    where: Optional[dict] = None) -> List[KnowledgeEntry]:
+        return self.query_entries([embedding], top_k=top_k, where=where)[0]
+
+    # Query the knowledge database for several embeddings in one call
+    # Return a list of matching entries per embedding
+    def query_entries(self, embeddings: List[List[float]], top_k: int = 5,
+                      where: Optional[dict] = None) -> List[List[KnowledgeEntry]]:
+        with Tracer.span("store.query", queries=len(embeddings), top_k=top_k):
+            results = self.store.query(embeddings, top_k, where=where)
+        matches = []
+        for q in range(len(embeddings)):
+            entries = []
+            for i in range(len(results["ids"][q])):
+                entries.append(
+                    KnowledgeEntry.from_metadata(
+                        results["ids"][q][i],
+                        results["documents"][q][i],
+                        results["metadatas"][q][i],
+                    )
                 )
-            )
-        return entries
+            matches.append(entries)
+        return matches
+
+    # Query the keyword index for the entries best matching the terms of the text
+    # (no embedding needed; with a "where" filter, all keyword matches are
+    #  ranked and the best matching the filter are returned)
+    def keyword_query(self, text: str, top_k: int = 5, where: Optional[dict] = None) -> List[KnowledgeEntry]:
+        with Tracer.span("keyword.search"):
+            ids = [id for id, _ in self.keyword_index.search(text, top_k=None if where else top_k)]
+        return self.get_entries_ordered(ids, where=where)[:top_k]
+
+    # Fetch the entries with the given ids, in the order given
+    def get_entries_ordered(self, ids: List[str], where: Optional[dict] = None) -> List[KnowledgeEntry]:
+        found = {entry.id: entry for entry in self.get_entries(ids, where=where)}
+        return [found[id] for id in ids if id in found]
 
     # Return a list of all existing knowledge entries
+    # (prefer iter_entries() for large databases)
     def export_all(self) -> List[dict]:
-        return [entry.to_dict() for entry in self.list_entries()]
+        return [entry.to_dict() for entry in self.iter_entries()]
+
+    # Rebuild the store into a staging store and swap it in
+    # (documents, embeddings and metadata are reused as they are, unless
+    #  re-embedding or re-tagging is requested; the existing store is left
+    #  untouched until the rebuilt one is complete)
+    # Return the number of entries in the rebuilt store
+    def rebuild(self, embedding_handler, llm_handler, re_embed: bool = False, re_tag: bool = False) -> int:
+        # Start from a clean staging store
+        staging = self.store.create_staging()
+        generation = self.bump_generation()
+
+        # Copy across in pages, regenerating only what was asked for
+        # (regenerated entries are stamped with the new generation)
+        include = ["documents", "metadatas"] if re_embed else ["documents", "embeddings", "metadatas"]
+        written = 0
+        for results in self._iter_batches(self.store, include):
+            documents = results["documents"]
+            metadatas = [dict(metadata or {}) for metadata in results["metadatas"]]
+            if re_tag:
+                for n, (id, text) in enumerate(zip(results["ids"], documents)):
+                    entry = KnowledgeEntry.from_metadata(id, text, metadatas[n])
+                    entry.tags = llm_handler.auto_tags(text)
+                    Diagnostics.debug(f"auto generated tags: {entry.tags}")
+                    metadatas[n] = entry.to_metadata()
+            if re_tag or re_embed:
+                for metadata in metadatas:
+                    metadata["generation"] = generation
+            if re_embed:
+                embeddings = embedding_handler.embed_batch(documents)
+            else:
+                embeddings = results["embeddings"]
+            self._write(staging, results["ids"], documents, embeddings, metadatas)
+            written += len(results["ids"])
+            Diagnostics.debug(f"rebuilt {written} entries so far")
 
-    # Delete the existing collection and recreate using stored entries
-    # Return a list of all existing entries
-    def reinitialize_collection(self, knowledge_db) -> List[KnowledgeEntry]:
-        # Fetch the list of all existing entries
-        entries = knowledge_db.list_entries()
+        # Refuse to swap in an incomplete store
+        expected = self.store.count()
+        rebuilt = staging.count()
+        if rebuilt != expected:
+            self.store.discard_staging(staging)
+            raise RuntimeError(f"rebuilt store has {rebuilt} entries, expected {expected}")
 
-        # Reinitialize the collection
-        self.client.delete_collection(COLLECTION_NAME)
-        self.collection = self.client.get_or_create_collection(COLLECTION_NAME)
+        # Swap the rebuilt store in
+        # (the keyword index is only brought in line with new tags once the
+        #  store holding them is in place, so a failed rebuild leaves both
+        #  as they were)
+        self.store.swap_in(staging)
+        if re_tag or self.keyword_index.count() != self.store.count():
+            self.rebuild_keyword_index()
+        return self.store.count()
 
-        # Return the list of entries to be added back
-        return entries
+    # Rebuild the keyword index from the entries in the store
+    def rebuild_keyword_index(self) -> None:
+        Diagnostics.note("building the keyword index")
+        self.keyword_index.clear()
+        for results in self._iter_batches(self.store, ["documents", "metadatas"]):
+            self.keyword_index.add([
+                (id, text, KnowledgeEntry.from_metadata(id, text, metadata).tags)
+                for id, text, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+            ])
+
+    # The version of the metadata schema of the entries
+    def schema_version(self) -> int:
+        try:
+            with open(os.path.join(self.persist_directory, SCHEMA_FILE_NAME), "r") as f:
+                return int(f.read().strip() or 1)
+        except (OSError, ValueError):
+            return 1
+
+    # Rewrite the metadata of entries written by older versions in the current
+    # schema (the time they were added is unknown, and left as 0)
+    def _migrate_schema(self) -> None:
+        version = self.schema_version()
+        if version >= SCHEMA_VERSION:
+            return
+        if self.store.count():
+            Diagnostics.note(f"migrating the knowledge database to schema version {SCHEMA_VERSION}")
+            for results in self._iter_batches(self.store, ["documents", "metadatas"]):
+                metadatas = []
+                for id, text, metadata in zip(results["ids"], results["documents"], results["metadatas"]):
+                    entry = KnowledgeEntry.from_metadata(id, text, metadata)
+                    metadatas.append(dict(entry.to_metadata(), generation=entry.generation))
+                self.store.update(results["ids"], metadatas)
 
+        path = os.path.join(self.persist_directory, SCHEMA_FILE_NAME)
+        with open(path + ".tmp", "w") as f:
+            f.write(str(SCHEMA_VERSION))
+        os.replace(path + ".tmp", path)
@@ -0,0 +1,40 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Deferred construction of expensive handlers
+
+# Import required modules
+import threading
+from retainium.diagnostics import Diagnostics
+
+class LazyHandler:
+    """Stands in for a handler and builds it on first attribute access."""
+
+    def __init__(self, name: str, factory):
+        self._name = name
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    # Build the underlying handler, if not already done, and return it
+    def resolve(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    Diagnostics.debug(f"loading {self._name} on first use")
+                    self._instance = self._factory()
+        return self._instance
+
+    # Query if the underlying handler has been built
+    def is_loaded(self) -> bool:
+        return self._instance is not None
+
+    # Forward everything else to the underlying handler
+    # (only invoked for attributes not found on the proxy itself)
+    def __getattr__(self, attr):
+        return getattr(self.resolve(), attr)
+
+    def __repr__(self):
+        if self._instance is None:
+            return f"<{self._name} (not loaded)>"
+        return repr(self._instance)
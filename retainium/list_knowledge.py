@@ -4,31 +4,54 @@
 # Module to list all knowledge from the database
 import json
 from retainium.diagnostics import Diagnostics
-from retainium.knowledge import KnowledgeEntry
+from retainium.filters import register_filters, filters_from_args, build_where
+from retainium.knowledge import KnowledgeEntry, READ_BATCH_SIZE
 
 # Register command line options for "list"
 def register(subparsers):
     parser = subparsers.add_parser("list", help="List all stored knowledge")
     parser.add_argument("--json", action="store_true", help="Output as JSON")
     parser.add_argument("--terse", action="store_true", help="List brief ids")
-    parser.set_defaults(func=run)
+    register_filters(parser)
+    parser.set_defaults(func=run, remote=remote)
 
 # Handling of the "list" command
+# (entries are streamed from the database a page at a time)
 def run(args, knowledge_db, embedding_handler, llm_handler):
-    entries = knowledge_db.list_entries()
-    if not entries:
+    where = build_where(**filters_from_args(args))
+    nr = knowledge_db.count(where=where)
+    if not nr:
         Diagnostics.warning("no entries found in knowledge database")
         return
 
-    nr = len(entries)
     Diagnostics.note(f"listing {nr} stored knowledge entries:")
-    for entry in entries:
-        if args.json:
-            print(json.dumps(entry.to_dict(), indent=2))
-        else:
-            metadata = entry.to_metadata()
-            id = entry.id
-            if args.terse:
-                id = entry.id[:16]
-            print(f"[{id}]\n{entry.text} {metadata}\n\n")
+    for entry in knowledge_db.iter_entries(where=where):
+        print_entry(args, entry)
 
+# Handling of the "list" command by a running daemon
+# (entries are fetched a page at a time)
+def remote(args, client):
+    offset = 0
+    while True:
+        response = client.request("/list", {"offset": offset, "limit": READ_BATCH_SIZE,
+                                            "filters": filters_from_args(args)})
+        if offset == 0:
+            if not response["count"]:
+                Diagnostics.warning("no entries found in knowledge database")
+                return
+            Diagnostics.note(f"listing {response['count']} stored knowledge entries:")
+        if not response["entries"]:
+            return
+        for entry in response["entries"]:
+            print_entry(args, KnowledgeEntry(**entry))
+        offset += len(response["entries"])
+
+# Print a single entry
+def print_entry(args, entry) -> None:
+    if args.json:
+        print(json.dumps(entry.to_dict(), indent=2))
+    else:
+        id = entry.id
+        if args.terse:
+            id = entry.id[:16]
+        print(f"[{id}]\n{entry.text} {entry.describe()}\n\n")
@@ -6,13 +6,133 @@
 import os
 root = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
 
-# Setup the default LLM CLI path
+# Setup the default LLM CLI and server paths
 default_llm_cli_path = os.path.join(root, "bin", "llama-cli")
+default_llm_server_path = os.path.join(root, "bin", "llama-server")
+default_llm_tokenize_path = os.path.join(root, "bin", "llama-tokenize")
 
 # Import required modules
 import re
+import math
+import json
+import time
+import codecs
+import atexit
+import tempfile
+import threading
 import subprocess
+import urllib.error
+import urllib.request
+from typing import List, Optional
 from retainium.diagnostics import Diagnostics
+from retainium.tracing import Tracer
+
+# Supported LLM backends
+#   cli    - spawn one llama-cli process per prompt (reloads the model each time)
+#   server - keep the model warm in a single long-lived llama-server process
+LLM_BACKENDS = ("cli", "server")
+
+# Shape of the combined summary and tags response, used to constrain the
+# generation (via the grammar llama.cpp derives from it)
+SUMMARY_TAGS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "tags": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["summary", "tags"],
+}
+
+# Instruction for generating tags
+TAGS_INSTRUCTION = (
+                    "Generate the most relevant tags for the given text "
+                    "that can be used as metadata to index or search "
+                    "this text in future, excluding common words such as "
+                    "\"and\", \"of\", \"in\", \"to\", etc. as well as "
+                    "punctuation marks and symbols as tags."
+                   )
+
+# Safety margin applied to estimated token counts
+TOKEN_ESTIMATE_MARGIN = 1.15
+
+# Estimate the number of tokens of the text, erring on the high side for
+# Llama/Mistral tokenizers: every digit, punctuation mark, symbol and newline
+# is a token of its own, a run of letters takes at most one token per 3
+# letters, and other characters may fall back to one token per UTF-8 byte
+def estimate_tokens(text: str) -> int:
+    tokens = 0
+    for run in re.findall(r"[A-Za-z]+| +|.", text, re.DOTALL):
+        if run[0].isascii() and run[0].isalpha():
+            tokens += math.ceil(len(run) / 3)
+        elif run[0] == " ":
+            tokens += len(run) - 1      # (a single space joins the next word)
+        else:
+            tokens += len(run.encode("utf-8"))
+    return math.ceil(tokens * TOKEN_ESTIMATE_MARGIN) + 1
+
+# Markers delimiting the answer in the LLM output
+ANSWER_MARKER = "Answer:"
+ANSWER_TERMINATOR = "[end of text]"
+
+class LLMStream:
+    """Iterates over the answer as the LLM generates it, yielding text
+    fragments. The raw output is scanned like extract_answer() does, and
+    generation is cut off as soon as the answer terminator appears."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks       # Generator of raw output
+        self._raw = []
+        self._buffer = ""           # Output not yet yielded
+        self._started = False       # Whether the answer marker was seen
+        self.complete = False       # Whether the answer terminator was seen
+        self.text = ""              # The answer yielded so far
+
+    def __iter__(self):
+        try:
+            for chunk in self._chunks:
+                self._raw.append(chunk)
+                fragment = self._feed(chunk)
+                if fragment:
+                    self.text += fragment
+                    yield fragment
+                if self.complete:
+                    return
+
+            # The output ended without the terminator; flush the rest
+            fragment = self._buffer.rstrip() if self._started else ""
+            self._buffer = ""
+            if fragment:
+                self.text += fragment
+                yield fragment
+        finally:
+            # Stop the generation (if still running)
+            self._chunks.close()
+            Diagnostics.debug(f"response from LLM: {''.join(self._raw)}")
+
+    # Consume raw output; return the part of the answer that is safe to yield
+    def _feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        if not self._started:
+            index = self._buffer.find(ANSWER_MARKER)
+            if index < 0:
+                return ""
+            self._buffer = self._buffer[index + len(ANSWER_MARKER):]
+            self._started = True
+        if not self.text:
+            self._buffer = self._buffer.lstrip()
+
+        index = self._buffer.find(ANSWER_TERMINATOR)
+        if index >= 0:
+            self.complete = True
+            fragment, self._buffer = self._buffer[:index].rstrip(), ""
+            return fragment
+
+        # Hold back what could be the start of the terminator, and trailing
+        # whitespace (which is stripped if the terminator follows)
+        safe = max(len(self._buffer) - len(ANSWER_TERMINATOR) + 1, 0)
+        fragment = self._buffer[:safe].rstrip()
+        self._buffer = self._buffer[len(fragment):]
+        return fragment
 
 class LLMHandler:
     def __init__(self, config):
@@ -20,20 +140,148 @@ class LLMHandler:
         self.enabled = config.getboolean("llm", "enabled", fallback=True)
         self.model_path = config.get("llm", "model_path", fallback=None)
         self.cli_path = config.get("llm", "cli_path", fallback=default_llm_cli_path) 
+        self.tokenize_path = config.get("llm", "tokenize_path", fallback=default_llm_tokenize_path)
         self.context_length = config.getint("llm", "context_length", fallback=2048)
         self.temperature = config.getfloat("llm", "temperature", fallback=0.7)
         self.threads = config.getint("llm", "threads", fallback=4)
         self.gpu_layers = config.getint("llm", "gpu_layers", fallback=0)
-        Diagnostics.note(f"LLM {self.cli_path} initialized with model {self.model_path}, context={self.context_length}, temp={self.temperature}")
+
+        # Share of the context window given to retrieved passages, and the
+        # number of tokens reserved for the answer to a query
+        self.context_share = config.getfloat("llm", "context_share", fallback=0.6)
+        self.answer_tokens = config.getint("llm", "answer_tokens", fallback=256)
+
+        # Whether imports summarize and tag each chunk with a single generation
+        self.combined_summary_tags = config.getboolean("llm", "combined_summary_tags", fallback=False)
+
+        # Backend selection and persistent server settings
+        self.backend = config.get("llm", "backend", fallback="cli")
+        if self.backend not in LLM_BACKENDS:
+            Diagnostics.warning(f"unknown LLM backend \"{self.backend}\"; using \"cli\"")
+            self.backend = "cli"
+        self.server_path = config.get("llm", "server_path", fallback=default_llm_server_path)
+        self.server_host = config.get("llm", "server_host", fallback="127.0.0.1")
+        self.server_port = config.getint("llm", "server_port", fallback=8080)
+        self.server_startup_timeout = config.getint("llm", "server_startup_timeout", fallback=120)
+        self._server = None                 # llama-server process, started lazily
+        self._server_lock = threading.Lock()
+        self._generate_lock = threading.Lock()  # One generation at a time
+        if self.backend == "server":
+            atexit.register(self.stop_server)  # Never leave the server behind
+        Diagnostics.note(f"LLM {self.backend} backend initialized with model {self.model_path}, context={self.context_length}, temp={self.temperature}")
+
+    # The settings that shape the generated answers
+    def settings(self) -> dict:
+        return {
+            "model_path": self.model_path,
+            "temperature": self.temperature,
+            "context_length": self.context_length,
+            "context_share": self.context_share,
+            "answer_tokens": self.answer_tokens,
+        }
+
+    # Count the tokens of the text with the model's tokenizer
+    # (the server backend has it at hand; the cli backend runs llama-tokenize,
+    #  which only loads the vocabulary of the model; without either, the
+    #  count is estimated, erring on the high side)
+    def count_tokens(self, text: str) -> int:
+        if self.backend == "server":
+            try:
+                self.start_server()
+                return len(self._server_request("/tokenize", {"content": text}).get("tokens", []))
+            except RuntimeError as e:
+                Diagnostics.debug(f"falling back to estimated token counts: {e}")
+        elif self.backend == "cli" and os.path.isfile(self.tokenize_path):
+            try:
+                return self._count_tokens_via_cli(text)
+            except RuntimeError as e:
+                Diagnostics.debug(f"falling back to estimated token counts: {e}")
+        return estimate_tokens(text)
+
+    # Count the tokens of each of the texts
+    # (the server backend counts each exactly; with the cli backend, a single
+    #  llama-tokenize run counts them all together, rather than starting one
+    #  process per text, and the total is shared out between the texts in
+    #  proportion to their estimated counts)
+    def count_tokens_many(self, texts: List[str]) -> List[int]:
+        if self.backend == "server":
+            return [self.count_tokens(text) for text in texts]
+        estimates = [estimate_tokens(text) for text in texts]
+        if not texts or self.backend != "cli" or not os.path.isfile(self.tokenize_path):
+            return estimates
+        try:
+            total = self._count_tokens_via_cli("\n".join(texts))
+        except RuntimeError as e:
+            Diagnostics.debug(f"falling back to estimated token counts: {e}")
+            return estimates
+        scale = total / sum(estimates)
+        return [math.ceil(estimate * scale) for estimate in estimates]
+
+    # Count the tokens of the text with llama-tokenize
+    def _count_tokens_via_cli(self, text: str) -> int:
+        command = [self.tokenize_path, "-m", self.model_path, "-p", text, "--ids", "--log-disable"]
+        try:
+            result = subprocess.run(command, capture_output=True, timeout=60)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise RuntimeError(f"llama-tokenize failed: {e}")
+        # (the token ids are printed as a list, e.g. "[1, 415, 2936]")
+        ids = re.search(r"\[([\d,\s]*)\]\s*$", result.stdout.decode("utf-8", errors="replace"))
+        if result.returncode != 0 or ids is None:
+            raise RuntimeError(f"llama-tokenize failed:\n{result.stderr.decode('utf-8', errors='replace')}")
+        return len(ids.group(1).replace(",", " ").split())
+
+    # Number of tokens available for the context of a query prompt
+    # (the configured share of the context window, less whatever the rest of
+    #  the prompt, of "overhead" tokens if already counted, and the answer need)
+    def context_budget(self, question: str, overhead: Optional[int] = None) -> int:
+        if overhead is None:
+            overhead = self.count_tokens(self.query_prompt(question, ""))
+        available = self.context_length - overhead - self.answer_tokens
+        return max(min(int(self.context_length * self.context_share), available), 0)
 
     # Generate a response from the underlying LLM for the specified prompt
-    def generate_response(self, prompt: str) -> str:
+    # (constrained to the JSON schema, if given)
+    def generate_response(self, prompt: str, json_schema: dict = None) -> str:
+        stream = self.generate_stream(prompt, json_schema=json_schema)
+        for _ in stream:
+            pass
+        return stream.text if stream.complete else ""
+
+    # Generate a response from the underlying LLM for the specified prompt,
+    # as a stream of answer fragments (of at most "max_tokens" tokens, and
+    # constrained to the JSON schema, if given)
+    def generate_stream(self, prompt: str, max_tokens: int = None, json_schema: dict = None) -> LLMStream:
         if not self.enabled:
             raise RuntimeError("LLM integration is disabled in config.")
 
         if not os.path.isfile(self.model_path):
             raise FileNotFoundError(f"Model not found at: {self.model_path}")
 
+        return LLMStream(self._generate_chunks(prompt, max_tokens or -1, json_schema))
+
+    # Raw output of the LLM for the specified prompt, as it is generated
+    def _generate_chunks(self, prompt: str, max_tokens: int, json_schema: dict):
+        # Serialize generations across threads
+        # (there is a single local model; concurrent llama-cli processes would
+        #  each load their own copy of it)
+        with self._generate_lock:
+            if self.backend == "server":
+                yield from self._stream_via_server(prompt, max_tokens, json_schema)
+            else:
+                yield from self._stream_via_cli(prompt, max_tokens, json_schema)
+
+    # Cleanup the raw LLM output to make it more human-friendly
+    def extract_answer(self, output: str) -> str:
+        match = re.search(r"Answer:\s*(.*?)\s*\[end of text\]", output, re.DOTALL)
+        if match:
+            response = match.group(1).strip()
+        else:
+            response = ""
+        return response
+
+    # Run the prompt through a fresh llama-cli process, reading its output
+    # as it is produced (the model is loaded from scratch on every call)
+    def _stream_via_cli(self, prompt: str, max_tokens: int = -1, json_schema: dict = None):
         command = [
             self.cli_path,
             "-m", self.model_path,
@@ -42,19 +290,143 @@ class LLMHandler:
             "--threads", str(self.threads),
             "--n-gpu-layers", str(self.gpu_layers)
         ]
+        if max_tokens >= 0:
+            command += ["--n-predict", str(max_tokens)]
+        if json_schema is not None:
+            command += ["--json-schema", json.dumps(json_schema)]
 
-        result = subprocess.run(command, capture_output=True, text=True)
-        if result.returncode != 0:
-            raise RuntimeError(f"LLM execution failed:\n{result.stderr}")
-        Diagnostics.debug(f"response from LLM: {result.stdout}")
-        
-        # Cleanup the results to make it more human-friendly
-        match = re.search(r"Answer:\s*(.*?)\s*\[end of text\]", result.stdout, re.DOTALL)
-        if match:
-            response = match.group(1).strip()
-        else:
-            response = ""
-        return response
+        # (stderr goes to a file, as the logs of llama-cli could fill a pipe)
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            try:
+                while True:
+                    data = os.read(process.stdout.fileno(), 4096)
+                    if not data:
+                        break
+                    yield decoder.decode(data)
+                yield decoder.decode(b"", final=True)
+
+                if process.wait() != 0:
+                    stderr.seek(0)
+                    raise RuntimeError(f"LLM execution failed:\n{stderr.read().decode('utf-8', errors='replace')}")
+            finally:
+                # Stop a generation that is no longer wanted
+                if process.poll() is None:
+                    process.terminate()
+                    process.wait()
+                process.stdout.close()
+
+    # Run the prompt through the persistent llama-server process, streaming
+    # the completion
+    # (the generation is kept identical to llama-cli's: the same default
+    #  sampling, a prompt too long for the context is refused rather than
+    #  truncated, and the output is the echoed prompt followed by the
+    #  completion, with "[end of text]" only when the model ends it, not when
+    #  cut off by "max_tokens"; so the same answer extraction applies to both)
+    def _stream_via_server(self, prompt: str, max_tokens: int = -1, json_schema: dict = None):
+        self.start_server()
+        prompt_tokens = len(self._server_request("/tokenize", {"content": prompt, "add_special": True})
+                                .get("tokens", []))
+        if prompt_tokens > self.context_length - 4:
+            raise RuntimeError(f"LLM execution failed:\nprompt is too long "
+                               f"({prompt_tokens} tokens, max {self.context_length - 4})")
+        request = {
+            "prompt": prompt,
+            "n_predict": max_tokens,
+            "cache_prompt": True,
+            "stream": True,
+        }
+        if json_schema is not None:
+            request["json_schema"] = json_schema
+        yield prompt
+
+        # The server sends one "data: {...}" event per token, and stops
+        # generating once the connection is closed
+        with self._server_open("/completion", request) as response:
+            for line in response:
+                line = line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                event = json.loads(line[len("data:"):])
+                yield event.get("content", "")
+                if event.get("stop"):
+                    if event.get("stopped_eos"):
+                        yield " " + ANSWER_TERMINATOR
+                    return
+
+    # Base URL of the persistent llama-server
+    def _server_url(self) -> str:
+        return f"http://{self.server_host}:{self.server_port}"
+
+    # POST a JSON request to the llama-server and return the open response
+    def _server_open(self, endpoint: str, payload: dict):
+        request = urllib.request.Request(
+                                            self._server_url() + endpoint,
+                                            data=json.dumps(payload).encode("utf-8"),
+                                            headers={"Content-Type": "application/json"},
+                                        )
+        try:
+            return urllib.request.urlopen(request)
+        except urllib.error.URLError as e:
+            raise RuntimeError(f"LLM server request failed: {e}")
+
+    # POST a JSON request to the llama-server and return the decoded reply
+    def _server_request(self, endpoint: str, payload: dict) -> dict:
+        with self._server_open(endpoint, payload) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    # Start the llama-server on first use and wait until the model is loaded
+    def start_server(self) -> None:
+        with self._server_lock:
+            if self._server is not None and self._server.poll() is None:
+                return
+
+            command = [
+                self.server_path,
+                "-m", self.model_path,
+                "--ctx-size", str(self.context_length),
+                "--threads", str(self.threads),
+                "--n-gpu-layers", str(self.gpu_layers),
+                "--host", self.server_host,
+                "--port", str(self.server_port),
+            ]
+            Diagnostics.note(f"starting LLM server {self.server_path} on {self._server_url()}")
+            stderr = None if Diagnostics.is_debug_enabled() else subprocess.DEVNULL
+            self._server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=stderr)
+
+            # Poll the health endpoint until the model is ready
+            # (llama-server answers 503 while the model is still loading)
+            deadline = time.monotonic() + self.server_startup_timeout
+            while time.monotonic() < deadline:
+                if self._server.poll() is not None:
+                    raise RuntimeError(f"LLM server exited during startup (code {self._server.returncode})")
+                try:
+                    with urllib.request.urlopen(self._server_url() + "/health", timeout=1) as response:
+                        if response.status == 200:
+                            Diagnostics.debug("LLM server is ready")
+                            return
+                except (urllib.error.URLError, ConnectionError, OSError):
+                    pass
+                time.sleep(0.25)
+
+        self.stop_server()
+        raise RuntimeError(f"LLM server did not become ready within {self.server_startup_timeout}s")
+
+    # Shutdown the persistent llama-server, if running
+    def stop_server(self) -> None:
+        with self._server_lock:
+            if self._server is None:
+                return
+            if self._server.poll() is None:
+                Diagnostics.debug("stopping LLM server")
+                self._server.terminate()
+                try:
+                    self._server.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self._server.kill()
+                    self._server.wait()
+            self._server = None
 
     # Normalize text
     def normalize_text(self, text: str):
@@ -70,19 +442,17 @@ class LLMHandler:
     # Auto generate tags for the given text
     def auto_tags(self, text: str):
         # Synthesize the prompt for the LLM
-        prompt = (
-                    "Generate the most relevant tags for the given text "
-                    "that can be used as metadata to index or search "
-                    "this text in future, excluding common words such as "
-                    "\"and\", \"of\", \"in\", \"to\", etc. as well as "
-                    "punctuation marks and symbols as tags."
-                 )
+        prompt = TAGS_INSTRUCTION
         prompt += f"\n\nText:\n{text}\n\nAnswer:"
         Diagnostics.debug(f"prompt for LLM based auto tag generation: {prompt}")
-        response = self.generate_response(prompt)
+        with Tracer.span("llm.auto_tags"):
+            response = self.generate_response(prompt)
 
-        # Process the response
-        words = response.split()
+        # Return the processed tags
+        return self.clean_tags(response.split())
+
+    # Turn the words of the LLM response into tags: normalized and deduplicated
+    def clean_tags(self, words):
         seen = set()
         result = []
         
@@ -97,12 +467,51 @@ class LLMHandler:
                 seen.add(cleaned)
                 result.append(cleaned)
 
-        # Return the processed tags
         return result
 
     # Summarize key information from given text, leveraging prior context, if any
     def summarize_info(self, text: str, context: str = "") -> str:
-        # Synthesize the prompt for the LLM
+        prompt = self.summary_prompt(text, context)
+        Diagnostics.debug(f"prompt for LLM based summarization: {prompt}")
+
+        # Return the response generated from the LLM
+        with Tracer.span("llm.summarize"):
+            response = self.generate_response(prompt)
+        if response.lower() == "repeated":
+            Diagnostics.debug(f"Summarization of chunk caused repetition; ignored")
+            response = None
+        return response
+
+    # Summarize key information from given text and tag the summary, with a
+    # single generation constrained to a JSON object holding both
+    # Return the summary (None if nothing new) and the tags (None if the
+    # response could not be parsed, in which case the text is summarized
+    # with a separate generation and tags are left to auto_tags())
+    def summarize_and_tag(self, text: str, context: str = ""):
+        prompt = self.summary_prompt(text, context, extra=(
+                    " " + TAGS_INSTRUCTION.replace("given text", "summary") +
+                    " Respond with a JSON object holding the summary as "
+                    "\"summary\" and the list of tags as \"tags\"."
+                 ))
+        Diagnostics.debug(f"prompt for LLM based summarization and tagging: {prompt}")
+        with Tracer.span("llm.summarize_tags"):
+            response = self.generate_response(prompt, json_schema=SUMMARY_TAGS_SCHEMA)
+        try:
+            result = json.loads(response)
+            summary, tags = result["summary"].strip(), result["tags"]
+            if not isinstance(tags, list):
+                raise ValueError("tags is not a list")
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            Diagnostics.debug(f"failed to parse summary and tags ({e}); summarizing separately")
+            return self.summarize_info(text, context), None
+
+        if not summary or summary.lower() == "repeated":
+            Diagnostics.debug(f"Summarization of chunk caused repetition; ignored")
+            return None, None
+        return summary, self.clean_tags(" ".join(str(tag) for tag in tags).split())
+
+    # Synthesize the prompt for summarizing the text, with any extra instructions
+    def summary_prompt(self, text: str, context: str = "", extra: str = "") -> str:
         prompt = (
                     "Extract the key information from the given text "
                     "portion into a brief form, ensuring no key data is "
@@ -120,21 +529,30 @@ class LLMHandler:
                         "further extraction is necessary, then just repond "
                         "with the word \"REPEATED\"."
                       )
+            prompt += extra
             prompt += f"\n\nText:\n{text}\n\nContext:\n{context}\n\nAnswer:"
         else:
+            prompt += extra
             prompt += f"\n\nText:\n{text}\n\nAnswer:"
-        Diagnostics.debug(f"prompt for LLM based summarization: {prompt}")
-
-        # Return the response generated from the LLM
-        response = self.generate_response(prompt)
-        if response.lower() == "repeated":
-            Diagnostics.debug(f"Summarization of chunk caused repetition; ignored")
-            response = None
-        return response
+        return prompt
 
     # Use an optional context to build up a prompt for the LLM query
+    # (the answer is limited to the reserved number of tokens, and returned
+    #  even if cut short by that limit)
     def query(self, question: str, context: str = "") -> str:
-        # Synthesize the prompt for the LLM
+        stream = self.query_stream(question, context)
+        for _ in stream:
+            pass
+        return stream.text
+
+    # Same as query(), but stream the answer as it is generated
+    def query_stream(self, question: str, context: str = "") -> LLMStream:
+        prompt = self.query_prompt(question, context)
+        Diagnostics.debug(f"prompt for LLM query: {prompt}")
+        return self.generate_stream(prompt, max_tokens=self.answer_tokens)
+
+    # Synthesize the prompt for the LLM query
+    def query_prompt(self, question: str, context: str = "") -> str:
         # Method 1
         #prompt = f"Use the context below to answer the question."
         # Method 2
@@ -144,6 +562,4 @@ class LLMHandler:
 
         # Append the necessary context, question and the placeholder for the answer
         prompt += f"\n\nContext:\n{context}\n\nQuery:\n{question}\n\nAnswer:"
-        Diagnostics.debug(f"prompt for LLM query: {prompt}")
-        return self.generate_response(prompt)
-
+        return prompt
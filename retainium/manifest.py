@@ -0,0 +1,104 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Manifest of ingested files, enabling incremental imports
+
+# Import required modules
+import os
+import json
+import hashlib
+import threading
+from typing import List, Optional, Set
+from retainium.diagnostics import Diagnostics
+
+# The manifest file name, kept alongside the knowledge database
+MANIFEST_FILE_NAME = "ingest_manifest.json"
+
+# Compute the SHA-256 of a file's contents
+def compute_file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Capture the state of a file recorded in the manifest: its content hash,
+# mtime and size
+# (taken before the file is read for import, so that a file edited during
+#  its import is recorded as the version before the edit, and so is imported
+#  again next time)
+def file_state(path: str) -> dict:
+    stat = os.stat(path)
+    return {
+        "sha256": compute_file_hash(path),
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+    }
+
+class IngestManifest:
+    """Maps each imported file to its content hash, mtime, size and the
+    ordered list of (chunk uuid, entry id) pairs it produced."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.records = json.load(f)
+            except (OSError, ValueError) as e:
+                Diagnostics.warning(f"ignoring unreadable ingest manifest {path}: {e}")
+        Diagnostics.debug(f"ingest manifest {path} tracks {len(self.records)} files")
+
+    # Fetch the record for a file, if any
+    def get(self, file_path: str) -> Optional[dict]:
+        with self._lock:
+            return self.records.get(file_path)
+
+    # Query if a file is unchanged since it was last recorded
+    # (cheap size/mtime check first; the content hash settles the rest)
+    def is_unchanged(self, file_path: str) -> bool:
+        record = self.get(file_path)
+        if record is None or not record.get("complete", True):
+            return False
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        if record["size"] != stat.st_size:
+            return False
+        if record["mtime"] == stat.st_mtime:
+            return True
+        if record["sha256"] != compute_file_hash(file_path):
+            return False
+
+        # Same content, only touched; remember the new mtime
+        with self._lock:
+            record["mtime"] = stat.st_mtime
+        return True
+
+    # Record the chunks produced for a file in the given state (see file_state())
+    # (chunks is an ordered list of [chunk uuid, entry id or None]; an
+    #  incomplete record checkpoints a file whose import is in progress)
+    def update(self, file_path: str, state: dict, chunks: List[list], complete: bool = True) -> None:
+        record = dict(state, chunks=chunks, complete=complete)
+        with self._lock:
+            self.records[file_path] = record
+
+    # Entry ids referenced by any file other than the given one
+    def referenced_entries(self, exclude: Optional[str] = None) -> Set[str]:
+        with self._lock:
+            return {
+                entry_id
+                for file_path, record in self.records.items() if file_path != exclude
+                for _, entry_id in record["chunks"] if entry_id
+            }
+
+    # Write the manifest atomically
+    def save(self) -> None:
+        with self._lock:
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.records, f, indent=2)
+            os.replace(temp_path, self.path)
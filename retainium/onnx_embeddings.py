@@ -0,0 +1,136 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Sentence-transformer embeddings computed with ONNX Runtime, optionally with
+# int8 dynamic quantization, without loading PyTorch
+
+# Import required modules
+# (the inference libraries are imported on first use, since they are slow
+#  to load)
+import os
+import json
+from typing import List
+from retainium.diagnostics import Diagnostics
+
+# Sequence length used when the model does not say (that of all-MiniLM-L6-v2)
+DEFAULT_MAX_SEQ_LENGTH = 256
+
+class OnnxEncoder:
+    """Runs a sentence-transformer model exported to ONNX: tokenization,
+    the transformer, the pooling and the normalization of the model, with
+    encode() compatible with SentenceTransformer.encode()."""
+
+    def __init__(self, model_name: str, cache_dir: str, quantize: bool = True, threads: int = 0):
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.quantize = quantize
+
+        # (deferred imports; these are much lighter than torch)
+        import numpy
+        import onnxruntime
+        from tokenizers import Tokenizer
+        self.np = numpy
+
+        # Read the settings of the model, as sentence-transformers would
+        self.max_seq_length = self._read_json("sentence_bert_config.json").get("max_seq_length",
+                                                                                DEFAULT_MAX_SEQ_LENGTH)
+        pooling = self._read_json("1_Pooling/config.json")
+        self.pooling = "cls" if pooling.get("pooling_mode_cls_token") else "mean"
+        modules = self._read_json("modules.json")
+        self.normalize = any(module.get("type", "").endswith("Normalize") for module in modules or [])
+
+        # Setup the tokenizer, padding each batch to its longest text
+        self.tokenizer = Tokenizer.from_file(self._model_file("tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.enable_padding()
+
+        # Setup the inference session
+        options = onnxruntime.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(self._onnx_model(), options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        Diagnostics.note(f"ONNX embedding model ready: {model_name}"
+                         + (" (int8)" if quantize else "") + (f", {threads} threads" if threads > 0 else ""))
+
+    # Hub repository of the model (bare names are sentence-transformers models)
+    def _repo_id(self) -> str:
+        return self.model_name if "/" in self.model_name else f"sentence-transformers/{self.model_name}"
+
+    # Path of a file of the model, from its local directory or the hub
+    def _model_file(self, file_name: str) -> str:
+        if os.path.isdir(self.model_name):
+            return os.path.join(self.model_name, file_name)
+        from huggingface_hub import hf_hub_download
+        return hf_hub_download(self._repo_id(), file_name)
+
+    # Contents of a JSON file of the model ({} if it has none)
+    def _read_json(self, file_name: str):
+        try:
+            with open(self._model_file(file_name), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    # Path of the ONNX model to run, quantizing it on first use
+    # (the quantized model is kept in the cache directory)
+    def _onnx_model(self) -> str:
+        model_path = None
+        for file_name in ("onnx/model.onnx", "model.onnx"):
+            try:
+                model_path = self._model_file(file_name)
+            except Exception:
+                continue
+            if os.path.exists(model_path):
+                break
+            model_path = None
+        if model_path is None:
+            raise RuntimeError(f"no ONNX export found for {self.model_name}")
+        if not self.quantize:
+            return model_path
+
+        if os.path.isdir(self.model_name):
+            name = os.path.basename(os.path.normpath(self.model_name))
+        else:
+            name = self._repo_id().replace("/", "--")
+        quantized_path = os.path.join(self.cache_dir, name + "-int8.onnx")
+        if not os.path.exists(quantized_path):
+            Diagnostics.note(f"quantizing {model_path} to int8")
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            os.makedirs(self.cache_dir, exist_ok=True)
+            quantize_dynamic(model_path, quantized_path + ".tmp", weight_type=QuantType.QInt8)
+            os.replace(quantized_path + ".tmp", quantized_path)
+        return quantized_path
+
+    # Embed texts in batches of "batch_size"
+    # Return a list of vectors (NumPy arrays), one per text
+    def encode(self, texts, batch_size: int = 32, convert_to_tensor: bool = False, **kwargs) -> List:
+        np = self.np
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            inputs = {
+                "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                "attention_mask": mask,
+                "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+            }
+            hidden = self.session.run(None, {name: value for name, value in inputs.items()
+                                             if name in self.input_names})[0]
+
+            # Pool the token embeddings into one per text
+            if self.pooling == "cls":
+                pooled = hidden[:, 0]
+            else:
+                weights = mask[:, :, None].astype(hidden.dtype)
+                pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            vectors.extend(pooled.astype(np.float32))
+        return vectors[0] if single else vectors
@@ -0,0 +1,169 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Staged processing pipeline: each stage runs in its own thread and hands its
+# results to the next stage through a bounded queue, so that the stages work
+# on different items at the same time
+
+# Import required modules
+import time
+import queue
+import threading
+from typing import Callable, List
+from retainium.diagnostics import Diagnostics
+
+# Marks the end of the input
+_STOP = object()
+
+# How often (in seconds) a stage waiting on a queue checks for cancellation
+_POLL_INTERVAL = 0.1
+
+class PipelineStage(threading.Thread):
+    """Runs the stage function over batches of items taken from its input
+    queue, and passes whatever the function yields on to the output queue.
+    Tracks how long it spends working, waiting for input, and blocked on a
+    full output queue. Once "cancelled" is set, stops after the result in
+    progress, dropping whatever is still queued."""
+
+    def __init__(self, name: str, function: Callable, max_batch: int, input_queue, output_queue,
+                 cancelled: threading.Event):
+        super().__init__(name=f"pipeline-{name}", daemon=True)
+        self.stage_name = name
+        self.function = function
+        self.max_batch = max(max_batch, 1)
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.cancelled = cancelled
+        self.items = 0
+        self.busy = 0.0         # Seconds spent in the stage function
+        self.waiting = 0.0      # Seconds spent waiting for input
+        self.blocked = 0.0      # Seconds spent waiting for the next stage
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            start = time.perf_counter()
+            item = self._get()
+            self.waiting += time.perf_counter() - start
+            if item is _STOP:
+                break
+
+            # Gather whatever else is already queued, up to a full batch
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.input_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self.items += len(batch)
+            self._process(batch)
+
+        self._put(_STOP)
+
+    # Take the next item from the input queue (_STOP once cancelled)
+    def _get(self):
+        while not self.cancelled.is_set():
+            try:
+                return self.input_queue.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+        return _STOP
+
+    # Pass an item on to the next stage (dropping it once cancelled)
+    def _put(self, item) -> bool:
+        if self.output_queue is None:
+            return not self.cancelled.is_set()
+        while not self.cancelled.is_set():
+            try:
+                self.output_queue.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    # Run the stage function over a batch, forwarding its results as they come
+    def _process(self, batch: List) -> None:
+        start = time.perf_counter()
+        try:
+            results = iter(self.function(batch) or ())
+            while True:
+                try:
+                    result = next(results)
+                except StopIteration:
+                    break
+                self.busy += time.perf_counter() - start
+                start = time.perf_counter()
+                forwarded = self._put(result)
+                self.blocked += time.perf_counter() - start
+                start = time.perf_counter()
+                if not forwarded:
+                    # (cancelled: leave the rest of the batch undone)
+                    getattr(results, "close", lambda: None)()
+                    break
+        except Exception as e:
+            # Stage functions handle their own errors; never stall the pipeline
+            Diagnostics.error(f"{self.stage_name} stage failed: {e}")
+        self.busy += time.perf_counter() - start
+
+class Pipeline:
+    """A chain of stages connected by bounded queues. Each stage function
+    takes a list of items and returns (or yields) the items for the next
+    stage; the last stage's results are discarded."""
+
+    def __init__(self, queue_size: int = 64):
+        self.queue_size = queue_size
+        self.stages = []
+        self._input = queue.Queue(maxsize=queue_size)
+        self._cancelled = threading.Event()
+        self._start = None
+        self._elapsed = 0.0
+
+    # Append a stage; "max_batch" bounds how many queued items it takes at once
+    def add_stage(self, name: str, function: Callable, max_batch: int = 1) -> None:
+        # Connect the previous stage to this one
+        if self.stages:
+            input_queue = queue.Queue(maxsize=self.queue_size)
+            self.stages[-1].output_queue = input_queue
+        else:
+            input_queue = self._input
+        self.stages.append(PipelineStage(name, function, max_batch, input_queue, None, self._cancelled))
+
+    def start(self) -> None:
+        self._start = time.perf_counter()
+        for stage in self.stages:
+            stage.start()
+
+    # Feed an item into the first stage (blocks while the stage is backed up)
+    def put(self, item) -> None:
+        self._input.put(item)
+
+    # Wait for everything fed so far to pass through all the stages
+    def finish(self) -> None:
+        self._input.put(_STOP)
+        self._join()
+
+    # Stop the stages once their results in progress are done, dropping
+    # everything still queued
+    def cancel(self) -> None:
+        self._cancelled.set()
+        self._join()
+
+    def _join(self) -> None:
+        for stage in self.stages:
+            stage.join()
+        self._elapsed = time.perf_counter() - self._start
+
+    # Report the utilization of each stage (the busiest is the bottleneck)
+    def report(self) -> None:
+        elapsed = max(self._elapsed, 1e-9)
+        bottleneck = max(self.stages, key=lambda stage: stage.busy)
+        for stage in self.stages:
+            Diagnostics.note(f"{stage.stage_name:>10} stage: {stage.items} items, "
+                             f"busy {100 * stage.busy / elapsed:.0f}%, "
+                             f"waiting for input {100 * stage.waiting / elapsed:.0f}%, "
+                             f"blocked on output {100 * stage.blocked / elapsed:.0f}%"
+                             + (" (bottleneck)" if stage is bottleneck else ""))
@@ -0,0 +1,97 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# On-disk cache of LLM answers to queries
+
+# Import required modules
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import List, Optional
+from retainium.diagnostics import Diagnostics
+
+# Compute the cache key of a query
+# (the normalized query text, the number of entries asked for, the ids of
+#  the entries actually retrieved, in rank order, and the LLM settings that
+#  shape the answer)
+def compute_query_key(query: str, top_k: int, entry_ids: List[str], llm_settings: dict) -> str:
+    normalized = " ".join(query.lower().split())
+    normalized = re.sub(r"[\s?!.]+$", "", normalized)
+    key = json.dumps([normalized, top_k, entry_ids, llm_settings], sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+class QueryCache:
+    """Size-bounded, least-recently-used cache of query answers backed by SQLite.
+
+    Each answer remembers the database generation it was produced at; it is
+    only served while none of the entries it was built from has been written
+    since (see KnowledgeEntry.generation)."""
+
+    def __init__(self, path: str, max_entries: int = 1000):
+        self.path = path
+        self.max_entries = max(max_entries, 1)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "key TEXT PRIMARY KEY, answer TEXT NOT NULL, "
+                "generation INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)"
+            )
+        Diagnostics.debug(f"query cache opened at {path} (max {self.max_entries} entries)")
+
+    # Fetch the cached answer for a key, unless produced before "min_generation"
+    # (i.e. before the latest write to any of the entries it was built from)
+    def lookup(self, key: str, min_generation: int) -> Optional[str]:
+        with self._lock, self.connection:
+            row = self.connection.execute(
+                "SELECT answer, generation FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < min_generation:
+                if row is not None:
+                    Diagnostics.debug("cached answer is stale; discarding")
+                    self.connection.execute("DELETE FROM answers WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self.connection.execute(
+                "UPDATE answers SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self.hits += 1
+            return row[0]
+
+    # Store an answer produced at the given database generation
+    def store(self, key: str, answer: str, generation: int) -> None:
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO answers (key, answer, generation, last_used) VALUES (?, ?, ?, ?)",
+                (key, answer, generation, time.time()),
+            )
+            excess = self.connection.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.connection.execute(
+                    "DELETE FROM answers WHERE key IN "
+                    "(SELECT key FROM answers ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+
+    # Remove all cached answers
+    def purge(self) -> int:
+        with self._lock, self.connection:
+            return self.connection.execute("DELETE FROM answers").rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
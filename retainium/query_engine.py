@@ -0,0 +1,112 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Asyncio engine coalescing concurrent similarity searches into batches
+
+# Import required modules
+import json
+import asyncio
+import threading
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from retainium.diagnostics import Diagnostics
+from retainium.knowledge import KnowledgeEntry
+
+class QueryEngine:
+    """Collects the searches arriving within a short window and runs them as
+    one batched embedding call and one multi-embedding database query, then
+    fans the results back out to the callers. Searches with different
+    "where" filters share the embedding batch, but not the database query."""
+
+    def __init__(self, knowledge_db, embedding_handler, window_ms: float = 5, max_batch: int = 64):
+        self.knowledge_db = knowledge_db
+        self.embedding_handler = embedding_handler
+        self.window = max(window_ms, 0) / 1000
+        self.max_batch = max(max_batch, 1)
+        self.batches = 0    # Number of batches run
+        self.queries = 0    # Number of searches served
+        self._pending = []  # (text, top_k, where, future) awaiting the next batch
+        self._timer = None
+        self._loop = None
+        self._thread = None
+
+        # Batches run one at a time off the event loop; the next batch
+        # accumulates while the current one is running
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-engine")
+
+    # Search for the entries most similar to the text
+    # (among those matching the "where" filter, if given)
+    async def search(self, text: str, top_k: int = 5, where: Optional[dict] = None) -> List[KnowledgeEntry]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, top_k, where, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    # Start the pending searches as one batch
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch) -> None:
+        requests = [(text, top_k, where) for text, top_k, where, _ in batch]
+        try:
+            matches = await asyncio.get_running_loop().run_in_executor(
+                                                                        self._executor,
+                                                                        self._search_batch, requests
+                                                                      )
+        except Exception as e:
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.queries += len(batch)
+        Diagnostics.debug(f"query engine ran a batch of {len(batch)} searches")
+        for (_, _, _, future), entries in zip(batch, matches):
+            if not future.done():
+                future.set_result(entries)
+
+    # Embed and query a batch of (text, top_k, where) requests
+    # (runs on the executor thread)
+    def _search_batch(self, requests) -> List[List[KnowledgeEntry]]:
+        embeddings = self.embedding_handler.embed_batch([text for text, _, _ in requests])
+
+        # One database query per distinct filter
+        groups = {}
+        for n, (_, _, where) in enumerate(requests):
+            groups.setdefault(json.dumps(where, sort_keys=True), (where, []))[1].append(n)
+        matches = [None] * len(requests)
+        for where, indices in groups.values():
+            top_k = max(requests[n][1] for n in indices)
+            found = self.knowledge_db.query_entries([embeddings[n] for n in indices], top_k=top_k, where=where)
+            for n, entries in zip(indices, found):
+                matches[n] = entries[:requests[n][1]]
+        return matches
+
+    # Run the engine on its own event loop thread, for use from threaded code
+    def start(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="query-engine-loop", daemon=True)
+        self._thread.start()
+
+    # Search from another thread, blocking until the batch completes
+    # (requires start())
+    def search_blocking(self, text: str, top_k: int = 5, where: Optional[dict] = None) -> List[KnowledgeEntry]:
+        return asyncio.run_coroutine_threadsafe(self.search(text, top_k, where), self._loop).result()
+
+    def stop(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+        self._executor.shutdown(wait=True)
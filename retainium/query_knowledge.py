@@ -2,15 +2,37 @@
 # Licensed under the GNU AGPL-3.0. See LICENSE file for details.
 
 # Module to query knowledge from the database
+from retainium.context_builder import build_context
 from retainium.diagnostics import Diagnostics
+from retainium.filters import register_filters, filters_from_args, build_where
+from retainium.keyword_index import reciprocal_rank_fusion
 from retainium.knowledge import KnowledgeEntry
+from retainium.query_cache import compute_query_key
+from retainium.tracing import Tracer
+
+# Retrieval modes
+#   vector  - similarity of the embeddings
+#   keyword - BM25 ranking of the terms in the text and tags (skips the embedding model)
+#   hybrid  - both rankings, fused with reciprocal rank fusion
+QUERY_MODES = ("vector", "keyword", "hybrid")
+
+# Number of candidates each ranking contributes to a hybrid search, per result
+HYBRID_CANDIDATES_FACTOR = 4
+
+# Number of matching entries retrieved, unless given or set by the reranker
+DEFAULT_TOP_K = 5
 
 # Register command line options for "query"
 def register(subparsers):
     parser = subparsers.add_parser("query", help="Query the knowledge base")
     parser.add_argument("--text", required=True, help="Text to search for")
     parser.add_argument("--similarity-only", action="store_true", help="Skip LLM summarization; provide results based on similarity only")
-    parser.set_defaults(func=run)
+    parser.add_argument("--top-k", type=int, help="Number of matching entries to retrieve (default: 5, or top_k in [rerank] when reranking)")
+    parser.add_argument("--mode", choices=QUERY_MODES, default="vector", help="Retrieval by embedding similarity, keywords, or both (default: vector)")
+    parser.add_argument("--no-rerank", action="store_true", help="Skip the reranker, even if enabled in config")
+    parser.add_argument("--no-cache", action="store_true", help="Do not answer from, or store into, the query cache")
+    register_filters(parser)
+    parser.set_defaults(func=run, remote=remote)
 
 # Handling of the "query" command
 def run(args, knowledge_db, embedding_handler, llm_handler):
@@ -20,23 +42,129 @@ def run(args, knowledge_db, embedding_handler, llm_handler):
         return
     Diagnostics.debug(f"searching for: {query_text}")
 
-    embedding = embedding_handler.embed(query_text)
-    results = knowledge_db.query_entry(embedding)
-
+    where = build_where(**filters_from_args(args))
+    reranker = None if args.no_rerank else args.reranker
+    top_k = resolve_top_k(args.top_k, reranker)
+    results, generation = search(query_text, top_k, knowledge_db, embedding_handler,
+                                 mode=args.mode, where=where, reranker=reranker)
     if not results:
         Diagnostics.warning(f"no matching entries found")
         return
 
     # Run the results through the LLM, unless prohibited
-    nr = len(results)
     if args.similarity_only:
-        Diagnostics.note(f"listing top {nr} matching knowledge entries:")
-        for entry in results:
-            metadata = entry.to_metadata()
-            print(f"[{entry.id}] {entry.text} {metadata}")
+        print_matches(results)
     else:
-        Diagnostics.note(f"LLM summary based on the top {nr} matching knowledge entries:")
-        context = "\n".join(entry.text.strip() for entry in results)
-        response = llm_handler.query(question=query_text, context=context)
-        print(response)
+        Diagnostics.note(f"LLM summary based on the top {len(results)} matching knowledge entries:")
+        # (print the answer as it is generated)
+        answer(query_text, top_k, results, generation, llm_handler,
+               cache=None if args.no_cache else args.query_cache,
+               on_text=lambda text: print(text, end="", flush=True))
+        print()
+
+# Handling of the "query" command by a running daemon
+def remote(args, client):
+    query_text = args.text.strip()
+    if not query_text:
+        Diagnostics.error("query text is empty")
+        return
+
+    response = client.request("/query", {
+                                            "text": query_text,
+                                            "top_k": args.top_k,
+                                            "similarity_only": args.similarity_only,
+                                            "no_cache": args.no_cache,
+                                            "mode": args.mode,
+                                            "filters": filters_from_args(args),
+                                            "rerank": not args.no_rerank,
+                                        })
+    results = [KnowledgeEntry(**entry) for entry in response["entries"]]
+    if not results:
+        Diagnostics.warning(f"no matching entries found")
+    elif args.similarity_only:
+        print_matches(results)
+    else:
+        Diagnostics.note(f"LLM summary based on the top {len(results)} matching knowledge entries:")
+        print(response["answer"])
+
+# Number of entries to retrieve: as asked for, else as many as the reranker keeps
+def resolve_top_k(top_k, reranker) -> int:
+    if top_k:
+        return top_k
+    return reranker.top_k if reranker is not None else DEFAULT_TOP_K
+
+# Retrieve the entries most similar to the query
+# Return the entries and the database generation they were retrieved at
+# (only among the entries matching the "where" filter, if given; a
+#  QueryEngine, if given, batches the similarity search with concurrent ones;
+#  a Reranker, if given, picks the best of a wider set of candidates)
+def search(query_text: str, top_k: int, knowledge_db, embedding_handler, engine=None, mode: str = "vector",
+           where=None, reranker=None):
+    # (note the generation first, so that an answer is never cached as newer
+    #  than the entries it was built from)
+    generation = knowledge_db.generation()
+    if reranker is None:
+        return retrieve(query_text, top_k, knowledge_db, embedding_handler, engine, mode, where), generation
+
+    candidates = retrieve(query_text, max(reranker.candidates, top_k), knowledge_db, embedding_handler,
+                          engine, mode, where)
+    return reranker.rerank(query_text, candidates, top_k), generation
+
+# Retrieve the "top_k" entries best matching the query in the given mode
+def retrieve(query_text: str, top_k: int, knowledge_db, embedding_handler, engine=None, mode: str = "vector",
+             where=None):
+    if mode == "keyword":
+        return knowledge_db.keyword_query(query_text, top_k=top_k, where=where)
+
+    candidates = top_k * HYBRID_CANDIDATES_FACTOR if mode == "hybrid" else top_k
+    if engine is not None:
+        results = engine.search_blocking(query_text, candidates, where=where)
+    else:
+        embedding = embedding_handler.embed(query_text)
+        results = knowledge_db.query_entry(embedding, top_k=candidates, where=where)
+    if mode != "hybrid":
+        return results
+
+    # Fuse the similarity and keyword rankings
+    keyword_results = knowledge_db.keyword_query(query_text, top_k=candidates, where=where)
+    fused = reciprocal_rank_fusion([[entry.id for entry in results], [entry.id for entry in keyword_results]])
+    found = {entry.id: entry for entry in results + keyword_results}
+    return [found[id] for id in fused[:top_k]]
+
+# Answer the query from the retrieved entries with the LLM
+# (answers are served from, and stored into, the QueryCache, if given;
+#  "on_text", if given, is called with each part of the answer as it is generated)
+def answer(query_text: str, top_k: int, results, generation: int, llm_handler, cache=None,
+           on_text=None) -> str:
+    if cache is not None:
+        # Answer from the cache, unless any of the entries changed since
+        key = compute_query_key(query_text, top_k, [entry.id for entry in results],
+                                llm_handler.settings())
+        response = cache.lookup(key, min_generation=max(entry.generation for entry in results))
+        if response is not None:
+            Diagnostics.debug("answered from the query cache")
+            if on_text is not None:
+                on_text(response)
+            return response
+
+    with Tracer.span("context.build", entries=len(results)):
+        context = build_context(query_text, results, llm_handler)
+    with Tracer.span("llm.answer"):
+        stream = llm_handler.query_stream(question=query_text, context=context)
+        for text in stream:
+            if on_text is not None:
+                on_text(text)
+    response = stream.text
+    if not stream.complete:
+        Diagnostics.warning("the LLM stopped before completing its answer")
+
+    # (only complete answers are cached)
+    if cache is not None and response and stream.complete:
+        cache.store(key, response, generation)
+    return response
 
+# List the matching entries
+def print_matches(results) -> None:
+    Diagnostics.note(f"listing top {len(results)} matching knowledge entries:")
+    for entry in results:
+        print(f"[{entry.id}] {entry.text} {entry.describe()}")
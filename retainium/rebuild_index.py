@@ -5,37 +5,41 @@
 
 # Import required modules
 from retainium.diagnostics import Diagnostics
-from retainium.knowledge import KnowledgeEntry, compute_text_uuid
 
 # Register command line options for "rebuild-index"
 def register(subparsers):
     parser = subparsers.add_parser("rebuild-index", help="Rebuild ChromaDB index from saved entries")
-    parser.set_defaults(func=run)
+    parser.add_argument("--re-embed", action="store_true", help="Recompute embeddings (e.g., after changing the embedding model)")
+    parser.add_argument("--re-tag", action="store_true", help="Regenerate tags with the LLM (e.g., after changing the LLM)")
+    parser.set_defaults(func=run, remote=remote, exclusive=True)
 
 # Handling of the "rebuild-index" command
 def run(args, knowledge_db, embedding_handler, llm_handler):
-    entries = knowledge_db.reinitialize_collection(knowledge_db)
+    nr = knowledge_db.count()
 
     # Empty collection; nothing to rebuild
-    if not entries:
+    if not nr:
         Diagnostics.warning("no existing entries in knowledge database")
         return
 
-    # Re-initialize the database with the cached list of existing entries
-    nr = len(entries)
-    Diagnostics.note(f"rebuilding index for {nr} knowledge entries")
-    for entry in entries:
-        text = entry.text
-        source = entry.to_metadata()["source"]
+    if args.re_tag and llm_handler is None:
+        Diagnostics.error("re-tagging requires the LLM to be enabled in config")
+        return
 
-        # Add the knowledge to the database
-        try:
-            knowledge_db.add_entry(text, source, embedding_handler, llm_handler)
-        except Exception as e:
-            Diagnostics.error(f"failed to add entry: {e}")
+    # Rebuild the index, reusing stored embeddings and tags unless asked not to
+    Diagnostics.note(f"rebuilding index for {nr} knowledge entries")
+    try:
+        nr = knowledge_db.rebuild(embedding_handler, llm_handler,
+                                  re_embed=args.re_embed, re_tag=args.re_tag)
+    except Exception as e:
+        Diagnostics.error(f"failed to rebuild index: {e}")
+        return
 
     # Report the number of entries in the re-initialized database
-    entries = knowledge_db.list_entries()
-    nr = len(entries)
     Diagnostics.note(f"database re-initialized with {nr} knowledge entries")
 
+# Handling of the "rebuild-index" command by a running daemon
+def remote(args, client):
+    Diagnostics.note("rebuilding index in the daemon")
+    response = client.request("/rebuild", {"re_embed": args.re_embed, "re_tag": args.re_tag})
+    Diagnostics.note(f"database re-initialized with {response['entries']} knowledge entries")
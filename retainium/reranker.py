@@ -0,0 +1,47 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Second retrieval stage: rescore a wide set of candidates with a local
+# cross-encoder, which reads the query and the entry together
+
+# Import required modules
+import threading
+from typing import List
+from retainium.diagnostics import Diagnostics
+from retainium.tracing import Tracer
+
+class Reranker:
+    def __init__(self, model_name: str, candidates: int = 50, top_k: int = 5, batch_size: int = 32):
+        self.model_name = model_name
+        self.candidates = max(candidates, 1)    # Entries retrieved for rescoring
+        self.top_k = max(top_k, 1)              # Entries kept after rescoring
+        self.batch_size = max(batch_size, 1)
+        self._model = None                      # Loaded on first use
+        self._model_lock = threading.Lock()
+
+    # The underlying CrossEncoder model, loaded on first use
+    @property
+    def model(self):
+        with self._model_lock:
+            if self._model is None:
+                Diagnostics.note(f"loading reranker model: {self.model_name}")
+
+                # Deferred import; pulls in torch, which is expensive
+                from sentence_transformers import CrossEncoder
+                self._model = CrossEncoder(self.model_name)
+        return self._model
+
+    # Score the relevance of each text to the query, in batches
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        if not texts:
+            return []
+        with Tracer.span("rerank", texts=len(texts)):
+            scores = self.model.predict([(query, text) for text in texts], batch_size=self.batch_size)
+        return [float(score) for score in scores]
+
+    # Return the "top_k" entries most relevant to the query, best first
+    def rerank(self, query: str, entries, top_k: int = None):
+        scores = self.score(query, [entry.text for entry in entries])
+        ranked = sorted(zip(scores, range(len(entries))), key=lambda item: item[0], reverse=True)
+        Diagnostics.debug(f"reranked {len(entries)} candidates")
+        return [entries[n] for _, n in ranked[:top_k or self.top_k]]
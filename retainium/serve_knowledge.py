@@ -0,0 +1,57 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Module to serve the knowledge base from a long-running daemon
+
+# Import required modules
+from retainium.diagnostics import Diagnostics
+from retainium.daemon import DaemonServer
+from retainium.query_engine import QueryEngine
+
+# Register command line options for "serve"
+def register(subparsers):
+    parser = subparsers.add_parser("serve", help="Run a daemon serving queries and ingestion over a local HTTP API")
+    parser.add_argument("--host", type=str, help="Address to listen on (default: from [server] in config)")
+    parser.add_argument("--port", type=int, help="Port to listen on (default: from [server] in config)")
+    parser.add_argument("--batch-window-ms", type=float, default=5,
+                        help="How long to gather concurrent queries into one batch (default: 5; 0 disables batching)")
+    parser.add_argument("--max-batch", type=int, default=64, help="Largest number of queries run as one batch (default: 64)")
+    parser.set_defaults(func=run)
+
+# Handling of the "serve" command
+def run(args, knowledge_db, embedding_handler, llm_handler):
+    host = args.host or args.daemon.host
+    port = args.port or args.daemon.port
+
+    # Load everything up front, so that the first request is as fast as the rest
+    Diagnostics.note(f"knowledge database holds {knowledge_db.count()} entries")
+    embedding_handler.model
+    if args.reranker is not None:
+        args.reranker.model
+    if llm_handler is not None and llm_handler.backend == "server":
+        llm_handler.start_server()
+
+    # Coalesce concurrent similarity searches into batched model and database calls
+    engine = None
+    if args.batch_window_ms > 0:
+        engine = QueryEngine(knowledge_db, embedding_handler,
+                             window_ms=args.batch_window_ms, max_batch=args.max_batch)
+        engine.start()
+
+    try:
+        server = DaemonServer((host, port), knowledge_db, embedding_handler, llm_handler,
+                              engine=engine, reranker=args.reranker, query_cache=args.query_cache)
+    except OSError as e:
+        Diagnostics.error(f"failed to listen on {host}:{port}: {e}")
+        if engine is not None:
+            engine.stop()
+        return
+    Diagnostics.success(f"serving on http://{host}:{port} (Ctrl-C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        Diagnostics.note("shutting down")
+    finally:
+        server.server_close()
+        if engine is not None:
+            engine.stop()
@@ -4,14 +4,18 @@
 # Module for various text processing utilities
 
 # Import required modules
-import fitz  # PyMuPDF
-import pytesseract
-from pdf2image import convert_from_path
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+# (PDF and OCR libraries are imported on first use, since they are slow to
+#  load and most commands never need them)
 from pathlib import Path
-from typing import List
+from typing import Dict, List
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
 import re
+from retainium.chunker import iter_chunks, token_counter
 from retainium.diagnostics import Diagnostics
+from retainium.tracing import Tracer, call_traced
 
 # Singleton class, enabling easy global access to all configured values
 class TextHandler:
@@ -26,12 +30,17 @@ class TextHandler:
     # Initialize with values from configuration file; fallback on defaults
     def _initialize(self, config):
         # Chunking configuration
+        # (chunk sizes are in tokens of the embedding model; the fallback size
+        #  applies when its tokenizer cannot be loaded and tokens are estimated)
         self.chunking_enabled = config.getboolean("chunking", "enabled", fallback=True)
-        self.chunk_size = config.getint("chunking", "chunk_size", fallback=512)
+        self.chunk_size = config.getint("chunking", "chunk_size", fallback=256)
         self.chunk_overlap = config.getint("chunking", "chunk_overlap", fallback=64)
         self.chunk_size_fallback = config.getint("chunking", 
                                                  "chunk_size_fallback", 
-                                                 fallback=256)
+                                                 fallback=192)
+        self.tokenizer = config.get("chunking", "tokenizer",
+                                    fallback=config.get("embedding", "model_path",
+                                                        fallback="all-MiniLM-L6-v2"))
         self.single_char_line_threshold = config.getfloat("chunking", 
                                                           "single_char_line_threshold", 
                                                           fallback=0.5)
@@ -44,7 +53,21 @@ class TextHandler:
         # OCR configuration
         self.ocr_enabled = config.getboolean("ocr", "enabled", fallback=True)
         self.ocr_dpi = config.getint("ocr", "dpi", fallback=300)
-        Diagnostics.note(f"text handler initialized with chunk_size={self.chunk_size}")
+        self.ocr_workers = config.getint("ocr", "workers", fallback=0) or os.cpu_count() or 1
+        Diagnostics.note(f"text handler initialized with chunk_size={self.chunk_size} tokens")
+
+    # Snapshot of the configured values, for handing to worker processes
+    def settings(self) -> dict:
+        return dict(self.__dict__)
+
+    # Install the singleton from a snapshot taken by settings()
+    # (worker processes started by "spawn" do not inherit the singleton)
+    @classmethod
+    def restore(cls, settings: dict):
+        instance = super(TextHandler, cls).__new__(cls)
+        instance.__dict__.update(settings)
+        cls._instance = instance
+        return instance
 
 # Remove excessive whitespace and line breaks
 def clean_text(text: str) -> str:
@@ -68,19 +91,30 @@ def clean_text(text: str) -> str:
     text = re.sub(r' +\n', '\n', text)        # remove trailing spaces at line ends
     return text.strip()
 
-# Chunk text using LangChain's RecursiveCharacterTextSplitter
+# Chunk text at paragraph and sentence boundaries, sized in tokens of the
+# embedding model
 def chunk_text(text: str) -> List[str]:
+    with Tracer.span("chunk", characters=len(text)):
+        return list(iter_text_chunks(text))
+
+# Yield the chunks of text one at a time, as they are found
+def iter_text_chunks(text: str):
     text_handler = TextHandler()
     if text_handler.chunking_enabled:
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=text_handler.chunk_size,
-            chunk_overlap=text_handler.chunk_overlap,
-            separators=["\n\n", "\n", ".", "!", "?", " ", ""]
-        )
-        return splitter.split_text(text)
+        counter = token_counter(text_handler.tokenizer)
+        if counter.exact:
+            chunk_size = text_handler.chunk_size - counter.special_tokens
+        else:
+            chunk_size = text_handler.chunk_size_fallback
+        yield from iter_chunks(text, counter, chunk_size, text_handler.chunk_overlap)
     else:
         Diagnostics.warning(f"text chunking disabled")
-        return [text.strip()]
+        yield text.strip()
+
+# Pages with less text than this (in characters) are too short to judge by
+# their lines (title pages, tables of contents and slides are mostly short
+# lines), and are never considered garbage
+MIN_GARBAGE_CHECK_LENGTH = 500
 
 # Heuristic to detect if text is mostly unusable 
 # (e.g., vertical letters, too much whitespace, etc.)
@@ -102,7 +136,7 @@ def looks_like_garbage(text: str) -> bool:
     Diagnostics.debug(f"Short line ratio: {short_line_ratio}")
     Diagnostics.debug(f"Average line length: {avg_line_length}")
     return (
-            short_line_ratio > text_handler.single_char_line_threshold 
+            short_line_ratio > text_handler.short_line_threshold 
             or
             (
                 avg_line_length < text_handler.avg_line_length_threshold 
@@ -111,34 +145,88 @@ def looks_like_garbage(text: str) -> bool:
             )
            )
 
-# Extract text using OCR from scanned/image-only PDFs
-def extract_text_via_ocr(pdf_path: str) -> str:
+# Limit each OCR worker to a single tesseract thread
+# (parallelism comes from the worker pool; nested threads just contend)
+def _init_ocr_worker(profile: bool = False):
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    Tracer.enable(profile)
+    Tracer.drain()  # (forked workers inherit the spans of the parent)
+
+# Rasterize and OCR a single (1-based) page of a PDF
+# (only this page is ever held in memory as an image)
+def ocr_pdf_page(pdf_path: str, page_number: int, dpi: int) -> str:
+    import pytesseract
+    from pdf2image import convert_from_path
+    with Tracer.span("ocr.page", page=page_number):
+        images = convert_from_path(pdf_path, dpi, first_page=page_number, last_page=page_number)
+        return "\n".join(pytesseract.image_to_string(image).strip() for image in images)
+
+# OCR the given (1-based) pages of a PDF in a pool of worker processes
+# (memory is bounded by the number of workers, not the number of pages)
+# Return a mapping of page number to text
+def ocr_pdf_pages(pdf_path: str, page_numbers: List[int]) -> Dict[int, str]:
     text_handler = TextHandler()
-    if text_handler.ocr_enabled:
-        images = convert_from_path(pdf_path, text_handler.ocr_dpi)
-        ocr_text = []
-
-        for idx, image in enumerate(images):
-            text = pytesseract.image_to_string(image)
-            ocr_text.append(f"[Page {idx + 1}]\n{text.strip()}")
-
-        return "\n\n".join(ocr_text)
+    workers = min(text_handler.ocr_workers, len(page_numbers))
+    if workers <= 1:
+        texts = [ocr_pdf_page(pdf_path, n, text_handler.ocr_dpi) for n in page_numbers]
     else:
-        Diagnostics.warning(f"OCR disabled")
-        return ""
+        Diagnostics.debug(f"running OCR on {len(page_numbers)} pages with {workers} workers")
+        # (spawned rather than forked: the parent may be a multithreaded
+        #  daemon with torch loaded)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker,
+                                 initargs=(Tracer.is_enabled(),),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            texts = []
+            for text, spans in pool.map(call_traced, repeat(ocr_pdf_page),
+                                        repeat(pdf_path), page_numbers, repeat(text_handler.ocr_dpi)):
+                texts.append(text)
+                Tracer.merge(spans)
+    return dict(zip(page_numbers, texts))
 
 # Extract text using PyMuPDF 
-# (if empty or garbage, fallback to OCR)
+# (pages that come out empty or garbled are individually re-done via OCR)
 def extract_text_from_pdf(pdf_path: str) -> str:
-    doc = fitz.open(pdf_path)
-    all_text = [page.get_text() for page in doc]
-    full_text = "\n".join(all_text).strip()
-
-    # Check for extraction quality and fallback on OCR if required
-    if not full_text or looks_like_garbage(full_text):
-        Diagnostics.warning("falling back to OCR due to poor fitz extraction")
-        full_text = extract_text_via_ocr(pdf_path)
+    import fitz  # PyMuPDF
+    with Tracer.span("pdf.extract", file=os.path.basename(pdf_path)), fitz.open(pdf_path) as doc:
+        all_text = []
+        bad_pages = []
+        blank_pages = []
+        for page in doc:
+            text = page.get_text()
+            all_text.append(text)
+
+            # Check extraction quality per page
+            # (pages without text may still show it as images, including
+            #  inline ones, which get_images() does not list, or as vector
+            #  outlines; only truly blank pages have nothing for OCR to find)
+            if not text.strip():
+                if page.get_images() or page.get_image_info() or page.get_drawings():
+                    bad_pages.append(page.number + 1)
+                else:
+                    blank_pages.append(page.number + 1)
+            elif len(text.strip()) >= MIN_GARBAGE_CHECK_LENGTH and looks_like_garbage(text):
+                bad_pages.append(page.number + 1)
+
+    if blank_pages:
+        Diagnostics.warning(f"skipping {len(blank_pages)} blank pages of {pdf_path}: "
+                            f"{', '.join(str(n) for n in blank_pages)}")
+
+    # Fallback on OCR for the failing pages only, merging in page order
+    if bad_pages:
+        Diagnostics.warning(f"falling back to OCR for {len(bad_pages)} of {len(all_text)} pages "
+                            f"due to poor fitz extraction")
+        if TextHandler().ocr_enabled:
+            ocr_text = ocr_pdf_pages(pdf_path, bad_pages)
+        else:
+            Diagnostics.warning(f"OCR disabled")
+            ocr_text = {}
+        # (OCR'd pages are marked, as the text of whole-document OCR was)
+        for page_number in bad_pages:
+            text = ocr_text.get(page_number, "")
+            all_text[page_number - 1] = f"[Page {page_number}]\n{text}" if text else ""
+    Diagnostics.note(f"OCR used for {len(bad_pages)} of {len(all_text)} pages in {pdf_path}")
 
+    full_text = "\n".join(all_text).strip()
     return clean_text(full_text)
 
 # Extract and chunk text from a PDF file with OCR fallback and quality check
@@ -0,0 +1,133 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Timing spans around the hot paths, summarized per stage by "--profile" and
+# optionally written as a Chrome trace (viewable in chrome://tracing or
+# https://ui.perfetto.dev)
+#
+# Usage:
+#   with Tracer.span("embed", texts=len(texts)):
+#       ...
+# When profiling is off, span() returns a shared do-nothing context manager,
+# so instrumented code pays a single flag check
+
+# Import required modules
+import os
+import sys
+import json
+import math
+import time
+import threading
+from typing import List
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        # (list.append is atomic, so threads need no lock here)
+        Tracer._spans.append((self.name, self.start, end - self.start,
+                              os.getpid(), threading.get_ident(), self.args))
+        return False
+
+class Tracer:
+    """Records timing spans of the stages of a command, when enabled."""
+
+    _enabled = False
+    _spans: List[tuple] = []     # (name, start ns, duration ns, pid, thread id, args)
+
+    @classmethod
+    def enable(cls, enabled: bool):
+        cls._enabled = enabled
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return cls._enabled
+
+    # Time the enclosed block as a span of the given stage
+    # (keyword arguments are attached to the span in the trace)
+    @classmethod
+    def span(cls, name: str, **args):
+        if not cls._enabled:
+            return _NULL_SPAN
+        return _Span(name, args)
+
+    # Remove and return the spans recorded so far
+    # (worker processes hand their spans back to the parent this way; the
+    #  monotonic clock they are timed with is shared by all processes)
+    @classmethod
+    def drain(cls) -> List[tuple]:
+        spans, cls._spans = cls._spans, []
+        return spans
+
+    # Add spans recorded elsewhere (by a worker process)
+    @classmethod
+    def merge(cls, spans: List[tuple]) -> None:
+        cls._spans.extend(spans)
+
+    # Count, total, median and 95th percentile time (in milliseconds) of each
+    # stage, the stages taking the most time first
+    @classmethod
+    def summary(cls) -> dict:
+        stages = {}
+        for name, _, duration, _, _, _ in cls._spans:
+            stages.setdefault(name, []).append(duration / 1e6)
+        result = {}
+        for name, durations in sorted(stages.items(), key=lambda item: sum(item[1]), reverse=True):
+            durations.sort()
+            result[name] = {
+                "count": len(durations),
+                "total_ms": sum(durations),
+                "p50_ms": durations[math.ceil(0.50 * len(durations)) - 1],
+                "p95_ms": durations[math.ceil(0.95 * len(durations)) - 1],
+            }
+        return result
+
+    # Print the summary of the stages
+    @classmethod
+    def report(cls, file=sys.stderr) -> None:
+        stages = cls.summary()
+        if not stages:
+            print("profile: no spans recorded", file=file)
+            return
+
+        print(f"{'stage':<24} {'count':>7} {'total':>11} {'p50':>10} {'p95':>10}", file=file)
+        for name, stage in stages.items():
+            print(f"{name:<24} {stage['count']:>7} {stage['total_ms']:>9.1f}ms "
+                  f"{stage['p50_ms']:>8.2f}ms {stage['p95_ms']:>8.2f}ms", file=file)
+
+    # Write the spans in the Chrome trace event format
+    @classmethod
+    def write_chrome_trace(cls, path: str) -> None:
+        events = [
+            {"name": name, "ph": "X", "ts": start / 1000, "dur": duration / 1000,
+             "pid": pid, "tid": tid, "args": args}
+            for name, start, duration, pid, tid, args in cls._spans
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+# Call a function in a worker process, returning its result along with the
+# spans it recorded (for the parent to merge)
+def call_traced(function, *args):
+    result = function(*args)
+    return result, Tracer.drain()
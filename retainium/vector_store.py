@@ -0,0 +1,551 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Storage backends of the knowledge database: documents, their embeddings
+# and metadata, with "where" filters in the ChromaDB format
+#
+# Results are returned in the shape of ChromaDB results: get() returns a
+# dict of parallel "ids", "documents", "metadatas" and "embeddings" lists,
+# and query() a list of those per query embedding
+
+# Import required modules
+# (the storage libraries are imported on first use, since they are slow to
+#  load; ChromaDB in particular)
+import os
+import json
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+from retainium.diagnostics import Diagnostics
+
+# The names of the available backends
+BACKENDS = ("chroma", "numpy")
+
+# The knowledge database collection name
+# (changing this can cause loss of existing knowledge)
+COLLECTION_NAME = "retainium_knowledge"
+
+# The collection that a rebuild is written into before being swapped in
+# (if found without the main collection, a rebuild crashed mid-swap)
+STAGING_COLLECTION_NAME = COLLECTION_NAME + "_staging"
+
+class VectorStore:
+    """The storage operations the knowledge database is built on."""
+
+    # Number of entries (matching the "where" filter, if given)
+    def count(self, where: Optional[dict] = None) -> int:
+        raise NotImplementedError
+
+    # Add entries (entries with existing ids are left as they are)
+    def add(self, ids: List[str], documents: List[str], embeddings, metadatas: List[dict]) -> None:
+        raise NotImplementedError
+
+    # Replace the metadata of existing entries
+    def update(self, ids: List[str], metadatas: List[dict]) -> None:
+        raise NotImplementedError
+
+    # Fetch entries by id and/or filter, a page at a time
+    # ("include" selects among "documents", "metadatas" and "embeddings")
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None,
+            include: List[str] = (), limit: Optional[int] = None, offset: int = 0) -> dict:
+        raise NotImplementedError
+
+    # Find the "top_k" entries nearest to each embedding
+    def query(self, embeddings: List[List[float]], top_k: int, where: Optional[dict] = None) -> dict:
+        raise NotImplementedError
+
+    def delete(self, ids: List[str]) -> None:
+        raise NotImplementedError
+
+    # Largest number of entries accepted by a single add(), if limited
+    def max_batch_size(self) -> Optional[int]:
+        return None
+
+    # An empty store that a rebuild is written into (replacing any left over)
+    def create_staging(self) -> "VectorStore":
+        raise NotImplementedError
+
+    # Replace the contents of this store with those of the staging store
+    def swap_in(self, staging: "VectorStore") -> None:
+        raise NotImplementedError
+
+    def discard_staging(self, staging: "VectorStore") -> None:
+        raise NotImplementedError
+
+# Open the store of the given backend in the database directory
+def open_store(backend: str, persist_directory: str, vector_dtype: str = "float32") -> VectorStore:
+    if backend == "chroma":
+        return ChromaStore(persist_directory)
+    if backend == "numpy":
+        return NumpyStore(os.path.join(persist_directory, NUMPY_STORE_DIR_NAME), vector_dtype)
+    raise ValueError(f"unknown database backend \"{backend}\"; expected one of {', '.join(BACKENDS)}")
+
+class ChromaStore(VectorStore):
+    """A ChromaDB collection in a persistent client."""
+
+    def __init__(self, persist_directory: str, client=None, name: str = COLLECTION_NAME):
+        if client is None:
+            # (deferred import; only commands that touch the database pay for it)
+            import chromadb
+            client = chromadb.PersistentClient(path=persist_directory)
+        self.persist_directory = persist_directory
+        self.client = client
+        if name == COLLECTION_NAME:
+            self._recover_staging_collection()
+        self.collection = self.client.get_or_create_collection(name)
+        Diagnostics.note(f"using ChromaDB client collection \"{self.collection.name}\"")
+
+    def count(self, where: Optional[dict] = None) -> int:
+        if where is None:
+            return self.collection.count()
+        return len(self.collection.get(where=where, include=[])["ids"])
+
+    def add(self, ids, documents, embeddings, metadatas) -> None:
+        self.collection.add(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+
+    def update(self, ids, metadatas) -> None:
+        self.collection.update(ids=ids, metadatas=metadatas)
+
+    def get(self, ids=None, where=None, include=(), limit=None, offset=0) -> dict:
+        if ids is not None and not ids:
+            return {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+        return self.collection.get(ids=ids, where=where, include=list(include), limit=limit,
+                                   offset=offset)
+
+    def query(self, embeddings, top_k, where=None) -> dict:
+        return self.collection.query(query_embeddings=embeddings, n_results=top_k, where=where)
+
+    def delete(self, ids) -> None:
+        if ids:
+            self.collection.delete(ids=ids)
+
+    def max_batch_size(self) -> Optional[int]:
+        get_max_batch_size = getattr(self.client, "get_max_batch_size", None)
+        return get_max_batch_size() if get_max_batch_size else None
+
+    def create_staging(self) -> "ChromaStore":
+        if STAGING_COLLECTION_NAME in self._collection_names():
+            self.client.delete_collection(STAGING_COLLECTION_NAME)
+        return ChromaStore(self.persist_directory, self.client, STAGING_COLLECTION_NAME)
+
+    def swap_in(self, staging: "ChromaStore") -> None:
+        self.client.delete_collection(COLLECTION_NAME)
+        staging.collection.modify(name=COLLECTION_NAME)
+        self.collection = self.client.get_collection(COLLECTION_NAME)
+
+    def discard_staging(self, staging: "ChromaStore") -> None:
+        self.client.delete_collection(STAGING_COLLECTION_NAME)
+
+    # Names of the existing collections
+    # (older ChromaDB versions return collection objects, newer ones names)
+    def _collection_names(self) -> List[str]:
+        return [getattr(collection, "name", collection) for collection in self.client.list_collections()]
+
+    # Complete a rebuild that crashed after dropping the main collection
+    # (a staging collection next to an intact main collection is either a
+    #  rebuild in progress or a partial one, which the next rebuild discards)
+    def _recover_staging_collection(self) -> None:
+        names = self._collection_names()
+        if STAGING_COLLECTION_NAME in names and COLLECTION_NAME not in names:
+            Diagnostics.warning("completing interrupted index rebuild")
+            self.client.get_collection(STAGING_COLLECTION_NAME).modify(name=COLLECTION_NAME)
+
+# Directory of the NumPy store, within the database directory
+# (a rebuild is written next to it, with the staging suffix, and swapped in)
+NUMPY_STORE_DIR_NAME = "vectors"
+NUMPY_STAGING_SUFFIX = ".staging"
+
+# Files of the NumPy store: the embedding matrix, and the ids, documents and
+# metadata of its rows
+MATRIX_FILE_NAME = "embeddings.bin"
+RECORDS_FILE_NAME = "records.db"
+
+# Rows the matrix file is grown by, at least
+MATRIX_GROWTH_ROWS = 1024
+
+# Rows scored at once (bounds the float32 copy of a float16 matrix)
+SCORE_BLOCK_ROWS = 8192
+
+# Largest number of values bound to one SQLite statement
+SQLITE_MAX_VARIABLES = 900
+
+# ChromaDB filter operators and their SQL equivalents
+_SQL_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+# Translate a ChromaDB "where" filter into an SQL condition on the JSON
+# metadata of the records
+# Return the condition and its parameters
+def where_to_sql(where: Optional[dict]) -> Tuple[str, list]:
+    if not where:
+        return "1", []
+    clauses, params = [], []
+    for key, value in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_to_sql(condition) for condition in value]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(clause for clause, _ in parts) + ")")
+            params.extend(param for _, part_params in parts for param in part_params)
+            continue
+
+        field = "json_extract(metadata, ?)"
+        path = '$."' + key + '"'
+        conditions = value if isinstance(value, dict) else {"$eq": value}
+        for operator, operand in conditions.items():
+            if operator in ("$in", "$nin"):
+                placeholders = ", ".join("?" * len(operand)) or "NULL"
+                negate = "NOT " if operator == "$nin" else ""
+                clauses.append(f"{field} {negate}IN ({placeholders})")
+                params.extend([path] + list(operand))
+            elif operator in _SQL_OPERATORS:
+                clauses.append(f"{field} {_SQL_OPERATORS[operator]} ?")
+                params.extend([path, operand])
+            else:
+                raise ValueError(f"unsupported filter operator \"{operator}\"")
+    return "(" + " AND ".join(clauses) + ")", params
+
+class NumpyStore(VectorStore):
+    """Embeddings in a memory-mapped matrix file, ranked exactly by vectorized
+    dot products, with the ids, documents and metadata of its rows in SQLite.
+
+    The matrix holds no gaps: deleting an entry moves the last row into its
+    place. Every write bumps a version in SQLite, which tells the processes
+    sharing the store (and the page cache of its matrix) to re-map it. A
+    rebuild replaces the files altogether, which the processes sharing the
+    store notice by the identity of its records file, and reopen it."""
+
+    def __init__(self, path: str, vector_dtype: str = "float32"):
+        # (deferred import; only commands that touch the database pay for it)
+        import numpy
+        self.np = numpy
+        self.path = path
+        self._lock = threading.Lock()
+        self._recover_staging()
+        self._open(vector_dtype)
+        Diagnostics.note(f"using NumPy vector store at {path} ({self.dtype.name})")
+
+    # Open (or create) the files of the store
+    def _open(self, vector_dtype: str) -> None:
+        path = self.path
+        os.makedirs(path, exist_ok=True)
+        # (the identity is taken before connecting: should the files be
+        #  replaced in between, the next check reopens them once more)
+        self._identity = self._records_identity()
+        self.connection = sqlite3.connect(os.path.join(path, RECORDS_FILE_NAME),
+                                          check_same_thread=False, isolation_level=None)
+        if self._identity is None:
+            self._identity = self._records_identity()
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, "
+            "row INTEGER NOT NULL UNIQUE, document TEXT, metadata TEXT)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value)"
+        )
+
+        # The element type is fixed when the store is created
+        stored_dtype = self._state("dtype")
+        if stored_dtype is None:
+            self.connection.execute("INSERT INTO state (key, value) VALUES ('dtype', ?)", (vector_dtype,))
+            stored_dtype = vector_dtype
+        elif stored_dtype != vector_dtype:
+            Diagnostics.warning(f"vector store holds {stored_dtype} embeddings; ignoring configured {vector_dtype}")
+        self.dtype = self.np.dtype(stored_dtype)
+
+        self._version = None    # Version the matrix was mapped at
+        self._matrix = None     # Memory-mapped matrix (None while empty)
+        self._norms = None      # Squared norms of the rows, computed on first query
+
+    # Value of a state variable (None if unset)
+    def _state(self, key: str):
+        row = self.connection.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, key: str, value) -> None:
+        self.connection.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
+
+    # Device and inode of the records file (None if missing)
+    def _records_identity(self):
+        try:
+            stat = os.stat(os.path.join(self.path, RECORDS_FILE_NAME))
+        except OSError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    # Reopen the store if a rebuild replaced its files
+    # (until then, the old files remain readable, as they are still open;
+    #  while a rebuild is moving them, the old ones are kept)
+    # (called with the lock held)
+    def _reopen_if_replaced(self) -> None:
+        identity = self._records_identity()
+        if identity is None or identity == self._identity:
+            return
+        Diagnostics.debug(f"vector store at {self.path} was rebuilt; reopening it")
+        self._matrix = None
+        self.connection.close()
+        self._open(self.dtype.name)
+
+    # Re-map the matrix if another process (or this one) has written to it,
+    # reopening the store if it was rebuilt (called with the lock held)
+    def _refresh(self) -> None:
+        self._reopen_if_replaced()
+        version = self._state("version") or 0
+        if version == self._version:
+            return
+        self._version = version
+        self._norms = None
+        self._matrix = None
+        dimension = self._state("dimension")
+        matrix_path = os.path.join(self.path, MATRIX_FILE_NAME)
+        if dimension and os.path.exists(matrix_path):
+            capacity = os.path.getsize(matrix_path) // (dimension * self.dtype.itemsize)
+            if capacity:
+                self._matrix = self.np.memmap(matrix_path, dtype=self.dtype, mode="r+",
+                                              shape=(capacity, dimension))
+
+    # Number of rows in use (called with the lock held)
+    def _rows(self) -> int:
+        return self._state("rows") or 0
+
+    # Grow the matrix file to hold at least "rows" rows
+    # (the file never shrinks, as other processes may have it mapped)
+    # (called with the lock held, within a write transaction)
+    def _reserve(self, rows: int, dimension: int) -> None:
+        capacity = 0 if self._matrix is None else self._matrix.shape[0]
+        if rows <= capacity:
+            return
+        capacity = max(rows, 2 * capacity, MATRIX_GROWTH_ROWS)
+        matrix_path = os.path.join(self.path, MATRIX_FILE_NAME)
+        row_size = dimension * self.dtype.itemsize
+        size = capacity * row_size
+        if os.path.exists(matrix_path):
+            size = max(size, os.path.getsize(matrix_path))
+        with open(matrix_path, "ab") as f:
+            f.truncate(size)
+        capacity = size // row_size
+        self._matrix = self.np.memmap(matrix_path, dtype=self.dtype, mode="r+",
+                                      shape=(capacity, dimension))
+
+    # Hold the lock and an exclusive write transaction, which is committed
+    # (marking the write, so that the matrix is re-mapped here and elsewhere)
+    # if the block completes and rolled back otherwise
+    @contextmanager
+    def _write_transaction(self):
+        with self._lock:
+            self._reopen_if_replaced()
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._refresh()
+                yield
+                if self._matrix is not None:
+                    self._matrix.flush()
+                self._set_state("version", (self._state("version") or 0) + 1)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                self._version = None
+                raise
+
+    def count(self, where: Optional[dict] = None) -> int:
+        condition, params = where_to_sql(where)
+        with self._lock:
+            self._reopen_if_replaced()
+            return self.connection.execute(f"SELECT COUNT(*) FROM records WHERE {condition}",
+                                           params).fetchone()[0]
+
+    def add(self, ids, documents, embeddings, metadatas) -> None:
+        if not ids:
+            return
+        vectors = self.np.asarray(embeddings, dtype=self.np.float32)
+        with self._write_transaction():
+            dimension = self._state("dimension")
+            if dimension is None:
+                dimension = vectors.shape[1]
+                self._set_state("dimension", dimension)
+            if vectors.shape[1] != dimension:
+                raise ValueError(f"embedding dimension {vectors.shape[1]} does not match "
+                                 f"the store's dimension {dimension}")
+
+            # Append the new entries (existing ids are left as they are)
+            existing = set(self._existing(ids))
+            new = []
+            for n, id in enumerate(ids):
+                if id not in existing:
+                    existing.add(id)
+                    new.append(n)
+            rows = self._rows()
+            self._reserve(rows + len(new), dimension)
+            self._matrix[rows:rows + len(new)] = vectors[new]
+            self.connection.executemany(
+                "INSERT INTO records (id, row, document, metadata) VALUES (?, ?, ?, ?)",
+                [(ids[n], rows + k, documents[n], json.dumps(metadatas[n])) for k, n in enumerate(new)]
+            )
+            self._set_state("rows", rows + len(new))
+
+    # Those of the given ids already present (called with the lock held)
+    def _existing(self, ids: List[str]) -> List[str]:
+        found = []
+        for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+            batch = ids[start:start + SQLITE_MAX_VARIABLES]
+            found += [row[0] for row in self.connection.execute(
+                f"SELECT id FROM records WHERE id IN ({', '.join('?' * len(batch))})", batch)]
+        return found
+
+    def update(self, ids, metadatas) -> None:
+        with self._write_transaction():
+            self.connection.executemany("UPDATE records SET metadata = ? WHERE id = ?",
+                                        [(json.dumps(metadata), id) for id, metadata in zip(ids, metadatas)])
+
+    def get(self, ids=None, where=None, include=(), limit=None, offset=0) -> dict:
+        condition, params = where_to_sql(where)
+        with self._lock:
+            self._refresh()
+            if ids is None:
+                query = f"SELECT id, row, document, metadata FROM records WHERE {condition} ORDER BY seq"
+                if limit is not None:
+                    query += f" LIMIT {int(limit)} OFFSET {int(offset or 0)}"
+                records = self.connection.execute(query, params).fetchall()
+            else:
+                records = []
+                for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+                    batch = ids[start:start + SQLITE_MAX_VARIABLES]
+                    records += self.connection.execute(
+                        f"SELECT id, row, document, metadata FROM records "
+                        f"WHERE id IN ({', '.join('?' * len(batch))}) AND {condition} ORDER BY seq",
+                        batch + params).fetchall()
+                records = records[offset or 0:][:limit]
+            return self._results(records, include)
+
+    # Gather records into a result dict (called with the lock held)
+    def _results(self, records, include) -> dict:
+        results = {"ids": [record[0] for record in records], "documents": None,
+                   "metadatas": None, "embeddings": None}
+        if "documents" in include:
+            results["documents"] = [record[2] for record in records]
+        if "metadatas" in include:
+            results["metadatas"] = [json.loads(record[3]) for record in records]
+        if "embeddings" in include:
+            results["embeddings"] = [self.np.array(self._matrix[record[1]], dtype=self.np.float32)
+                                     for record in records]
+        return results
+
+    # Nearest rows by squared Euclidean distance (the ChromaDB default),
+    # |q - x|^2 = |q|^2 - 2 q.x + |x|^2, ranked by 2 q.x - |x|^2
+    def query(self, embeddings, top_k, where=None) -> dict:
+        np = self.np
+        queries = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            self._refresh()
+            rows = self._rows()
+            if where is None:
+                candidates = None
+                total = rows
+            else:
+                condition, params = where_to_sql(where)
+                candidates = np.fromiter((row for row, in self.connection.execute(
+                                          f"SELECT row FROM records WHERE {condition}", params)),
+                                         dtype=np.int64)
+                total = len(candidates)
+
+            matches = [[] for _ in range(len(queries))]
+            distances = [[] for _ in range(len(queries))]
+            if total and self._matrix is not None:
+                if self._norms is None:
+                    self._norms = self._row_norms(rows)
+
+                # Score in blocks of rows, keeping the "top_k" best of each
+                scores = np.empty((len(queries), total), dtype=np.float32)
+                for start in range(0, total, SCORE_BLOCK_ROWS):
+                    end = min(start + SCORE_BLOCK_ROWS, total)
+                    block_rows = slice(start, end) if candidates is None else candidates[start:end]
+                    block = np.asarray(self._matrix[block_rows], dtype=np.float32)
+                    scores[:, start:end] = 2 * (queries @ block.T) - self._norms[block_rows]
+                k = min(top_k, total)
+                for q in range(len(queries)):
+                    best = np.argpartition(-scores[q], k - 1)[:k]
+                    best = best[np.argsort(-scores[q][best], kind="stable")]
+                    matches[q] = best if candidates is None else candidates[best]
+                    query_norm = float(queries[q] @ queries[q])
+                    distances[q] = [query_norm - float(scores[q][n]) for n in best]
+
+            # Fetch the records of the matches, in rank order
+            wanted = sorted({int(row) for rows_of_query in matches for row in rows_of_query})
+            records = {}
+            for start in range(0, len(wanted), SQLITE_MAX_VARIABLES):
+                batch = wanted[start:start + SQLITE_MAX_VARIABLES]
+                for record in self.connection.execute(
+                        f"SELECT id, row, document, metadata FROM records "
+                        f"WHERE row IN ({', '.join('?' * len(batch))})", batch):
+                    records[record[1]] = record
+
+            results = {"ids": [], "documents": [], "metadatas": [], "distances": distances}
+            for rows_of_query in matches:
+                query_records = [records[int(row)] for row in rows_of_query]
+                results["ids"].append([record[0] for record in query_records])
+                results["documents"].append([record[2] for record in query_records])
+                results["metadatas"].append([json.loads(record[3]) for record in query_records])
+            return results
+
+    # Squared norms of the first "rows" rows (called with the lock held)
+    def _row_norms(self, rows: int):
+        np = self.np
+        norms = np.empty(rows, dtype=np.float32)
+        for start in range(0, rows, SCORE_BLOCK_ROWS):
+            block = np.asarray(self._matrix[start:min(start + SCORE_BLOCK_ROWS, rows)], dtype=np.float32)
+            norms[start:start + len(block)] = np.einsum("ij,ij->i", block, block)
+        return norms
+
+    # Delete entries, filling each gap with the last row
+    def delete(self, ids) -> None:
+        if not ids:
+            return
+        with self._write_transaction():
+            rows = self._rows()
+            for id in ids:
+                record = self.connection.execute("SELECT row FROM records WHERE id = ?", (id,)).fetchone()
+                if record is None:
+                    continue
+                row, last = record[0], rows - 1
+                self.connection.execute("DELETE FROM records WHERE id = ?", (id,))
+                if row != last:
+                    self._matrix[row] = self._matrix[last]
+                    self.connection.execute("UPDATE records SET row = ? WHERE row = ?", (row, last))
+                rows -= 1
+            self._set_state("rows", rows)
+
+    def create_staging(self) -> "NumpyStore":
+        staging_path = self.path + NUMPY_STAGING_SUFFIX
+        shutil.rmtree(staging_path, ignore_errors=True)
+        return NumpyStore(staging_path, self.dtype.name)
+
+    def swap_in(self, staging: "NumpyStore") -> None:
+        with self._lock:
+            staging.close()
+            self.connection.close()
+            self._matrix = None
+            old_path = self.path + ".old"
+            shutil.rmtree(old_path, ignore_errors=True)
+            os.rename(self.path, old_path)
+            os.rename(staging.path, self.path)
+            shutil.rmtree(old_path, ignore_errors=True)
+            self._open(self.dtype.name)
+
+    def discard_staging(self, staging: "NumpyStore") -> None:
+        staging.close()
+        shutil.rmtree(staging.path, ignore_errors=True)
+
+    def close(self) -> None:
+        with self._lock:
+            self._matrix = None
+            self.connection.close()
+
+    # Complete a rebuild that crashed after moving the main store aside
+    def _recover_staging(self) -> None:
+        staging_path = self.path + NUMPY_STAGING_SUFFIX
+        if os.path.isdir(staging_path) and not os.path.isdir(self.path) \
+                and os.path.isdir(self.path + ".old"):
+            Diagnostics.warning("completing interrupted index rebuild")
+            os.rename(staging_path, self.path)
+            shutil.rmtree(self.path + ".old", ignore_errors=True)
@@ -15,13 +15,21 @@ setup(
     include_package_data=True,
     install_requires=[
         "chromadb>=0.4.21",
-        "langchain>=0.1.0",
         "sentence-transformers>=2.2.2",
         "nltk>=3.8.1",
         "tqdm>=4.66.1",
         "configparser>=5.3.0",
+        "tokenizers",  # sizes chunks in tokens of the embedding model
         "uuid",  # comes with stdlib in Python 3, can be omitted if needed
     ],
+    extras_require={
+        # Only for comparison in bin/chunk-bench.py
+        "bench": ["langchain>=0.1.0"],
+        # The "onnx" embedding backend
+        "onnx": ["onnxruntime>=1.16", "onnx", "tokenizers", "huggingface_hub"],
+        # The tests under tests/
+        "test": ["pytest"],
+    },
     entry_points={
         "console_scripts": [
             "retainium=retainium.cli:main",
@@ -0,0 +1,55 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Shared setup of the tests
+
+# Enable relative module lookups
+# (protect against symlinks using realpath())
+import os, sys
+root = os.path.realpath(os.path.dirname(__file__) + "/..")
+if root not in sys.path:
+    sys.path.insert(0, root)
+
+# Import required modules
+import configparser
+import pytest
+from retainium.text_utils import TextHandler
+
+# Text handling with the default settings
+# (the handler is a singleton, shared by all the tests)
+TextHandler(configparser.ConfigParser())
+
+class FakeEmbeddingHandler:
+    """Deterministic embeddings without a model: the counts of a few letters."""
+
+    batch_size = 8
+
+    def embed(self, text: str) -> list:
+        return [float(text.lower().count(letter)) for letter in "aeiost"]
+
+    def embed_batch(self, texts):
+        return [self.embed(text) for text in texts]
+
+class FakeLLMHandler:
+    """Deterministic summaries and tags without a model, counting the calls."""
+
+    combined_summary_tags = False
+
+    def __init__(self):
+        self.calls = 0
+
+    def summarize_info(self, text: str, context: str = "") -> str:
+        self.calls += 1
+        return f"Summary: {text}"
+
+    def auto_tags(self, text: str):
+        self.calls += 1
+        return text.lower().split()[:2]
+
+@pytest.fixture
+def embedding_handler():
+    return FakeEmbeddingHandler()
+
+@pytest.fixture
+def llm_handler():
+    return FakeLLMHandler()
@@ -0,0 +1,107 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Tests of chunk boundaries and overlap, with the estimated token counts
+# (the same rules apply with the tokenizer of the embedding model)
+
+import pytest
+from retainium.chunker import TokenCounter, iter_chunks, split_long_sentence
+
+@pytest.fixture(scope="module")
+def counter():
+    counter = TokenCounter("no-such-tokenizer")
+    assert not counter.exact
+    return counter
+
+# Sentences of varying lengths, numbered so that each is distinct
+def make_sentences(count: int):
+    words = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"]
+    return [f"Sentence {n} says " + " ".join(words[:n % len(words) + 1]) + "."
+            for n in range(count)]
+
+def make_text(paragraphs: int, sentences: int) -> str:
+    numbered = iter(make_sentences(paragraphs * sentences))
+    return "\n\n".join(" ".join(next(numbered) for _ in range(sentences))
+                       for _ in range(paragraphs))
+
+# The sentences of a chunk (all of them whole, none split)
+def sentences_of(chunk: str):
+    return [sentence.strip() for sentence in chunk.replace("\n\n", " ").split(".") if sentence.strip()]
+
+def test_estimated_counts(counter):
+    assert counter.count("Hello, world!") == 4
+    assert counter.offsets(["ab cd"]) == [[(0, 2), (3, 5)]]
+
+@pytest.mark.parametrize("chunk_size", [16, 40, 100])
+def test_chunks_fit_and_keep_every_sentence_in_order(counter, chunk_size):
+    text = make_text(paragraphs=6, sentences=5)
+    chunks = list(iter_chunks(text, counter, chunk_size))
+    assert len(chunks) > 1
+    assert all(counter.count(chunk) <= chunk_size for chunk in chunks)
+    found = [sentence for chunk in chunks for sentence in sentences_of(chunk)]
+    assert found == sentences_of(text)
+
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(40, 12), (60, 20), (100, 50)])
+def test_overlap_carries_whole_trailing_sentences(counter, chunk_size, chunk_overlap):
+    text = make_text(paragraphs=4, sentences=6)
+    chunks = list(iter_chunks(text, counter, chunk_size, chunk_overlap))
+    assert all(counter.count(chunk) <= chunk_size for chunk in chunks)
+
+    overlapped = 0
+    for previous, chunk in zip(chunks, chunks[1:]):
+        previous, chunk = sentences_of(previous), sentences_of(chunk)
+        # The chunk starts with the tail of the previous one, if anything
+        shared = next((n for n in range(len(chunk), 0, -1) if chunk[:n] == previous[-n:]), 0)
+        assert shared < len(chunk)
+        assert sum(counter.count(sentence + ".") for sentence in chunk[:shared]) <= chunk_overlap
+        overlapped += bool(shared)
+    assert overlapped
+
+    # Without the overlaps, the chunks hold every sentence once, in order
+    found = sentences_of(chunks[0])
+    for chunk in chunks[1:]:
+        chunk = sentences_of(chunk)
+        found += chunk[chunk.index(found[-1]) + 1:] if found[-1] in chunk else chunk
+    assert found == sentences_of(text)
+
+# The overlap never exceeds half a chunk
+def test_overlap_is_capped(counter):
+    text = make_text(paragraphs=1, sentences=30)
+    for chunk in iter_chunks(text, counter, 40, chunk_overlap=200):
+        assert counter.count(chunk) <= 40
+
+def test_no_repeats_without_overlap(counter):
+    text = make_text(paragraphs=5, sentences=4)
+    found = [sentence for chunk in iter_chunks(text, counter, 30) for sentence in sentences_of(chunk)]
+    assert len(found) == len(set(found))
+
+def test_short_text_is_one_chunk(counter):
+    assert list(iter_chunks("One sentence.\n\nAnother one.", counter, 100)) == ["One sentence.\n\nAnother one."]
+    assert list(iter_chunks("  \n\n ", counter, 100)) == []
+
+# A paragraph that does not fit in the rest of a half-full chunk starts the next
+def test_paragraphs_start_new_chunks(counter):
+    sentences = make_sentences(6)
+    first = " ".join(sentences[:3])             # 18 tokens
+    second = " ".join(sentences[3:])            # 27 tokens
+    chunks = list(iter_chunks(first + "\n\n" + second, counter, 36))
+    assert chunks == [first, second]
+
+    # ...but fills the rest of a chunk less than half full
+    short = " ".join(sentences[:2])             # 11 tokens
+    chunks = list(iter_chunks(short + "\n\n" + second, counter, 36))
+    assert chunks == [short + "\n\n" + " ".join(sentences[3:5]), sentences[5]]
+
+# Sentences longer than a chunk are split, between words
+def test_long_sentences_are_split(counter):
+    sentence = " ".join(f"word{n}" for n in range(95)) + "."
+    chunks = list(iter_chunks(sentence, counter, 20))
+    assert len(chunks) == 5
+    assert all(counter.count(chunk) <= 20 for chunk in chunks)
+    assert " ".join(chunks) == sentence
+
+def test_split_long_sentence_prefers_line_breaks(counter):
+    sentence = "one two three four\nfive six seven eight nine ten"
+    offsets = counter.offsets([sentence])[0]
+    pieces = list(split_long_sentence(sentence, offsets, 6))
+    assert pieces == [("one two three four", 4), ("five six seven eight nine ten", 6)]
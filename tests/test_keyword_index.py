@@ -0,0 +1,78 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Tests of keyword search and of its fusion with similarity search
+
+from retainium.keyword_index import KeywordIndex, reciprocal_rank_fusion, tokenize
+from retainium.knowledge import KnowledgeDB
+from retainium.query_knowledge import retrieve
+
+def make_index(tmp_path) -> KeywordIndex:
+    index = KeywordIndex(str(tmp_path / "keyword_index.db"))
+    index.add([
+        ("gpu", "The H100-SXM5 GPU has 80 GB of memory", ["hardware"]),
+        ("cuda", "CUDA 12.2.1 adds support for new GPUs", ["software"]),
+        ("cake", "Bake the cake for forty minutes", ["recipe"]),
+        ("bread", "Bake bread, then bake it again for a crisp crust", ["recipe", "bread"]),
+    ])
+    return index
+
+def test_tokenize_keeps_identifiers_and_their_parts():
+    assert tokenize("The H100-SXM5, v10.2.1") == ["the", "h100-sxm5", "h100", "sxm5", "v10.2.1", "v10", "2", "1"]
+
+def test_search_ranks_by_bm25(tmp_path):
+    index = make_index(tmp_path)
+    ranked = index.search("bake")
+    assert [id for id, score in ranked] == ["bread", "cake"]
+    assert ranked[0][1] > ranked[1][1] > 0
+    assert index.search("bake", top_k=1) == ranked[:1]
+
+def test_search_matches_identifiers_and_tags(tmp_path):
+    index = make_index(tmp_path)
+    assert [id for id, score in index.search("h100-sxm5")] == ["gpu"]
+    assert [id for id, score in index.search("sxm5")] == ["gpu"]
+    assert [id for id, score in index.search("12.2.1")] == ["cuda"]
+    assert [id for id, score in index.search("software")] == ["cuda"]
+
+def test_search_without_matches(tmp_path):
+    index = make_index(tmp_path)
+    assert index.search("submarine") == []
+    assert index.search("?!") == []
+    assert KeywordIndex(str(tmp_path / "empty.db")).search("bake") == []
+
+def test_reindex_delete_and_clear(tmp_path):
+    index = make_index(tmp_path)
+    assert index.count() == 4
+
+    # Re-indexing an entry replaces its terms
+    index.add([("cake", "Ice the cupcakes", ["recipe"])])
+    assert index.count() == 4
+    assert [id for id, score in index.search("bake")] == ["bread"]
+
+    index.delete(["bread", "missing"])
+    assert index.count() == 3
+    assert index.search("bake") == []
+
+    index.clear()
+    assert index.count() == 0
+    assert index.search("gpu") == []
+
+def test_reciprocal_rank_fusion():
+    # Ranked high in both beats ranked first in only one
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["b", "d", "a"]]) == ["b", "a", "d", "c"]
+    assert reciprocal_rank_fusion([["a", "b"], []]) == ["a", "b"]
+    assert reciprocal_rank_fusion([]) == []
+
+# Hybrid retrieval finds what either similarity or keyword search ranks high
+def test_hybrid_retrieval(tmp_path, embedding_handler, llm_handler):
+    db = KnowledgeDB(str(tmp_path / "db"), backend="numpy")
+    texts = ["The H100-SXM5 GPU has 80 GB of memory", "Bake the cake for forty minutes",
+             "Bake bread, then bake it again for a crisp crust"]
+    db.add_entries(texts, ["notes"] * 3, embedding_handler, llm_handler, tags=[[], [], []])
+
+    keyword = retrieve("H100-SXM5", 1, db, embedding_handler, mode="keyword")
+    assert [entry.text for entry in keyword] == texts[:1]
+
+    hybrid = retrieve("H100-SXM5", 3, db, embedding_handler, mode="hybrid")
+    assert len(hybrid) == 3
+    assert hybrid[0].text == texts[0]
@@ -0,0 +1,146 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Tests of the ingest manifest and of the incremental imports built on it
+
+import os
+import json
+from retainium.import_knowledge import import_inputs
+from retainium.knowledge import KnowledgeDB, compute_text_uuid
+from retainium.manifest import IngestManifest, MANIFEST_FILE_NAME, file_state
+
+# Write the texts as a JSON Lines file of entries
+def write_entries(path, texts) -> str:
+    with open(path, "w", encoding="utf-8") as f:
+        for text in texts:
+            f.write(json.dumps({"text": text}) + "\n")
+    return str(path)
+
+def open_db(directory) -> KnowledgeDB:
+    return KnowledgeDB(str(directory), backend="numpy")
+
+# A recorded file is unchanged until its content changes
+def test_is_unchanged(tmp_path):
+    path = write_entries(tmp_path / "a.jsonl", ["one"])
+    manifest = IngestManifest(str(tmp_path / MANIFEST_FILE_NAME))
+    assert not manifest.is_unchanged(path)
+
+    manifest.update(path, file_state(path), [["chunk", "entry"]])
+    assert manifest.is_unchanged(path)
+
+    # Touched only: still unchanged, and the new mtime is remembered
+    os.utime(path, (1, 1))
+    assert manifest.is_unchanged(path)
+    assert manifest.get(path)["mtime"] == 1
+
+    # Same size, different content
+    write_entries(path, ["two"])
+    os.utime(path, (2, 2))
+    assert not manifest.is_unchanged(path)
+
+# A partially imported file is never skipped
+def test_incomplete_record_is_not_unchanged(tmp_path):
+    path = write_entries(tmp_path / "a.jsonl", ["one"])
+    manifest = IngestManifest(str(tmp_path / MANIFEST_FILE_NAME))
+    manifest.update(path, file_state(path), [], complete=False)
+    assert not manifest.is_unchanged(path)
+
+# The recorded state is the one given, not the file's current one
+def test_update_records_given_state(tmp_path):
+    path = write_entries(tmp_path / "a.jsonl", ["one"])
+    state = file_state(path)
+    write_entries(path, ["edited while importing"])
+    manifest = IngestManifest(str(tmp_path / MANIFEST_FILE_NAME))
+    manifest.update(path, state, [])
+    assert manifest.get(path)["sha256"] == state["sha256"]
+    assert not manifest.is_unchanged(path)
+
+def test_save_and_reload(tmp_path):
+    path = write_entries(tmp_path / "a.jsonl", ["one"])
+    manifest_path = str(tmp_path / MANIFEST_FILE_NAME)
+    manifest = IngestManifest(manifest_path)
+    manifest.update(path, file_state(path), [["c1", "e1"], ["c2", None]])
+    manifest.save()
+    assert IngestManifest(manifest_path).get(path)["chunks"] == [["c1", "e1"], ["c2", None]]
+
+def test_referenced_entries(tmp_path):
+    a = write_entries(tmp_path / "a.jsonl", ["one"])
+    b = write_entries(tmp_path / "b.jsonl", ["two"])
+    manifest = IngestManifest(str(tmp_path / MANIFEST_FILE_NAME))
+    manifest.update(a, file_state(a), [["c1", "e1"], ["c2", None]])
+    manifest.update(b, file_state(b), [["c3", "e3"]])
+    assert manifest.referenced_entries() == {"e1", "e3"}
+    assert manifest.referenced_entries(exclude=a) == {"e3"}
+
+# Unchanged files are skipped by the next import, without any LLM work
+def test_import_skips_unchanged_files(tmp_path, embedding_handler, llm_handler):
+    path = write_entries(tmp_path / "a.jsonl", ["first fact", "second fact", "third fact"])
+    db = open_db(tmp_path / "db")
+    counts = import_inputs([path], db, embedding_handler, llm_handler, workers=1)
+    assert counts == {"files": 1, "chunks": 3, "failed": 0}
+    assert db.count() == 3
+
+    calls = llm_handler.calls
+    counts = import_inputs([path], db, embedding_handler, llm_handler, workers=1)
+    assert counts["files"] == 0
+    assert llm_handler.calls == calls
+
+    # A forced import processes the file again, adding nothing new
+    counts = import_inputs([path], db, embedding_handler, llm_handler, workers=1, force=True)
+    assert counts["files"] == 1
+    assert db.count() == 3
+
+# Only the new chunks of a changed file are summarized
+def test_import_reuses_unchanged_chunks(tmp_path, embedding_handler, llm_handler):
+    path = write_entries(tmp_path / "a.jsonl", ["first fact", "second fact"])
+    db = open_db(tmp_path / "db")
+    import_inputs([path], db, embedding_handler, llm_handler, workers=1)
+
+    write_entries(path, ["first fact", "second fact", "third fact"])
+    calls = llm_handler.calls
+    import_inputs([path], db, embedding_handler, llm_handler, workers=1)
+    assert llm_handler.calls - calls == 2     # One summary and its tags
+    assert db.count() == 3
+
+# Entries of chunks that disappeared from a file are removed with --prune
+def test_import_prunes_stale_entries(tmp_path, embedding_handler, llm_handler):
+    path = write_entries(tmp_path / "a.jsonl", ["first fact", "second fact"])
+    db = open_db(tmp_path / "db")
+    import_inputs([path], db, embedding_handler, llm_handler, workers=1)
+
+    write_entries(path, ["first fact", "replacement fact"])
+    import_inputs([path], db, embedding_handler, llm_handler, workers=1, prune=True)
+    texts = sorted(entry.text for entry in db.list_entries())
+    assert texts == ["Summary: first fact", "Summary: replacement fact"]
+
+# Without --prune, the entries of removed chunks are kept
+def test_import_keeps_stale_entries_without_prune(tmp_path, embedding_handler, llm_handler):
+    path = write_entries(tmp_path / "a.jsonl", ["first fact", "second fact"])
+    db = open_db(tmp_path / "db")
+    import_inputs([path], db, embedding_handler, llm_handler, workers=1)
+
+    write_entries(path, ["first fact", "replacement fact"])
+    import_inputs([path], db, embedding_handler, llm_handler, workers=1)
+    assert db.count() == 3
+
+# An entry still produced by another file survives pruning
+def test_prune_keeps_entries_shared_with_other_files(tmp_path, embedding_handler, llm_handler):
+    a = write_entries(tmp_path / "a.jsonl", ["shared fact", "only in a"])
+    b = write_entries(tmp_path / "b.jsonl", ["shared fact"])
+    db = open_db(tmp_path / "db")
+    import_inputs([a, b], db, embedding_handler, llm_handler, workers=1)
+
+    write_entries(a, ["only in a"])
+    import_inputs([a], db, embedding_handler, llm_handler, workers=1, prune=True)
+    shared = compute_text_uuid("Summary: shared fact")
+    assert db.existing_ids([shared]) == [shared]
+
+# With --force, previously imported chunks are redone but still pruned
+def test_forced_import_still_prunes(tmp_path, embedding_handler, llm_handler):
+    path = write_entries(tmp_path / "a.jsonl", ["first fact", "second fact"])
+    db = open_db(tmp_path / "db")
+    import_inputs([path], db, embedding_handler, llm_handler, workers=1)
+
+    write_entries(path, ["first fact"])
+    import_inputs([path], db, embedding_handler, llm_handler, workers=1, force=True, prune=True)
+    assert [entry.text for entry in db.list_entries()] == ["Summary: first fact"]
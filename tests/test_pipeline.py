@@ -0,0 +1,79 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Tests of the staged processing pipeline
+
+import threading
+from retainium.pipeline import Pipeline
+
+# Items pass through all the stages, in order
+def test_items_pass_through_in_order():
+    results = []
+    pipeline = Pipeline(queue_size=2)
+    pipeline.add_stage("double", lambda batch: [item * 2 for item in batch])
+    pipeline.add_stage("increment", lambda batch: (item + 1 for item in batch), max_batch=4)
+    pipeline.add_stage("collect", results.extend, max_batch=3)
+    pipeline.start()
+    for item in range(50):
+        pipeline.put(item)
+    pipeline.finish()
+    assert results == [item * 2 + 1 for item in range(50)]
+    assert [stage.items for stage in pipeline.stages] == [50, 50, 50]
+
+# A stage never takes more than "max_batch" items at once
+def test_batches_are_bounded():
+    sizes = []
+    pipeline = Pipeline(queue_size=16)
+    pipeline.add_stage("collect", lambda batch: sizes.append(len(batch)), max_batch=3)
+    pipeline.start()
+    for item in range(20):
+        pipeline.put(item)
+    pipeline.finish()
+    assert sum(sizes) == 20
+    assert max(sizes) <= 3
+
+# A failing batch is reported and the rest still get through
+def test_failure_does_not_stall():
+    def fail_on_three(batch):
+        for item in batch:
+            if item == 3:
+                raise ValueError("bad item")
+            yield item
+
+    results = []
+    pipeline = Pipeline(queue_size=2)
+    pipeline.add_stage("check", fail_on_three)
+    pipeline.add_stage("collect", results.extend)
+    pipeline.start()
+    for item in range(6):
+        pipeline.put(item)
+    pipeline.finish()
+    assert results == [0, 1, 2, 4, 5]
+
+# Cancelling stops the stages without working through what is still queued
+def test_cancel_drops_queued_items():
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow(batch):
+        started.set()
+        release.wait(5)
+        return batch
+
+    results = []
+    pipeline = Pipeline(queue_size=8)
+    pipeline.add_stage("slow", slow)
+    pipeline.add_stage("collect", results.extend)
+    pipeline.start()
+    for item in range(5):
+        pipeline.put(item)
+    assert started.wait(5)
+
+    canceller = threading.Thread(target=pipeline.cancel)
+    canceller.start()
+    pipeline._cancelled.wait(5)
+    release.set()
+    canceller.join(5)
+    assert not canceller.is_alive()
+    assert pipeline.stages[0].items == 1
+    assert results == []
@@ -0,0 +1,114 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Tests of the cache of LLM answers to queries
+
+import configparser
+from retainium import query_cache
+from retainium.knowledge import KnowledgeDB
+from retainium.llm import LLMHandler, LLMStream, ANSWER_TERMINATOR
+from retainium.query_cache import QueryCache, compute_query_key
+from retainium.query_knowledge import answer, search
+
+SETTINGS = {"model_path": "model.gguf", "temperature": 0.7}
+
+class CountingLLMHandler(LLMHandler):
+    """Answers every query with the number of answers generated so far,
+    output like llama-cli's, without any model; the answers are cut short
+    (no terminator) when "complete" is unset."""
+
+    def __init__(self, tmp_path):
+        config = configparser.ConfigParser()
+        config["llm"] = {"tokenize_path": str(tmp_path / "no-llama-tokenize")}
+        super().__init__(config)
+        self.answers = 0
+        self.complete = True        # Whether answers end with the terminator
+
+    def generate_stream(self, prompt: str, max_tokens: int = None, json_schema: dict = None) -> LLMStream:
+        self.answers += 1
+        output = [prompt, f" answer {self.answers}"]
+        if self.complete:
+            output.append(" " + ANSWER_TERMINATOR)
+        return LLMStream(chunk for chunk in output)
+
+def test_key_ignores_case_spacing_and_punctuation():
+    key = compute_query_key("What is  RAG?", 5, ["a", "b"], SETTINGS)
+    assert compute_query_key("what is rag", 5, ["a", "b"], SETTINGS) == key
+    assert compute_query_key(" What is RAG ?! ", 5, ["a", "b"], SETTINGS) == key
+
+def test_key_depends_on_everything_shaping_the_answer():
+    key = compute_query_key("what is rag", 5, ["a", "b"], SETTINGS)
+    assert compute_query_key("what is a rag", 5, ["a", "b"], SETTINGS) != key
+    assert compute_query_key("what is rag", 3, ["a", "b"], SETTINGS) != key
+    assert compute_query_key("what is rag", 5, ["b", "a"], SETTINGS) != key
+    assert compute_query_key("what is rag", 5, ["a", "b"], dict(SETTINGS, temperature=0.2)) != key
+
+def test_lookup_and_store(tmp_path):
+    cache = QueryCache(str(tmp_path / "cache.db"))
+    assert cache.lookup("key", min_generation=0) is None
+    cache.store("key", "the answer", generation=3)
+    assert cache.lookup("key", min_generation=3) == "the answer"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+# Answers older than the entries they were built from are discarded
+def test_stale_answer_is_dropped(tmp_path):
+    cache = QueryCache(str(tmp_path / "cache.db"))
+    cache.store("key", "the answer", generation=3)
+    assert cache.lookup("key", min_generation=4) is None
+    assert cache.lookup("key", min_generation=0) is None
+    assert cache.misses == 2
+
+def test_answers_persist(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = QueryCache(path)
+    cache.store("key", "the answer", generation=1)
+    cache.close()
+    assert QueryCache(path).lookup("key", min_generation=1) == "the answer"
+
+# The least recently used answers are evicted first
+def test_eviction(tmp_path, monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr(query_cache.time, "time", lambda: next(clock))
+    cache = QueryCache(str(tmp_path / "cache.db"), max_entries=2)
+    cache.store("a", "A", generation=0)
+    cache.store("b", "B", generation=0)
+    assert cache.lookup("a", min_generation=0) == "A"
+    cache.store("c", "C", generation=0)
+    assert cache.lookup("b", min_generation=0) is None
+    assert cache.lookup("a", min_generation=0) == "A"
+    assert cache.lookup("c", min_generation=0) == "C"
+
+def test_purge(tmp_path):
+    cache = QueryCache(str(tmp_path / "cache.db"))
+    cache.store("a", "A", generation=0)
+    cache.store("b", "B", generation=0)
+    assert cache.purge() == 2
+    assert cache.lookup("a", min_generation=0) is None
+
+# Repeated queries are answered from the cache until one of the entries
+# they were answered from is written again
+def test_answer_uses_cache(tmp_path, embedding_handler, llm_handler):
+    db = KnowledgeDB(str(tmp_path / "db"), backend="numpy")
+    db.add_entries(["the sky is blue", "grass is green"], ["a", "b"], embedding_handler, llm_handler,
+                   tags=[["sky"], ["grass"]])
+    llm = CountingLLMHandler(tmp_path)
+    cache = QueryCache(str(tmp_path / "cache.db"))
+
+    def ask(question):
+        results, generation = search(question, 1, db, embedding_handler)
+        return answer(question, 1, results, generation, llm, cache=cache)
+
+    assert ask("What colour is the sky?") == "answer 1"
+    assert ask("what colour is the sky") == "answer 1"
+    assert llm.answers == 1
+
+    # Rewriting the entries invalidates the cached answer
+    db.rebuild(embedding_handler, llm_handler, re_tag=True)
+    assert ask("What colour is the sky?") == "answer 2"
+    assert ask("What colour is the sky?") == "answer 2"
+
+    # Only complete answers are cached
+    llm.complete = False
+    assert ask("Why is the sky blue?") == "answer 3"
+    assert ask("Why is the sky blue?") == "answer 4"
+    assert llm.answers == 4
@@ -0,0 +1,146 @@
+# Copyright (C) 2024-2025 Soumitra Chatterjee
+# Licensed under the GNU AGPL-3.0. See LICENSE file for details.
+
+# Tests of the NumPy vector store, and of rebuilding the database on it
+
+import os
+import pytest
+from retainium.knowledge import KnowledgeDB
+from retainium.vector_store import NumpyStore, MATRIX_FILE_NAME, NUMPY_STORE_DIR_NAME
+
+def make_store(tmp_path, vectors) -> NumpyStore:
+    store = NumpyStore(str(tmp_path / NUMPY_STORE_DIR_NAME))
+    store.add(list(vectors), [f"document {id}" for id in vectors], list(vectors.values()),
+              [{"source": "even" if n % 2 == 0 else "odd", "n": n} for n in range(len(vectors))])
+    return store
+
+VECTORS = {"a": [0.0, 0.0], "b": [1.0, 0.0], "c": [0.0, 2.0], "d": [3.0, 3.0]}
+
+def test_add_get_count(tmp_path):
+    store = make_store(tmp_path, VECTORS)
+    assert store.count() == 4
+    assert store.count({"source": "odd"}) == 2
+
+    found = store.get(["c", "a", "missing"], include=("documents", "metadatas", "embeddings"))
+    assert found["ids"] == ["a", "c"]
+    assert found["documents"] == ["document a", "document c"]
+    assert found["metadatas"] == [{"source": "even", "n": 0}, {"source": "even", "n": 2}]
+    assert [list(vector) for vector in found["embeddings"]] == [[0.0, 0.0], [0.0, 2.0]]
+
+    assert store.get()["ids"] == ["a", "b", "c", "d"]
+    assert store.get(limit=2, offset=1)["ids"] == ["b", "c"]
+    assert store.get(where={"n": {"$gte": 2}})["ids"] == ["c", "d"]
+    assert store.get(where={"$or": [{"n": 0}, {"source": {"$in": ["odd"]}}]})["ids"] == ["a", "b", "d"]
+
+# Existing ids are left as they are
+def test_add_ignores_existing_ids(tmp_path):
+    store = make_store(tmp_path, VECTORS)
+    store.add(["a", "e"], ["changed", "document e"], [[9.0, 9.0], [5.0, 5.0]], [{}, {}])
+    assert store.count() == 5
+    assert store.get(["a"], include=("documents",))["documents"] == ["document a"]
+
+def test_add_rejects_other_dimensions(tmp_path):
+    store = make_store(tmp_path, VECTORS)
+    with pytest.raises(ValueError):
+        store.add(["e"], ["document e"], [[1.0, 2.0, 3.0]], [{}])
+    assert store.count() == 4
+
+def test_update(tmp_path):
+    store = make_store(tmp_path, VECTORS)
+    store.update(["b"], [{"source": "updated"}])
+    assert store.get(["b"], include=("metadatas",))["metadatas"] == [{"source": "updated"}]
+    assert store.count({"source": "updated"}) == 1
+
+# Matches are ranked by squared Euclidean distance
+def test_query(tmp_path):
+    store = make_store(tmp_path, VECTORS)
+    results = store.query([[0.9, 0.1], [3.0, 2.0]], top_k=2)
+    assert results["ids"] == [["b", "a"], ["d", "b"]]
+    assert results["distances"][0] == pytest.approx([0.02, 0.82])
+    assert results["distances"][1] == pytest.approx([1.0, 8.0])
+    assert results["documents"][0] == ["document b", "document a"]
+    assert results["metadatas"][1][0] == {"source": "odd", "n": 3}
+
+    assert store.query([[0.9, 0.1]], top_k=10)["ids"] == [["b", "a", "c", "d"]]
+    assert store.query([[0.9, 0.1]], top_k=2, where={"source": "even"})["ids"] == [["a", "c"]]
+    assert store.query([[0.9, 0.1]], top_k=2, where={"source": "none"})["ids"] == [[]]
+
+# Deleting moves the last row into the gap, and the matrix file never shrinks
+def test_delete(tmp_path):
+    store = make_store(tmp_path, VECTORS)
+    matrix = os.path.join(store.path, MATRIX_FILE_NAME)
+    size = os.path.getsize(matrix)
+
+    store.delete(["a", "missing"])
+    assert store.count() == 3
+    assert store.query([[0.0, 0.0]], top_k=3)["ids"] == [["b", "c", "d"]]
+    assert [list(vector) for vector in store.get(["d"], include=("embeddings",))["embeddings"]] == [[3.0, 3.0]]
+
+    store.delete(["b", "c", "d"])
+    assert store.count() == 0
+    assert store.query([[0.0, 0.0]], top_k=3)["ids"] == [[]]
+    assert os.path.getsize(matrix) == size
+
+    # Freed rows are reused
+    store.add(["e"], ["document e"], [[1.0, 1.0]], [{}])
+    assert store.query([[0.0, 0.0]], top_k=3)["ids"] == [["e"]]
+    assert os.path.getsize(matrix) == size
+
+def test_reopen(tmp_path):
+    make_store(tmp_path, VECTORS).close()
+    store = NumpyStore(str(tmp_path / NUMPY_STORE_DIR_NAME))
+    assert store.count() == 4
+    assert store.query([[3.0, 2.9]], top_k=1)["ids"] == [["d"]]
+
+# Writes through one handle are seen by another
+def test_shared_store(tmp_path):
+    store = make_store(tmp_path, VECTORS)
+    other = NumpyStore(store.path)
+    store.add(["e"], ["document e"], [[9.0, 9.0]], [{}])
+    store.delete(["a"])
+    assert other.count() == 4
+    assert other.query([[9.0, 9.0]], top_k=1)["ids"] == [["e"]]
+
+# A staged rebuild replaces the store, for every handle on it, once swapped in
+def test_staging_swap_in(tmp_path):
+    store = make_store(tmp_path, VECTORS)
+    other = NumpyStore(store.path)
+    staging = store.create_staging()
+    staging.add(["x", "y"], ["document x", "document y"], [[1.0, 1.0], [2.0, 2.0]], [{}, {}])
+    assert store.count() == 4
+
+    store.swap_in(staging)
+    assert store.get()["ids"] == ["x", "y"]
+    assert other.get()["ids"] == ["x", "y"]
+    assert other.query([[2.0, 2.1]], top_k=1)["ids"] == [["y"]]
+    assert not os.path.exists(staging.path)
+
+def test_staging_discard(tmp_path):
+    store = make_store(tmp_path, VECTORS)
+    staging = store.create_staging()
+    staging.add(["x"], ["document x"], [[1.0, 1.0]], [{}])
+    store.discard_staging(staging)
+    assert not os.path.exists(staging.path)
+    assert store.get()["ids"] == ["a", "b", "c", "d"]
+
+# Rebuilding the database keeps every entry, re-embedded or not
+def test_rebuild(tmp_path, embedding_handler, llm_handler):
+    texts = ["the sky is blue", "grass is green", "snow is white"]
+    db = KnowledgeDB(str(tmp_path / "db"), backend="numpy")
+    db.add_entries(texts, ["notes"] * 3, embedding_handler, llm_handler,
+                   embeddings=[[1.0] * 6] * 3, tags=[["sky"], ["grass"], ["snow"]])
+
+    assert db.rebuild(embedding_handler, llm_handler) == 3
+    assert sorted(entry.text for entry in db.list_entries()) == sorted(texts)
+    assert [entry.text for entry in db.keyword_query("grass")] == ["grass is green"]
+
+    # Re-embedding replaces the stored vectors
+    assert db.rebuild(embedding_handler, llm_handler, re_embed=True) == 3
+    sky = db.query_entry(embedding_handler.embed("the sky is blue"), top_k=1)
+    assert [entry.text for entry in sky] == ["the sky is blue"]
+
+    # Re-tagging regenerates the tags, and the keyword index with them
+    assert db.rebuild(embedding_handler, llm_handler, re_tag=True) == 3
+    assert {tuple(entry.tags) for entry in db.list_entries()} == {("the", "sky"), ("grass", "is"),
+                                                                  ("snow", "is")}
+    assert [entry.text for entry in db.keyword_query("grass")] == ["grass is green"]